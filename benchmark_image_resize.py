@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+benchmark_image_resize.py - Compare full-resolution and reduced-resolution image downscaling.
+
+Runs upload_landmark_images.process_image on each image twice, with and without
+fast_downscale (JPEG draft decoding plus a box pre-reduction before LANCZOS), each in a
+fresh process, and reports the median time, peak memory and how close the fast output is
+to the full-resolution output (PSNR; above ~40 dB the difference isn't visible).
+
+Usage:
+    python benchmark_image_resize.py [image_files...] [--runs N] [--max-size PX]
+
+Example:
+    python benchmark_image_resize.py
+    python benchmark_image_resize.py big_original.jpg huge_scan.png --runs 5
+
+Without image files a synthetic 6000x4000 JPEG (24 MP, a typical Commons original) is used.
+"""
+
+import argparse
+import io
+import math
+import multiprocessing
+import resource
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+import logging
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+from upload_landmark_images import process_image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def synthetic_photo(width: int = 6000, height: int = 4000) -> bytes:
+    """A photo-like JPEG with fine detail, smooth gradients and sensor-like noise."""
+    detail = Image.effect_mandelbrot((width, height), (-2.0, -1.2, 1.0, 1.2), 256)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 24).filter(ImageFilter.GaussianBlur(1))
+    photo = Image.merge('RGB', (detail, gradient, ImageChops.add(gradient.rotate(90, expand=False), noise, 2.0)))
+    
+    output_buffer = io.BytesIO()
+    photo.save(output_buffer, format='JPEG', quality=92)
+    return output_buffer.getvalue()
+
+def _reset_peak_memory() -> None:
+    """Reset the peak resident set size to the current one (Linux only)."""
+    try:
+        Path('/proc/self/clear_refs').write_text('5')
+    except OSError:
+        pass
+
+def _peak_memory_bytes() -> int:
+    """Peak resident set size of this process."""
+    try:
+        for line in Path('/proc/self/status').read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS, where this overstates memory 1024x)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run_mode(image_data: bytes, fast_downscale: bool, runs: int, max_size: int) -> Dict:
+    """Time process_image in this (fresh) process and measure its peak memory above the baseline."""
+    logging.getLogger('upload_landmark_images').setLevel(logging.WARNING)
+    timings = []
+    peak_memory = 0
+    for _ in range(runs):
+        _reset_peak_memory()
+        baseline = _peak_memory_bytes()
+        start = time.perf_counter()
+        result = process_image(image_data, max_size=max_size, fast_downscale=fast_downscale)
+        timings.append(time.perf_counter() - start)
+        peak_memory = max(peak_memory, _peak_memory_bytes() - baseline)
+        del result['data']  # Don't count the previous output against the next run
+    
+    return {
+        'seconds': statistics.median(timings),
+        'peak_memory': peak_memory,
+        'data': process_image(image_data, max_size=max_size, fast_downscale=fast_downscale)['data'],
+        'width': result['width'],
+        'height': result['height']
+    }
+
+def psnr(first: bytes, second: bytes) -> float:
+    """Peak signal-to-noise ratio in dB between two encoded images of the same size."""
+    with Image.open(io.BytesIO(first)) as a, Image.open(io.BytesIO(second)) as b:
+        difference = ImageChops.difference(a.convert('RGB'), b.convert('RGB'))
+    mse = statistics.mean(rms ** 2 for rms in ImageStat.Stat(difference).rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def benchmark(name: str, image_data: bytes, runs: int, max_size: int) -> None:
+    """Benchmark one image in both modes and print a comparison."""
+    with Image.open(io.BytesIO(image_data)) as img:
+        logger.info(f"{name}: {img.width}x{img.height} {img.format}, {len(image_data)} bytes")
+    
+    results = {}
+    for fast_downscale in (False, True):
+        # A fresh process per mode, so peak memory isn't shared between them
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results[fast_downscale] = pool.submit(run_mode, image_data, fast_downscale, runs, max_size).result()
+    
+    full, fast = results[False], results[True]
+    print(f"\n{name} -> {fast['width']}x{fast['height']}")
+    print(f"  full decode:  {full['seconds'] * 1000:8.0f} ms  peak +{full['peak_memory'] / 2 ** 20:6.0f} MB")
+    print(f"  fast path:    {fast['seconds'] * 1000:8.0f} ms  peak +{fast['peak_memory'] / 2 ** 20:6.0f} MB")
+    print(f"  speedup:      {full['seconds'] / fast['seconds']:8.1f}x")
+    print(f"  PSNR vs full: {psnr(full['data'], fast['data']):8.1f} dB")
+
+def main():
+    """Run the benchmark on the given images or a synthetic one."""
+    parser = argparse.ArgumentParser(description="Benchmark full vs reduced-resolution image downscaling.")
+    parser.add_argument('image_files', nargs='*', help="Images to benchmark (default: a synthetic 24 MP JPEG)")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per mode; the median is reported (default: 3)")
+    parser.add_argument('--max-size', type=int, default=2048, help="Target maximum width/height (default: 2048)")
+    args = parser.parse_args()
+    
+    images: List = [(path, Path(path).read_bytes()) for path in args.image_files]
+    if not images:
+        images = [('synthetic 6000x4000 JPEG', synthetic_photo())]
+    
+    for name, image_data in images:
+        benchmark(name, image_data, args.runs, args.max_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+commons_geo_index.py - Offline spatial index of geotagged Wikimedia Commons files.
+
+Builds a compact binary index from the Commons `geo_tags` and `page` SQL dumps
+(https://dumps.wikimedia.org/commonswiki/latest/commonswiki-latest-geo_tags.sql.gz and
+commonswiki-latest-page.sql.gz) holding the page ID, camera location and title of every
+file with a primary (camera) coordinate. find_photo.py memory-maps the index to answer
+geosearch and "has camera location" checks from disk instead of the Commons API.
+
+Usage:
+    python commons_geo_index.py build [geo_tags_dump] [page_dump] [index_file]
+    python commons_geo_index.py [index_file] nearby [lat] [lon] [radius_m]
+    python commons_geo_index.py [index_file] lookup [file_title]
+
+Example:
+    python commons_geo_index.py build commonswiki-latest-geo_tags.sql.gz commonswiki-latest-page.sql.gz
+    python commons_geo_index.py nearby 48.8584 2.2945 500
+    python commons_geo_index.py lookup "File:Tour Eiffel Wikimedia Commons.jpg"
+
+Building keeps the geotagged files (not the whole page table) in memory, roughly 100 bytes
+per file; the index itself takes 16 bytes per file plus its titles.
+"""
+
+import gzip
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_GEO_INDEX_FILE = "public_images/commons_geo_index.bin"
+
+# File layout (little-endian):
+#   header | band table: first record of each latitude band (+ end) | records sorted by (band, lon)
+#   | titles: uint16 length + UTF-8 dump title per record | title index: record numbers sorted by title
+INDEX_MAGIC = b'CGEOIDX1'
+HEADER = struct.Struct('<8sIIdQQ')  # magic, record count, band count, band height, titles offset, title index offset
+RECORD = struct.Struct('<IffI')  # page ID, lat, lon, offset of the title in the titles section
+UINT32 = struct.Struct('<I')
+BAND_RANGE = struct.Struct('<II')
+TITLE_LENGTH = struct.Struct('<H')
+BAND_DEGREES = 0.1  # About 11 km, so a typical geosearch radius touches one or two bands
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+CREATE_COLUMN_PATTERN = re.compile(r'\s+`(\w+)`\s')
+ROW_PATTERN = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+FIELD_PATTERN = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)")
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+MYSQL_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+def iter_dump_rows(dump_file: str, columns: Sequence[str]) -> Iterator[Tuple[Optional[str], ...]]:
+    """Yield the given columns of every row in a MySQL table dump (.sql or .sql.gz).
+    
+    Column positions are read from the dump's CREATE TABLE statement, so dumps from
+    different MediaWiki versions work. Values are strings, or None for NULL.
+    """
+    opener = gzip.open if dump_file.endswith('.gz') else open
+    table_columns: List[str] = []
+    positions = None
+    
+    with opener(dump_file, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.startswith('INSERT INTO'):
+                if positions is None:
+                    column = CREATE_COLUMN_PATTERN.match(line)
+                    if column:
+                        table_columns.append(column.group(1))
+                continue
+            
+            if positions is None:
+                missing = [column for column in columns if column not in table_columns]
+                if missing:
+                    raise ValueError(f"{dump_file} has no column(s) {', '.join(missing)}")
+                positions = [table_columns.index(column) for column in columns]
+            
+            for row in ROW_PATTERN.finditer(line, line.index(' VALUES ')):
+                fields = [
+                    (None if bare == 'NULL' else bare) if bare else _unescape(quoted)
+                    for quoted, bare in FIELD_PATTERN.findall(row.group(1))
+                ]
+                yield tuple(fields[position] for position in positions)
+
+def _unescape(value: str) -> str:
+    return ESCAPE_PATTERN.sub(lambda m: MYSQL_ESCAPES.get(m.group(1), m.group(1)), value)
+
+def dump_title(file_title: str) -> str:
+    """Title as stored in the page dump: no namespace prefix and underscores for spaces."""
+    if file_title.startswith('File:'):
+        file_title = file_title[len('File:'):]
+    return file_title.replace(' ', '_')
+
+def commons_file_url(file_title: str) -> str:
+    """URL of the original file on upload.wikimedia.org, derived from its title."""
+    name = dump_title(file_title)
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return f"https://upload.wikimedia.org/wikipedia/commons/{digest[0]}/{digest[:2]}/{quote(name)}"
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def _band(lat: float, band_count: int) -> int:
+    return min(band_count - 1, max(0, int((lat + 90) / BAND_DEGREES)))
+
+def build_geo_index(geo_tags_dump: str, page_dump: str, index_file: str = DEFAULT_GEO_INDEX_FILE) -> int:
+    """Build the index from the geo_tags and page dumps. Returns the number of files indexed."""
+    # Camera locations are the primary coordinates of file pages
+    page_ids = array('I')
+    lats = array('f')
+    lons = array('f')
+    for page_id, globe, primary, lat, lon in iter_dump_rows(
+        geo_tags_dump, ('gt_page_id', 'gt_globe', 'gt_primary', 'gt_lat', 'gt_lon')
+    ):
+        if primary != '1' or (globe or 'earth') != 'earth' or lat is None or lon is None:
+            continue
+        page_ids.append(int(page_id))
+        lats.append(float(lat))
+        lons.append(float(lon))
+    logger.info(f"Read {len(page_ids)} primary coordinates from {geo_tags_dump}")
+    
+    # Sort by page ID so the page dump can be joined with binary searches
+    order = sorted(range(len(page_ids)), key=page_ids.__getitem__)
+    page_ids = array('I', (page_ids[i] for i in order))
+    lats = array('f', (lats[i] for i in order))
+    lons = array('f', (lons[i] for i in order))
+    del order
+    
+    titles: List[Optional[bytes]] = [None] * len(page_ids)
+    for page_id, namespace, title in iter_dump_rows(page_dump, ('page_id', 'page_namespace', 'page_title')):
+        if namespace != '6':
+            continue
+        position = bisect_left(page_ids, int(page_id))
+        if position < len(page_ids) and page_ids[position] == int(page_id):
+            titles[position] = title.encode('utf-8')
+    
+    # Pages missing from the page dump were deleted since the coordinates were recorded
+    band_count = int(round(180 / BAND_DEGREES))
+    records = sorted(
+        (i for i in range(len(page_ids)) if titles[i] is not None),
+        key=lambda i: (_band(lats[i], band_count), lons[i])
+    )
+    
+    band_starts = [0] * (band_count + 1)
+    for i in records:
+        band_starts[_band(lats[i], band_count) + 1] += 1
+    for band in range(band_count):
+        band_starts[band + 1] += band_starts[band]
+    
+    records_offset = HEADER.size + UINT32.size * (band_count + 1)
+    titles_offset = records_offset + RECORD.size * len(records)
+    title_offset = 0
+    
+    temp_file = f"{index_file}.tmp"
+    with open(temp_file, 'wb') as f:
+        f.seek(records_offset)
+        for i in records:
+            f.write(RECORD.pack(page_ids[i], lats[i], lons[i], title_offset))
+            title_offset += TITLE_LENGTH.size + len(titles[i])
+        for i in records:
+            f.write(TITLE_LENGTH.pack(len(titles[i])) + titles[i])
+        
+        title_index_offset = titles_offset + title_offset
+        for record in sorted(range(len(records)), key=lambda record: titles[records[record]]):
+            f.write(UINT32.pack(record))
+        
+        f.seek(0)
+        f.write(HEADER.pack(INDEX_MAGIC, len(records), band_count, BAND_DEGREES, titles_offset, title_index_offset))
+        f.write(b''.join(UINT32.pack(start) for start in band_starts))
+    
+    # Replace atomically so a running search never maps a half-written index
+    os.replace(temp_file, index_file)
+    logger.info(f"Indexed {len(records)} geotagged files into {index_file}")
+    return len(records)
+
+class CommonsGeoIndex:
+    """Read-only, memory-mapped index of the camera locations of Commons files."""
+    
+    def __init__(self, index_file: str = DEFAULT_GEO_INDEX_FILE):
+        self.index_file = index_file
+        with open(index_file, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        magic, self.count, self.band_count, self.band_degrees, self.titles_offset, self.title_index_offset = \
+            HEADER.unpack_from(self._map, 0)
+        if magic != INDEX_MAGIC:
+            self._map.close()
+            raise ValueError(f"{index_file} is not a Commons geotag index")
+        self.records_offset = HEADER.size + UINT32.size * (self.band_count + 1)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __contains__(self, file_title: str) -> bool:
+        return self.location_of(file_title) is not None
+    
+    def _record(self, record: int) -> Tuple[int, float, float, int]:
+        page_id, lat, lon, title_offset = RECORD.unpack_from(self._map, self.records_offset + RECORD.size * record)
+        # Coordinates are stored as float32; six decimals is all the precision they carry
+        return page_id, round(lat, 6), round(lon, 6), title_offset
+    
+    def _title_bytes(self, title_offset: int) -> bytes:
+        start = self.titles_offset + title_offset
+        (length,) = TITLE_LENGTH.unpack_from(self._map, start)
+        return self._map[start + TITLE_LENGTH.size:start + TITLE_LENGTH.size + length]
+    
+    def _file_title(self, title_offset: int) -> str:
+        return 'File:' + self._title_bytes(title_offset).decode('utf-8').replace('_', ' ')
+    
+    def location_of(self, file_title: str) -> Optional[Tuple[float, float]]:
+        """Camera location (lat, lon) of a file, or None if it has none."""
+        wanted = dump_title(file_title).encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            (record,) = UINT32.unpack_from(self._map, self.title_index_offset + UINT32.size * middle)
+            _, lat, lon, title_offset = self._record(record)
+            title = self._title_bytes(title_offset)
+            if title == wanted:
+                return lat, lon
+            if title < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+    
+    def _first_record_at_lon(self, start: int, end: int, lon: float) -> int:
+        """First record in [start, end) of one band whose longitude is at least lon."""
+        while start < end:
+            middle = (start + end) // 2
+            if self._record(middle)[2] < lon:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+    
+    def nearby(self, lat: float, lon: float, radius: float, limit: int = 10) -> List[Dict]:
+        """Files within radius meters of a point, nearest first, shaped like list=geosearch results."""
+        lat_delta = radius / METERS_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(89.9, abs(lat) + lat_delta)))
+        lon_delta = min(180.0, lat_delta / cos_lat)
+        
+        # Longitude ranges, split where the search area crosses the antimeridian
+        lon_ranges = [(max(-180.0, lon - lon_delta), min(180.0, lon + lon_delta))]
+        if lon - lon_delta < -180:
+            lon_ranges.append((lon - lon_delta + 360, 180.0))
+        if lon + lon_delta > 180:
+            lon_ranges.append((-180.0, lon + lon_delta - 360))
+        
+        matches = []
+        for band in range(_band(lat - lat_delta, self.band_count), _band(lat + lat_delta, self.band_count) + 1):
+            band_start, band_end = BAND_RANGE.unpack_from(self._map, HEADER.size + UINT32.size * band)
+            for lon_min, lon_max in lon_ranges:
+                record = self._first_record_at_lon(band_start, band_end, lon_min)
+                while record < band_end:
+                    page_id, record_lat, record_lon, title_offset = self._record(record)
+                    if record_lon > lon_max:
+                        break
+                    dist = distance_m(lat, lon, record_lat, record_lon)
+                    if dist <= radius:
+                        matches.append((dist, page_id, record_lat, record_lon, title_offset))
+                    record += 1
+        
+        matches.sort()
+        return [{
+            'pageid': page_id,
+            'ns': 6,
+            'title': self._file_title(title_offset),
+            'lat': record_lat,
+            'lon': record_lon,
+            'dist': round(dist, 1),
+            'primary': ''
+        } for dist, page_id, record_lat, record_lon, title_offset in matches[:limit]]
+    
+    def close(self) -> None:
+        self._map.close()
+
+def main():
+    """Build or query a geotag index from the command line."""
+    args = sys.argv[1:]
+    if args and args[0] == 'build' and len(args) >= 3:
+        build_geo_index(args[1], args[2], args[3] if len(args) > 3 else DEFAULT_GEO_INDEX_FILE)
+        return
+    
+    index_file = DEFAULT_GEO_INDEX_FILE
+    if args and args[0] not in ('nearby', 'lookup'):
+        index_file = args.pop(0)
+    
+    if len(args) >= 3 and args[0] == 'nearby':
+        index = CommonsGeoIndex(index_file)
+        radius = float(args[3]) if len(args) > 3 else 2000
+        for result in index.nearby(float(args[1]), float(args[2]), radius, limit=50):
+            print(f"{result['dist']:>8.1f} m  {result['lat']:.5f}, {result['lon']:.5f}  {result['title']}")
+        index.close()
+    elif len(args) >= 2 and args[0] == 'lookup':
+        index = CommonsGeoIndex(index_file)
+        location = index.location_of(args[1])
+        print(f"{location[0]:.5f}, {location[1]:.5f}" if location else "No camera location")
+        index.close()
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -51,6 +51,10 @@ fi
 
 echo "✅ Wrangler CLI found and authenticated"
 
+# Apply pending D1 migrations before the new code starts using them
+echo "🗄️  Applying D1 migrations..."
+wrangler d1 migrations apply whereami-db --remote
+
 # Build the SvelteKit application
 echo "📦 Building SvelteKit application..."
 npm run build
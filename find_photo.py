@@ -6,139 +6,576 @@ This script reads landmarks from landmarks.txt and searches Wikimedia Commons fo
 that have GPS/camera location data embedded. It uses async requests for efficient processing.
 
 Usage:
-    python find_photo.py [landmarks_file]
+    python find_photo.py [landmarks_file] [options]
 
 Example:
     python find_photo.py public_images/landmarks.txt
+    python find_photo.py public_images/landmarks.txt --cache
+    python find_photo.py public_images/landmarks.txt --race --landmark-timeout 60 --max-requests-per-landmark 30
+    python find_photo.py public_images/landmarks.txt --processes 4
+    python find_photo.py public_images/landmarks.txt --shard 0/2   # on host A
+    python find_photo.py public_images/landmarks.txt --shard 1/2   # on host B
+    python find_photo.py --merge
+    python find_photo.py public_images/landmarks.txt --cache --geo-index --offline
+
+Options:
+    --cache [cache_file]  Cache Commons API responses on disk (SQLite) so re-runs only
+                          pay for queries that changed (default: public_images/commons_api_cache.sqlite)
+    --cache-max-mb N      Evict least recently used responses beyond this size (default: 512)
+    --retry-misses        Also search landmarks that came up empty recently; by default they are
+                          retried with exponential backoff or when their search variations change
+    --race                Run the search strategies (and their variations) concurrently; the
+                          first result in preference order wins and the rest are cancelled
+    --landmark-timeout S  Time budget per landmark in seconds
+    --max-requests-per-landmark N
+                          Cap on Commons API requests per landmark
+    --concurrent-landmarks N
+                          Landmarks searched at the same time (default: 5)
+    --rate R              Maximum Commons API requests per second (default: 10); the request
+                          concurrency adapts to throttling (429/503/maxlag) and honors Retry-After
+    --max-api-concurrency N
+                          Upper bound for concurrent API requests (default: 16)
+    --shard I/N           Only search shard I (zero-based) of N, writing
+                          public_images/landmark_images.shard-I-of-N.json; run shards on
+                          several machines and combine them with --merge
+    --processes N         Search N shards in parallel local processes (the --rate budget is
+                          split between them) and merge the results
+    --store [store_file]  Keep results in an indexed SQLite store with transactional upserts
+                          (default: public_images/landmark_images.db, created from
+                          landmark_images.json on first use); landmark_images.json is exported
+                          from it at the end of the run. See landmark_store.py for queries.
+    --geo-index [index_file]
+                          Answer coordinate searches and "has camera location" checks from a
+                          memory-mapped index of the Commons geotag dump built with
+                          commons_geo_index.py (default: public_images/commons_geo_index.bin)
+    --offline             Never call the Commons API: search only with cached responses and the
+                          geotag index, so large re-runs work entirely from disk
+    --merge [files]       Merge shard outputs into landmark_images.json, de-duplicating by
+                          landmark and file title (default: every shard file in public_images/)
+
+Requirements:
+    pip install aiohttp
 """
 
+import argparse
 import asyncio
 import aiohttp
+import functools
+import hashlib
 import json
+import multiprocessing
+import os
+import random
 import re
+import sqlite3
 import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Awaitable, Callable, Container, Iterable, Iterator, List, Dict, Optional, Tuple
 from urllib.parse import quote_plus
 import logging
 
+from commons_geo_index import DEFAULT_GEO_INDEX_FILE, CommonsGeoIndex, commons_file_url
+from landmark_store import DEFAULT_STORE_FILE, LandmarkResultsStore
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_OUTPUT_FILE = "public_images/landmark_images.json"
+DEFAULT_CACHE_FILE = "public_images/commons_api_cache.sqlite"
+DEFAULT_MISSES_FILE = "public_images/landmark_misses.jsonl"
+
+# Bump when the search strategies change in a way that could find images they missed before
+QUERY_PLAN_VERSION = 1
+
+# Longest side of the thumbnails recorded with each result; upload_landmark_images.py uploads
+# images at most this large, so it can download the thumbnail instead of the original
+THUMBNAIL_SIZE = 2048
+
+class CommonsResponseCache:
+    """Persistent SQLite cache of Commons API responses keyed by normalized query parameters."""
+    
+    # Time-to-live per query type in seconds; search results drift faster than file metadata
+    DEFAULT_TTLS = {
+        'search': 7 * 24 * 3600,
+        'categorymembers': 7 * 24 * 3600,
+        'geosearch': 30 * 24 * 3600,
+        'imageinfo': 30 * 24 * 3600,
+        'other': 7 * 24 * 3600
+    }
+    
+    # LRU order only needs to be roughly right, so recent accesses aren't rewritten and the rest are
+    # written in batches instead of committing on every hit
+    ACCESS_RESOLUTION = 3600
+    ACCESS_FLUSH_SIZE = 500
+    
+    def __init__(self, db_path: str = DEFAULT_CACHE_FILE, ttls: Optional[Dict[str, int]] = None,
+                 max_bytes: int = 512 * 1024 * 1024, max_entries: int = 200000):
+        self.db_path = db_path
+        self.ttls = {**self.DEFAULT_TTLS, **(ttls or {})}
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._pending_access: Dict[str, float] = {}
+        
+        # Shard processes may share one cache file, so wait for locks instead of failing
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                query_type TEXT NOT NULL,
+                params TEXT NOT NULL,
+                body TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+        self.conn.commit()
+        self._purge_expired()
+    
+    @staticmethod
+    def query_type(params: Dict) -> str:
+        """Classify a request so it gets the TTL of the data it returns."""
+        kind = params.get('generator') or params.get('list')
+        if kind in ('search', 'categorymembers', 'geosearch'):
+            return kind
+        if 'imageinfo' in str(params.get('prop', '')):
+            return 'imageinfo'
+        return 'other'
+    
+    @staticmethod
+    def normalize_params(params: Dict) -> str:
+        """Serialize params in a canonical form so equivalent queries share a key."""
+        return json.dumps({str(key): str(value).strip() for key, value in params.items()}, sort_keys=True, ensure_ascii=False)
+    
+    def _key(self, normalized: str) -> str:
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    
+    def get(self, params: Dict) -> Optional[Dict]:
+        """Return a cached response if present and not expired."""
+        key = self._key(self.normalize_params(params))
+        row = self.conn.execute(
+            'SELECT body, query_type, created_at, last_access FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+        
+        now = time.time()
+        if row is None:
+            self.misses += 1
+            return None
+        
+        body, query_type, created_at, last_access = row
+        if now - created_at > self.ttls.get(query_type, self.ttls['other']):
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.conn.commit()
+            self.expired += 1
+            self.misses += 1
+            return None
+        
+        if now - last_access > self.ACCESS_RESOLUTION:
+            self._pending_access[key] = now
+            if len(self._pending_access) >= self.ACCESS_FLUSH_SIZE:
+                self._flush_access_times()
+        self.hits += 1
+        return json.loads(body)
+    
+    def _flush_access_times(self) -> None:
+        """Write buffered last-access times in one transaction."""
+        if not self._pending_access:
+            return
+        self.conn.executemany(
+            'UPDATE responses SET last_access = ? WHERE key = ?',
+            [(accessed, key) for key, accessed in self._pending_access.items()]
+        )
+        self.conn.commit()
+        self._pending_access.clear()
+    
+    def put(self, params: Dict, data: Dict) -> None:
+        """Store a response and evict the least recently used entries if over budget."""
+        normalized = self.normalize_params(params)
+        body = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO responses (key, query_type, params, body, size, created_at, last_access) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self._key(normalized), self.query_type(params), normalized, body, len(body), now, now)
+        )
+        self.conn.commit()
+        self._evict_if_needed()
+    
+    def _purge_expired(self) -> None:
+        """Drop entries whose TTL has passed."""
+        now = time.time()
+        for query_type, ttl in self.ttls.items():
+            cursor = self.conn.execute(
+                'DELETE FROM responses WHERE query_type = ? AND created_at < ?',
+                (query_type, now - ttl)
+            )
+            self.expired += cursor.rowcount
+        self.conn.commit()
+    
+    def _evict_if_needed(self) -> None:
+        """Evict least recently used entries until both size limits are satisfied."""
+        count, total_bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        
+        # Eviction order depends on access times, so bring them up to date first
+        self._flush_access_times()
+        excess_entries = max(0, count - self.max_entries)
+        excess_bytes = max(0, total_bytes - self.max_bytes)
+        
+        keys_to_delete = []
+        freed_bytes = 0
+        for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY last_access'):
+            if len(keys_to_delete) >= excess_entries and freed_bytes >= excess_bytes:
+                break
+            keys_to_delete.append((key,))
+            freed_bytes += size
+        
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', keys_to_delete)
+        self.conn.commit()
+        self.evicted += len(keys_to_delete)
+        logger.debug(f"Evicted {len(keys_to_delete)} cached responses ({freed_bytes} bytes)")
+    
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters for this run."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evicted': self.evicted
+        }
+    
+    def close(self) -> None:
+        self._flush_access_times()
+        self.conn.close()
+
+class AdaptiveRateLimiter:
+    """Token bucket with an AIMD concurrency window, shared by all Commons API requests.
+    
+    Requests are admitted at no more than `rate` per second and while fewer than
+    `concurrency` are in flight. The window grows by one request per window of
+    successful responses and is halved when the API throttles us (429/503/maxlag),
+    and a Retry-After pause stops all requests until it has passed.
+    """
+    
+    def __init__(self, rate: float = 10.0, burst: int = 10, max_concurrency: int = 16,
+                 initial_concurrency: int = 4, min_concurrency: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(min(initial_concurrency, max_concurrency))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._waiters: List[asyncio.Future] = []
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self) -> None:
+        """Wait for a token and a free slot in the concurrency window."""
+        while True:
+            now = time.monotonic()
+            wait = None
+            if now < self.paused_until:
+                wait = self.paused_until - now
+            else:
+                self._refill(now)
+                if self.tokens >= 1:
+                    if self.in_flight < int(self.concurrency):
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            
+            # Without a timeout we are waiting for a slot, which release() signals
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+    
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None,
+                cancelled: bool = False) -> None:
+        """Return a slot and adjust the window based on how the request went.
+        
+        Synchronous, so it also runs to completion inside a task that is being cancelled.
+        A cancelled request only frees its slot: it says nothing about the API's capacity.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        
+        if cancelled:
+            pass
+        elif throttled:
+            self.throttled += 1
+            # Halve at most once per second so a burst of 429s counts as one congestion event
+            if now - self._last_decrease > 1.0:
+                self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+                self._last_decrease = now
+                logger.info(f"API throttling detected, reducing concurrency to {int(self.concurrency)}")
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+        
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+class RequestBudget:
+    """Number of API requests a single landmark search may still make."""
+    
+    def __init__(self, max_requests: int):
+        self.remaining = max_requests
+    
+    def take(self) -> bool:
+        """Consume one request; returns False once the budget is used up."""
+        if self.remaining <= 0:
+            return False
+        self.remaining -= 1
+        return True
+
+class _InFlightRequest:
+    """An API request shared by every caller that asked for the same parameters."""
+    
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class _SearchCompleteness:
+    """Whether every query of a landmark search got a usable API response."""
+    
+    def __init__(self):
+        self.complete = True
+
+# Budget of the landmark search running in the current task (shared with the tasks it spawns)
+_request_budget: ContextVar[Optional[RequestBudget]] = ContextVar('request_budget', default=None)
+# Completeness of the landmark search running in the current task (shared the same way)
+_search_completeness: ContextVar[Optional[_SearchCompleteness]] = ContextVar('search_completeness', default=None)
+
 class WikiCommonsSearcher:
     """Async searcher for Wikimedia Commons quality images with camera locations."""
     
-    def __init__(self, session: aiohttp.ClientSession):
+    def __init__(self, session: aiohttp.ClientSession, cache: Optional[CommonsResponseCache] = None,
+                 race_strategies: bool = False, landmark_timeout: Optional[float] = None,
+                 max_requests_per_landmark: Optional[int] = None,
+                 rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                 max_retries: int = 5, maxlag: int = 5, image_info_memo_size: int = 10000,
+                 geo_index: Optional[CommonsGeoIndex] = None, offline: bool = False):
         self.session = session
+        self.cache = cache
+        # Local camera locations answer geosearches and skip info lookups for files without one
+        self.geo_index = geo_index
+        self.geo_index_lookups = 0
+        self.offline = offline  # Only use cached responses and the geotag index, never the network
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.maxlag = maxlag  # Ask the API to refuse requests while replication lag exceeds this
+        self.retries = 0
+        self._in_flight: Dict[str, _InFlightRequest] = {}
+        self.coalesced_requests = 0
+        # Image info by file title for the duration of the run (None = file has no usable info)
+        self.image_info_memo_size = image_info_memo_size
+        self._image_info_memo: OrderedDict[str, Optional[Dict]] = OrderedDict()
+        self.image_info_memo_hits = 0
+        self.race_strategies = race_strategies  # Run strategies and their variations concurrently
+        self.landmark_timeout = landmark_timeout  # Seconds allowed per landmark (None = no limit)
+        self.max_requests_per_landmark = max_requests_per_landmark  # Cap on API requests per landmark
         self.base_url = "https://commons.wikimedia.org/w/api.php"
+        self.max_titles_per_query = 50  # API limit on titles per query for regular clients
         
     async def search_quality_images(self, landmark: str, limit: int = 10) -> List[Dict]:
         """Enhanced search for quality images using multiple strategies."""
+        results, _ = await self.search_landmark(landmark, limit)
+        return results
+    
+    async def search_landmark(self, landmark: str, limit: int = 10) -> Tuple[List[Dict], bool]:
+        """Search for quality images of a landmark.
+        
+        Returns:
+            Tuple of (results, complete), where complete is False if any query went unanswered
+            (failed request, exhausted request budget, swallowed error), so an empty result
+            doesn't prove the landmark has no images
+        """
         logger.info(f"Searching for: {landmark}")
-        all_results = []
-        seen_titles = set()
-        
-        # Strategy 1: Original content search with variations
-        results1 = await self._search_by_content_variations(landmark, limit)
-        self._add_unique_results(all_results, seen_titles, results1)
-        if all_results:  # Stop after finding first result
-            return all_results[:1]
-        
-        # Strategy 2: Category-based search
-        results2 = await self._search_by_categories(landmark, limit)
-        self._add_unique_results(all_results, seen_titles, results2)
-        if all_results:  # Stop after finding first result
-            return all_results[:1]
-        
-        # Strategy 3: Coordinate-based search for known landmarks
-        results3 = await self._search_by_coordinates(landmark, limit)
-        self._add_unique_results(all_results, seen_titles, results3)
-        if all_results:  # Stop after finding first result
-            return all_results[:1]
-        
-        # Strategy 4: Quality image filter search
-        results4 = await self._search_quality_filtered(landmark, limit)
-        self._add_unique_results(all_results, seen_titles, results4)
+        
+        # Strategies in order of preference; the first one that finds an image wins
+        strategies = [
+            # Strategy 1: Original content search with variations
+            functools.partial(self._run_strategy, 'content', self._search_by_content_variations, landmark, limit),
+            # Strategy 2: Category-based search
+            functools.partial(self._run_strategy, 'category', self._search_by_categories, landmark, limit),
+            # Strategy 3: Coordinate-based search for known landmarks
+            functools.partial(self._run_strategy, 'coordinates', self._search_by_coordinates, landmark, limit),
+            # Strategy 4: Quality image filter search
+            functools.partial(self._run_strategy, 'quality', self._search_quality_filtered, landmark, limit)
+        ]
+        
+        budget_token = None
+        if self.max_requests_per_landmark is not None:
+            budget_token = _request_budget.set(RequestBudget(self.max_requests_per_landmark))
+        completeness = _SearchCompleteness()
+        completeness_token = _search_completeness.set(completeness)
+        
+        # A timeout propagates to the caller, so it is not mistaken for a landmark without images
+        try:
+            async with asyncio.timeout(self.landmark_timeout):
+                all_results = await self._first_result(strategies)
+        finally:
+            _search_completeness.reset(completeness_token)
+            if budget_token is not None:
+                _request_budget.reset(budget_token)
         
         logger.info(f"Found {len(all_results)} unique images with location data for {landmark}")
-        return all_results[:1]  # Return only the first (best) result
+        return all_results[:1], completeness.complete  # Return only the first (best) result
     
-    def _add_unique_results(self, all_results: List[Dict], seen_titles: set, new_results: List[Dict]):
-        """Add new results to the list, avoiding duplicates."""
-        for result in new_results:
-            if result['title'] not in seen_titles:
-                all_results.append(result)
-                seen_titles.add(result['title'])
+    def _mark_incomplete(self) -> None:
+        """Record that the current landmark search missed a query's answer."""
+        completeness = _search_completeness.get()
+        if completeness is not None:
+            completeness.complete = False
+    
+    async def _run_strategy(self, name: str, strategy: Callable[[str, int], Awaitable[List[Dict]]],
+                            landmark: str, limit: int) -> List[Dict]:
+        """Run one search strategy and record its name on the results it finds."""
+        results = await strategy(landmark, limit)
+        for result in results:
+            result['search_strategy'] = name
+        return results
+    
+    async def _first_result(self, searches: List[Callable[[], Awaitable[Optional[List[Dict]]]]],
+                            decisive: Callable[[Optional[List[Dict]]], bool] = bool) -> List[Dict]:
+        """Return the result of the highest-priority search whose result is decisive.
+        
+        Searches run one after another by default. With race_strategies they run
+        concurrently: lower-priority searches are cancelled as soon as a search ahead
+        of them produces a decisive result, and that result is returned once every
+        higher-priority search has finished without one.
+        """
+        if not self.race_strategies:
+            for search in searches:
+                result = await search()
+                if decisive(result):
+                    return result or []
+            return []
+        
+        tasks = [asyncio.create_task(search()) for search in searches]
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                
+                for task in done:
+                    if decisive(self._task_result(task)):
+                        for lower_priority in tasks[tasks.index(task) + 1:]:
+                            lower_priority.cancel()
+                
+                # Preference order: only answer once everything ahead of a decisive result is done
+                for task in tasks:
+                    if not task.done():
+                        break
+                    result = self._task_result(task)
+                    if decisive(result):
+                        return result or []
+            
+            return []
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def _task_result(self, task: asyncio.Task) -> Optional[List[Dict]]:
+        """Result of a finished search task, treating cancellation and errors as no result."""
+        if task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
     
     async def _search_by_content_variations(self, landmark: str, limit: int) -> List[Dict]:
         """Search using multiple content variations."""
-        search_variations = self._generate_search_variations(landmark)
+        searches = [
+            functools.partial(self._search_content_term, search_term, landmark, limit)
+            for search_term in self._generate_search_variations(landmark)
+        ]
+        # The first variation with any hits decides, even if none of them are geotagged
+        return await self._first_result(searches, decisive=lambda result: result is not None)
+    
+    async def _search_content_term(self, search_term: str, landmark: str, limit: int) -> Optional[List[Dict]]:
+        """Run one content search; returns None if the search had no hits."""
+        try:
+            # generator=search returns the hits together with their image info in one round trip
+            search_params = {
+                'generator': 'search',
+                'gsrsearch': f'"{search_term}" filetype:bitmap',
+                'gsrnamespace': 6,
+                'gsrlimit': limit * 2
+            }
+            
+            candidates = await self._query_candidates(search_params)
+            if candidates:
+                logger.debug(f"Content search '{search_term}' found {len(candidates)} results")
+                return self._first_located_image(candidates, landmark)
         
-        for search_term in search_variations:
-            try:
-                search_params = {
-                    'action': 'query',
-                    'format': 'json',
-                    'list': 'search',
-                    'srsearch': f'"{search_term}" filetype:bitmap',
-                    'srnamespace': 6,
-                    'srlimit': limit * 2,
-                    'srprop': 'title|snippet'
-                }
-                
-                async with self.session.get(self.base_url, params=search_params) as response:
-                    if response.status != 200:
-                        continue
-                    
-                    data = await response.json()
-                    search_results = data.get('query', {}).get('search', [])
-                    
-                    if search_results:
-                        logger.debug(f"Content search '{search_term}' found {len(search_results)} results")
-                        return await self._check_images_for_location(search_results, landmark, limit)
-                        
-            except Exception as e:
-                logger.debug(f"Content search error for '{search_term}': {e}")
-                continue
+        except Exception as e:
+            logger.debug(f"Content search error for '{search_term}': {e}")
+            self._mark_incomplete()
         
-        return []
+        return None
     
     async def _search_by_categories(self, landmark: str, limit: int) -> List[Dict]:
         """Search by relevant categories."""
-        category_searches = self._generate_category_searches(landmark)
-        results = []
+        searches = [
+            functools.partial(self._search_category, category_search, landmark, limit)
+            for category_search in self._generate_category_searches(landmark)
+        ]
+        return await self._first_result(searches)
+    
+    async def _search_category(self, category_search: str, landmark: str, limit: int) -> List[Dict]:
+        """Check the files of one category for location data."""
+        try:
+            logger.debug(f"Searching category: {category_search}")
+            
+            params = {
+                'generator': 'categorymembers',
+                'gcmtitle': f'Category:{category_search}',
+                'gcmnamespace': 6,
+                'gcmtype': 'file',
+                'gcmlimit': limit * 2
+            }
+            
+            candidates = await self._query_candidates(params)
+            if candidates:
+                logger.debug(f"Category '{category_search}' has {len(candidates)} files")
+                return self._first_located_image(candidates, landmark)
         
-        for category_search in category_searches:
-            try:
-                logger.debug(f"Searching category: {category_search}")
-                
-                params = {
-                    'action': 'query',
-                    'format': 'json',
-                    'list': 'categorymembers',
-                    'cmtitle': f'Category:{category_search}',
-                    'cmnamespace': 6,
-                    'cmlimit': limit * 2,
-                    'cmprop': 'title'
-                }
-                
-                async with self.session.get(self.base_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        members = data.get('query', {}).get('categorymembers', [])
-                        
-                        if members:
-                            logger.debug(f"Category '{category_search}' has {len(members)} files")
-                            category_results = await self._check_images_for_location(members, landmark, limit)
-                            if category_results:
-                                return category_results  # Return immediately after finding first result
-                                
-            except Exception as e:
-                logger.debug(f"Category search error for '{category_search}': {e}")
-                continue
+        except Exception as e:
+            logger.debug(f"Category search error for '{category_search}': {e}")
+            self._mark_incomplete()
         
-        return results
+        return []
     
     async def _search_by_coordinates(self, landmark: str, limit: int) -> List[Dict]:
         """Search by coordinates if location can be guessed."""
@@ -150,78 +587,104 @@ class WikiCommonsSearcher:
         logger.debug(f"Searching coordinates: {lat}, {lon}")
         
         try:
-            params = {
-                'action': 'query',
-                'format': 'json', 
-                'list': 'geosearch',
-                'gscoord': f'{lat}|{lon}',
-                'gsradius': 2000,  # 2km radius
-                'gsnamespace': 6,
-                'gslimit': limit * 3
-            }
+            if self.geo_index is not None:
+                self.geo_index_lookups += 1
+                data = {'query': {'geosearch': self.geo_index.nearby(lat, lon, 2000, limit * 3)}}
+            else:
+                params = {
+                    'action': 'query',
+                    'format': 'json', 
+                    'list': 'geosearch',
+                    'gscoord': f'{lat}|{lon}',
+                    'gsradius': 2000,  # 2km radius
+                    'gsnamespace': 6,
+                    'gslimit': limit * 3
+                }
+                data = await self._api_get(params)
             
-            async with self.session.get(self.base_url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    geo_results = data.get('query', {}).get('geosearch', [])
+            if data:
+                geo_results = data.get('query', {}).get('geosearch', [])
+                
+                if geo_results:
+                    logger.debug(f"Coordinate search found {len(geo_results)} files")
+                    
+                    # Filter for relevant files
+                    relevant_files = []
+                    keywords = self._get_search_keywords(landmark)
+                    
+                    for result in geo_results:
+                        title = result.get('title', '').lower()
+                        if any(keyword in title for keyword in keywords):
+                            relevant_files.append(result)
                     
-                    if geo_results:
-                        logger.debug(f"Coordinate search found {len(geo_results)} files")
-                        
-                        # Filter for relevant files
-                        relevant_files = []
-                        keywords = self._get_search_keywords(landmark)
-                        
-                        for result in geo_results:
-                            title = result.get('title', '').lower()
-                            if any(keyword in title for keyword in keywords):
-                                relevant_files.append(result)
-                        
-                        if relevant_files:
-                            logger.debug(f"Found {len(relevant_files)} relevant files near coordinates")
-                            return await self._check_images_for_location(relevant_files, landmark, limit)
+                    if relevant_files:
+                        logger.debug(f"Found {len(relevant_files)} relevant files near coordinates")
+                        return await self._check_images_for_location(relevant_files, landmark, limit)
         
         except Exception as e:
             logger.debug(f"Coordinate search error: {e}")
+            self._mark_incomplete()
         
         return []
     
     async def _search_quality_filtered(self, landmark: str, limit: int) -> List[Dict]:
         """Search with quality image filter."""
-        search_variations = [
-            f'{landmark} hasassessment:quality-image',
-            f'"{landmark}" hasassessment:quality-image',
-            f'{landmark.replace("\'s", "")} hasassessment:quality-image'
+        searches = [
+            functools.partial(self._search_quality_term, search_term, landmark, limit)
+            for search_term in self._generate_quality_searches(landmark)
         ]
+        return await self._first_result(searches, decisive=lambda result: result is not None)
+    
+    async def _search_quality_term(self, search_term: str, landmark: str, limit: int) -> Optional[List[Dict]]:
+        """Run one quality-filtered search; returns None if the search had no hits."""
+        try:
+            params = {
+                'generator': 'search',
+                'gsrsearch': search_term,
+                'gsrnamespace': 6,
+                'gsrlimit': limit
+            }
+            
+            candidates = await self._query_candidates(params)
+            if candidates:
+                logger.debug(f"Quality search '{search_term}' found {len(candidates)} results")
+                return self._first_located_image(candidates, landmark)
         
-        for search_term in search_variations:
-            try:
-                params = {
-                    'action': 'query',
-                    'format': 'json',
-                    'list': 'search',
-                    'srsearch': search_term,
-                    'srnamespace': 6,
-                    'srlimit': limit,
-                    'srprop': 'title|snippet'
-                }
-                
-                async with self.session.get(self.base_url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        search_results = data.get('query', {}).get('search', [])
-                        
-                        if search_results:
-                            logger.debug(f"Quality search '{search_term}' found {len(search_results)} results")
-                            return await self._check_images_for_location(search_results, landmark, limit)
-                            
-            except Exception as e:
-                logger.debug(f"Quality search error for '{search_term}': {e}")
-                continue
+        except Exception as e:
+            logger.debug(f"Quality search error for '{search_term}': {e}")
+            self._mark_incomplete()
         
-        return []
+        return None
     
-    def _generate_search_variations(self, landmark: str) -> List[str]:
+    @classmethod
+    def query_plan_fingerprint(cls, landmark: str) -> str:
+        """Fingerprint of every query the search strategies would issue for a landmark.
+        
+        It changes whenever the generated variations change or QUERY_PLAN_VERSION is bumped,
+        which invalidates negative results recorded under the old plan.
+        """
+        plan = {
+            'version': QUERY_PLAN_VERSION,
+            'content': cls._generate_search_variations(landmark),
+            'categories': cls._generate_category_searches(landmark),
+            'coordinates': cls._guess_coordinates(landmark),
+            'keywords': cls._get_search_keywords(landmark),
+            'quality': cls._generate_quality_searches(landmark)
+        }
+        return hashlib.sha256(json.dumps(plan, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    
+    @staticmethod
+    def _generate_quality_searches(landmark: str) -> List[str]:
+        """Generate quality-image search terms."""
+        landmark_no_possessive = landmark.replace("'s", "")
+        return list(dict.fromkeys([
+            f'{landmark} hasassessment:quality-image',
+            f'"{landmark}" hasassessment:quality-image',
+            f'{landmark_no_possessive} hasassessment:quality-image'
+        ]))
+    
+    @staticmethod
+    def _generate_search_variations(landmark: str) -> List[str]:
         """Generate search term variations."""
         variations = [
             landmark,
@@ -240,9 +703,10 @@ class WikiCommonsSearcher:
                 "Old Town Split"
             ])
         
-        return list(set(variations))  # Remove duplicates
+        return list(dict.fromkeys(variations))  # Remove duplicates, keeping preference order
     
-    def _generate_category_searches(self, landmark: str) -> List[str]:
+    @staticmethod
+    def _generate_category_searches(landmark: str) -> List[str]:
         """Generate potential category names."""
         landmark_clean = landmark.replace("'s", "").replace("'", "")
         
@@ -261,9 +725,10 @@ class WikiCommonsSearcher:
                 "Quality images of Split"
             ])
         
-        return list(set(categories))
+        return list(dict.fromkeys(categories))
     
-    def _guess_coordinates(self, landmark: str) -> Optional[tuple]:
+    @staticmethod
+    def _guess_coordinates(landmark: str) -> Optional[tuple]:
         """Guess coordinates for well-known landmarks."""
         landmark_lower = landmark.lower()
         
@@ -281,7 +746,8 @@ class WikiCommonsSearcher:
         
         return None
     
-    def _get_search_keywords(self, landmark: str) -> List[str]:
+    @staticmethod
+    def _get_search_keywords(landmark: str) -> List[str]:
         """Get search keywords for filtering relevant results."""
         landmark_lower = landmark.lower()
         keywords = landmark_lower.split()
@@ -293,99 +759,339 @@ class WikiCommonsSearcher:
     
     async def _check_images_for_location(self, search_results: List[Dict], landmark: str, limit: int) -> List[Dict]:
         """Check search results for location data."""
-        quality_images = []
+        titles = [result.get('title', result.get('name', '')) for result in search_results]
+        titles = [title for title in titles if title]
+        if self.geo_index is not None:
+            # Files without a camera location in the index aren't worth an info lookup
+            self.geo_index_lookups += len(titles)
+            titles = [title for title in titles if title in self.geo_index]
+        # Check more than limit in case some don't have location
+        titles = titles[:limit * 2]
         
-        for result in search_results[:limit * 2]:  # Check more than limit in case some don't have location
-            file_title = result.get('title', result.get('name', ''))
-            if not file_title:
-                continue
-                
-            image_info = await self.get_image_info(file_title)
+        # Resolve all candidates with batched lookups instead of one request per file
+        image_infos = await self.get_image_info_batch(titles)
+        return self._first_located_image([(title, image_infos.get(title)) for title in titles], landmark)
+    
+    def _first_located_image(self, candidates: List[Tuple[str, Optional[Dict]]], landmark: str) -> List[Dict]:
+        """Return the first candidate, in preference order, that has location data."""
+        for file_title, image_info in candidates:
+            if image_info is None and self.geo_index is not None:
+                image_info = self._indexed_image_info(file_title)
             if image_info and self.has_camera_location(image_info):
-                quality_images.append({
+                # Return immediately after finding the first image with location data
+                return [{
                     'title': file_title,
                     'landmark': landmark,
                     'url': image_info.get('url', ''),
                     'description': image_info.get('description', ''),
                     'location': image_info.get('location', {}),
-                    'commons_url': f"https://commons.wikimedia.org/wiki/{file_title.replace(' ', '_')}"
-                })
-                
-                # Return immediately after finding the first image with location data
-                return quality_images
+                    'commons_url': f"https://commons.wikimedia.org/wiki/{file_title.replace(' ', '_')}",
+                    'thumbnail_url': image_info.get('thumburl', ''),
+                    'original_width': image_info.get('width', 0),
+                    'original_height': image_info.get('height', 0)
+                }]
         
-        return quality_images
+        return []
     
-    async def get_image_info(self, file_title: str) -> Optional[Dict]:
-        """Get detailed information about an image file."""
+    def _indexed_image_info(self, file_title: str) -> Optional[Dict]:
+        """Image info derived from the geotag index alone, for files whose info couldn't be fetched."""
+        location = self.geo_index.location_of(file_title)
+        if location is None:
+            return None
+        return {
+            'url': commons_file_url(file_title),
+            'description': '',
+            'location': {'lat': location[0], 'lon': location[1]}
+        }
+    
+    async def _api_get(self, params: Dict) -> Optional[Dict]:
+        """Send a request to the Commons API and return the decoded JSON.
+        
+        Concurrent calls with identical parameters share a single HTTP request. The shared
+        request is only cancelled once every caller waiting on it has been cancelled.
+        """
+        key = CommonsResponseCache.normalize_params(params)
+        shared = self._in_flight.get(key)
+        if shared is None:
+            shared = _InFlightRequest(asyncio.create_task(self._fetch(params)))
+            self._in_flight[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget_in_flight(key, shared))
+        else:
+            self.coalesced_requests += 1
+        
+        shared.waiters += 1
         try:
-            info_params = {
-                'action': 'query',
-                'format': 'json',
-                'titles': file_title,
-                'prop': 'imageinfo|coordinates',
-                'iiprop': 'url|extmetadata|size',
-                'iiurlwidth': 800,
-                'coprop': 'country|region|globe'
-            }
+            data = await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._mark_incomplete()
+            raise
+        else:
+            # No response (failed, throttled out, over budget, or not cached offline) or an API error
+            if data is None or 'error' in data:
+                self._mark_incomplete()
+            return data
+        finally:
+            shared.waiters -= 1
+            if shared.waiters == 0 and not shared.task.done():
+                # Forget it now, so a caller arriving before the cancellation lands starts a fresh request
+                self._forget_in_flight(key, shared)
+                shared.task.cancel()
+    
+    def _forget_in_flight(self, key: str, shared: _InFlightRequest) -> None:
+        """Stop sharing a request, unless a newer one has already replaced it."""
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+    
+    async def _fetch(self, params: Dict) -> Optional[Dict]:
+        """Fetch one query, going through the response cache, request budget and rate limiter."""
+        if self.cache:
+            cached = self.cache.get(params)
+            if cached is not None:
+                return cached
+        
+        if self.offline:
+            return None
+        
+        budget = _request_budget.get()
+        if budget is not None and not budget.take():
+            logger.debug("Per-landmark request budget exhausted, skipping request")
+            return None
+        
+        # maxlag is not part of the query itself, so it stays out of the cache key
+        request_params = {**params, 'maxlag': self.maxlag}
+        
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.acquire()
+            throttled = False
+            retry_after = None
+            data = None
+            failed = False
             
-            async with self.session.get(self.base_url, params=info_params) as response:
-                if response.status != 200:
-                    return None
-                
-                data = await response.json()
-                pages = data.get('query', {}).get('pages', {})
-                
-                for page_id, page_data in pages.items():
-                    if page_id == '-1':  # Page not found
-                        continue
-                    
-                    imageinfo = page_data.get('imageinfo', [])
-                    coordinates = page_data.get('coordinates', [])
-                    
-                    if not imageinfo:
-                        continue
-                    
-                    info = imageinfo[0]
-                    extmetadata = info.get('extmetadata', {})
-                    
-                    # Extract GPS coordinates if available
-                    location = {}
-                    if coordinates:
-                        coord = coordinates[0]
-                        location = {
-                            'lat': coord.get('lat'),
-                            'lon': coord.get('lon'),
-                            'country': coord.get('country', ''),
-                            'region': coord.get('region', '')
-                        }
-                    
-                    # Check for EXIF GPS data in metadata
-                    gps_lat = extmetadata.get('GPSLatitude', {}).get('value', '')
-                    gps_lon = extmetadata.get('GPSLongitude', {}).get('value', '')
-                    
-                    if gps_lat and gps_lon and not location:
-                        # Parse GPS coordinates from EXIF
-                        lat = self.parse_gps_coordinate(gps_lat)
-                        lon = self.parse_gps_coordinate(gps_lon)
-                        if lat is not None and lon is not None:
-                            location = {'lat': lat, 'lon': lon}
-                    
-                    return {
-                        'url': info.get('url', ''),
-                        'thumburl': info.get('thumburl', ''),
-                        'description': extmetadata.get('ImageDescription', {}).get('value', ''),
-                        'artist': extmetadata.get('Artist', {}).get('value', ''),
-                        'location': location,
-                        'width': info.get('width', 0),
-                        'height': info.get('height', 0)
-                    }
-                
+            try:
+                async with self.session.get(self.base_url, params=request_params) as response:
+                    if response.status in (429, 503):
+                        throttled = True
+                        retry_after = self._parse_retry_after(response.headers.get('Retry-After'))
+                    elif response.status != 200:
+                        failed = True
+                    else:
+                        data = await response.json()
+                        error_code = data.get('error', {}).get('code', '')
+                        if error_code in ('maxlag', 'ratelimited'):
+                            throttled = True
+                            retry_after = self._parse_retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Timeouts and dropped connections are treated as congestion too
+                throttled = True
+                logger.debug(f"Request failed ({e.__class__.__name__}), will retry")
+            except BaseException:
+                # Cancelled (a race loser or landmark timeout) or failed without an answer: free the slot
+                # without counting the request as a success
+                self.rate_limiter.release(cancelled=True)
+                raise
+            self.rate_limiter.release(throttled, retry_after)
+            
+            if failed:
+                return None
+            if not throttled:
+                break
+            
+            if attempt == self.max_retries:
+                logger.warning(f"Giving up on Commons API request after {self.max_retries} retries")
                 return None
+            
+            # Honor Retry-After when given, otherwise back off exponentially with jitter
+            self.retries += 1
+            delay = retry_after if retry_after else min(60, 2 ** attempt) * (0.5 + random.random())
+            logger.debug(f"Throttled by Commons API, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+        
+        # Never cache API errors, they are usually transient
+        if self.cache and 'error' not in data:
+            self.cache.put(params, data)
+        
+        return data
+    
+    def _parse_retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header given either in seconds or as an HTTP date."""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    
+    def _image_info_params(self) -> Dict:
+        """Query parameters that attach image info and coordinates to every returned page."""
+        return {
+            'prop': 'imageinfo|coordinates',
+            'iiprop': 'url|extmetadata|size',
+            # Width and height together make the thumbnail fit in a THUMBNAIL_SIZE square
+            'iiurlwidth': THUMBNAIL_SIZE,
+            'iiurlheight': THUMBNAIL_SIZE,
+            'iiextmetadatafilter': 'ImageDescription|Artist|GPSLatitude|GPSLongitude',
+            'coprop': 'country|region|globe',
+            'colimit': 'max'  # The default of 10 is shared by all pages in the batch
+        }
+    
+    async def _query_pages(self, params: Dict) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+        """Run a query returning pages, following continuation until the batch is complete.
+        
+        Returns:
+            Tuple of (pages keyed by page ID, mapping of requested title to normalized title)
+        """
+        request_params = {'action': 'query', 'format': 'json', **params}
+        pages = {}
+        normalized = {}
+        
+        while True:
+            data = await self._api_get(request_params)
+            if not data:
+                break
+            
+            query = data.get('query', {})
+            for item in query.get('normalized', []):
+                normalized[item.get('from', '')] = item.get('to', '')
+            
+            # Property data for one batch can be split across several responses
+            for page_id, page_data in query.get('pages', {}).items():
+                merged = pages.setdefault(page_id, {})
+                for key, value in page_data.items():
+                    if isinstance(value, list):
+                        merged.setdefault(key, []).extend(value)
+                    else:
+                        merged.setdefault(key, value)
+            
+            # Stop at batchcomplete so a generator doesn't move on to its next page of hits
+            if 'continue' not in data or 'batchcomplete' in data:
+                break
+            request_params = {**request_params, **data['continue']}
+        
+        return pages, normalized
+    
+    async def _query_candidates(self, generator_params: Dict) -> List[Tuple[str, Optional[Dict]]]:
+        """Run a generator query and return (title, image info) pairs in generator order."""
+        pages, _ = await self._query_pages({**generator_params, **self._image_info_params()})
+        
+        # generator=search reports the rank of each hit; other generators keep response order
+        ordered_pages = sorted(pages.items(), key=lambda item: item[1].get('index', 0))
+        candidates = []
+        for page_id, page_data in ordered_pages:
+            if not page_data.get('title'):
+                continue
+            info = self._parse_image_page(page_id, page_data)
+            self._remember_image_info(page_data['title'], info)
+            candidates.append((page_data['title'], info))
+        
+        return candidates
+    
+    def _remember_image_info(self, file_title: str, info: Optional[Dict]) -> None:
+        """Add image info to the bounded per-run LRU."""
+        self._image_info_memo[file_title] = info
+        self._image_info_memo.move_to_end(file_title)
+        while len(self._image_info_memo) > self.image_info_memo_size:
+            self._image_info_memo.popitem(last=False)
+    
+    async def get_image_info_batch(self, file_titles: List[str]) -> Dict[str, Dict]:
+        """Get image information for many files, resolving up to 50 titles per request."""
+        results = {}
+        unique_titles = []
+        
+        # Serve titles seen earlier in this run from memory
+        for title in dict.fromkeys(title for title in file_titles if title):
+            if title in self._image_info_memo:
+                self.image_info_memo_hits += 1
+                self._image_info_memo.move_to_end(title)
+                if self._image_info_memo[title]:
+                    results[title] = self._image_info_memo[title]
+            else:
+                unique_titles.append(title)
+        
+        for start in range(0, len(unique_titles), self.max_titles_per_query):
+            batch = unique_titles[start:start + self.max_titles_per_query]
+            
+            try:
+                pages, normalized = await self._query_pages({
+                    'titles': '|'.join(batch),
+                    **self._image_info_params()
+                })
+            except Exception as e:
+                logger.error(f"Error getting image info for {len(batch)} files: {str(e)}")
+                self._mark_incomplete()
+                continue
+            
+            infos_by_title = {}
+            for page_id, page_data in pages.items():
+                infos_by_title[page_data.get('title', '')] = self._parse_image_page(page_id, page_data)
+            
+            for file_title in batch:
+                resolved_title = normalized.get(file_title, file_title)
+                if resolved_title not in infos_by_title:
+                    continue  # Not in the response (e.g. the request failed), so don't remember it
                 
-        except Exception as e:
-            logger.error(f"Error getting image info for {file_title}: {str(e)}")
+                info = infos_by_title[resolved_title]
+                self._remember_image_info(file_title, info)
+                if info:
+                    results[file_title] = info
+        
+        return results
+    
+    async def get_image_info(self, file_title: str) -> Optional[Dict]:
+        """Get detailed information about an image file."""
+        image_infos = await self.get_image_info_batch([file_title])
+        return image_infos.get(file_title)
+    
+    def _parse_image_page(self, page_id: str, page_data: Dict) -> Optional[Dict]:
+        """Extract URL, description and location from a page with imageinfo/coordinates."""
+        if page_id.startswith('-') or 'missing' in page_data:  # Page not found
             return None
+        
+        imageinfo = page_data.get('imageinfo', [])
+        coordinates = page_data.get('coordinates', [])
+        
+        if not imageinfo:
+            return None
+        
+        info = imageinfo[0]
+        extmetadata = info.get('extmetadata', {})
+        
+        # Extract GPS coordinates if available
+        location = {}
+        if coordinates:
+            coord = coordinates[0]
+            location = {
+                'lat': coord.get('lat'),
+                'lon': coord.get('lon'),
+                'country': coord.get('country', ''),
+                'region': coord.get('region', '')
+            }
+        
+        # Check for EXIF GPS data in metadata
+        gps_lat = extmetadata.get('GPSLatitude', {}).get('value', '')
+        gps_lon = extmetadata.get('GPSLongitude', {}).get('value', '')
+        
+        if gps_lat and gps_lon and not location:
+            # Parse GPS coordinates from EXIF
+            lat = self.parse_gps_coordinate(gps_lat)
+            lon = self.parse_gps_coordinate(gps_lon)
+            if lat is not None and lon is not None:
+                location = {'lat': lat, 'lon': lon}
+        
+        return {
+            'url': info.get('url', ''),
+            'thumburl': info.get('thumburl', ''),
+            'description': extmetadata.get('ImageDescription', {}).get('value', ''),
+            'artist': extmetadata.get('Artist', {}).get('value', ''),
+            'location': location,
+            'width': info.get('width', 0),
+            'height': info.get('height', 0)
+        }
     
     def parse_gps_coordinate(self, gps_string: str) -> Optional[float]:
         """Parse GPS coordinate from EXIF format to decimal degrees."""
@@ -454,85 +1160,419 @@ def parse_landmarks_file(file_path: str) -> List[str]:
     logger.info(f"Parsed {len(landmarks)} landmarks from {file_path}")
     return landmarks
 
-def load_existing_results(file_path: str) -> Dict[str, Dict]:
-    """Load existing landmark image results from JSON file."""
+class ResultJournal:
+    """Append-only JSON Lines journal of search results, written as each landmark completes.
+    
+    Every line is flushed and fsynced, so an interrupted run loses at most the line being
+    written. The results journal is folded into the JSON results file by compact_results();
+    NegativeResultCache uses the same format for its own records.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._file = None
+    
+    def append(self, result: Dict) -> None:
+        """Durably append one result."""
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def read(self) -> Iterator[Dict]:
+        """Yield journaled results, skipping a line truncated by a crash."""
+        if not self.path.exists():
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable line {line_number} in {self.path}")
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def clear(self) -> None:
+        """Remove the journal once its results have been compacted."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+def journal_path_for(output_file: str) -> str:
+    """Journal file that accompanies a results file (landmark_images.json -> landmark_images.journal.jsonl)."""
+    return str(Path(output_file).with_suffix('.journal.jsonl'))
+
+class NegativeResultCache:
+    """Persisted record of landmarks that were searched without finding a geotagged image.
+    
+    A landmark with a recorded miss is only searched again once its backoff has passed
+    (base_delay doubled for every consecutive miss, up to max_delay) or as soon as its
+    query plan fingerprint differs from the one it was searched with.
+    """
+    
+    def __init__(self, path: str = DEFAULT_MISSES_FILE, base_delay: float = 24 * 3600,
+                 max_delay: float = 90 * 24 * 3600):
+        self.journal = ResultJournal(path)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.entries = {}
+        
+        # Records are appended as they happen; the last one for a landmark wins
+        self.merge_from(path)
+    
+    def merge_from(self, path: str) -> None:
+        """Replay records from another record file (e.g. a shard's) on top of the current entries."""
+        for record in ResultJournal(path).read():
+            landmark = record.get('landmark', '')
+            if not landmark:
+                continue
+            if record.get('found'):
+                self.entries.pop(landmark, None)
+            else:
+                self.entries[landmark] = record
+    
+    def retry_at(self, landmark: str) -> float:
+        """Timestamp after which a landmark with a recorded miss may be searched again."""
+        entry = self.entries[landmark]
+        delay = min(self.max_delay, self.base_delay * 2 ** (entry.get('attempts', 1) - 1))
+        return entry.get('searched_at', 0) + delay
+    
+    def should_search(self, landmark: str, plan: str) -> bool:
+        """Whether a landmark is due for another search under the given query plan."""
+        entry = self.entries.get(landmark)
+        if entry is None or entry.get('plan') != plan:
+            return True
+        return time.time() >= self.retry_at(landmark)
+    
+    def record_miss(self, landmark: str, plan: str) -> None:
+        """Record a search that found nothing, increasing the backoff if the plan is unchanged."""
+        previous = self.entries.get(landmark)
+        attempts = previous.get('attempts', 1) + 1 if previous and previous.get('plan') == plan else 1
+        entry = {'landmark': landmark, 'plan': plan, 'searched_at': time.time(), 'attempts': attempts}
+        self.entries[landmark] = entry
+        self.journal.append(entry)
+    
+    def record_hit(self, landmark: str) -> None:
+        """Forget a landmark that has now produced a result."""
+        if self.entries.pop(landmark, None) is not None:
+            self.journal.append({'landmark': landmark, 'found': True})
+    
+    def compact(self) -> None:
+        """Rewrite the record file with one line per landmark that still has a miss."""
+        self.journal.close()
+        temp_file = f"{self.journal.path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.journal.path)
+
+def load_existing_results(file_path: str, journal_path: Optional[str] = None,
+                          strict: bool = False) -> Dict[str, Dict]:
+    """Load existing landmark image results from JSON file, plus any journaled results not yet compacted.
+    
+    A results file that can't be read is logged and skipped, or re-raised when strict is set so
+    callers about to rewrite the file don't replace it with a partial result set.
+    """
+    existing_results = {}
+    
     if not Path(file_path).exists():
         logger.info(f"No existing results file found at: {file_path}")
-        return {}
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            results_list = json.load(f)
+    else:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                results_list = json.load(f)
+            
+            # Convert list to dict keyed by landmark name for easy lookup
+            for result in results_list:
+                landmark = result.get('landmark', '')
+                if landmark:
+                    existing_results[landmark] = result
+            
+            logger.info(f"Loaded {len(existing_results)} existing results from {file_path}")
         
-        # Convert list to dict keyed by landmark name for easy lookup
-        existing_results = {}
-        for result in results_list:
+        except Exception as e:
+            logger.error(f"Error loading existing results: {str(e)}")
+            if strict:
+                raise
+    
+    # Resume from results journaled by an interrupted run
+    if journal_path:
+        journaled = 0
+        for result in ResultJournal(journal_path).read():
             landmark = result.get('landmark', '')
             if landmark:
                 existing_results[landmark] = result
-        
-        logger.info(f"Loaded {len(existing_results)} existing results from {file_path}")
-        return existing_results
-        
-    except Exception as e:
-        logger.error(f"Error loading existing results: {str(e)}")
-        return {}
+                journaled += 1
+        if journaled:
+            logger.info(f"Recovered {journaled} results from journal {journal_path}")
+    
+    return existing_results
 
-def filter_landmarks_to_search(landmarks: List[str], existing_results: Dict[str, Dict]) -> List[str]:
-    """Filter out landmarks that already have results."""
+def write_results_file(output_file: str, results: List[Dict]) -> None:
+    """Atomically replace the JSON results file."""
+    temp_file = f"{output_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, output_file)
+
+def compact_results(output_file: str, journal: ResultJournal) -> Optional[int]:
+    """Fold the journal into the JSON results file and remove it. Returns the number of results.
+    
+    If the results file can't be parsed, both files are left untouched and None is returned.
+    """
+    try:
+        all_results = load_existing_results(output_file, str(journal.path), strict=True)
+    except Exception:
+        logger.error(f"Not compacting {journal.path} into unreadable {output_file}; fix or move it and rerun")
+        return None
+    write_results_file(output_file, list(all_results.values()))
+    # The journal is only removed once its results are safely in the output file
+    journal.clear()
+    return len(all_results)
+
+def filter_landmarks_to_search(landmarks: List[str], existing_results: Container[str],
+                               negative_cache: Optional[NegativeResultCache] = None) -> List[str]:
+    """Filter out landmarks that already have results or recently came up empty.
+    
+    existing_results is anything supporting `landmark in existing_results`, such as the dict
+    from load_existing_results or a LandmarkResultsStore.
+    """
     landmarks_to_search = []
+    backed_off = 0
     
     for landmark in landmarks:
-        if landmark not in existing_results:
-            landmarks_to_search.append(landmark)
-        else:
+        if landmark in existing_results:
             logger.debug(f"Skipping {landmark} - already have result")
+        elif negative_cache and not negative_cache.should_search(landmark, WikiCommonsSearcher.query_plan_fingerprint(landmark)):
+            logger.debug(f"Skipping {landmark} - no result on a recent search")
+            backed_off += 1
+        else:
+            landmarks_to_search.append(landmark)
     
-    logger.info(f"Need to search for {len(landmarks_to_search)} landmarks ({len(landmarks) - len(landmarks_to_search)} already found)")
+    logger.info(f"Need to search for {len(landmarks_to_search)} landmarks "
+                f"({len(landmarks) - len(landmarks_to_search) - backed_off} already found, "
+                f"{backed_off} without a result on a recent run)")
     return landmarks_to_search
 
-async def search_landmark_images(landmarks: List[str], max_concurrent: int = 5) -> List[Dict]:
-    """Search for images of all landmarks concurrently."""
-    results = []
-    
-    # Create semaphore to limit concurrent requests
-    semaphore = asyncio.Semaphore(max_concurrent)
+async def iter_landmark_images(landmarks: Iterable[str], max_concurrent: int = 5,
+                               **searcher_options) -> AsyncIterator[Tuple[str, List[Dict], bool]]:
+    """Search for images of landmarks concurrently, yielding (landmark, results, complete) as each completes.
     
+    A fixed pool of workers pulls landmarks from the iterable, so memory stays flat no matter
+    how many landmarks there are. Landmarks whose search raised an error are logged and skipped.
+    complete is False when some query of the search went unanswered, so empty results are only
+    conclusive when it is True.
+    Extra keyword arguments (cache, race_strategies, ...) are passed to WikiCommonsSearcher.
+    """
     async with aiohttp.ClientSession(
         timeout=aiohttp.ClientTimeout(total=30),
         headers={'User-Agent': 'WikiCommons Landmark Image Finder/1.0'}
     ) as session:
-        searcher = WikiCommonsSearcher(session)
+        searcher = WikiCommonsSearcher(session, **searcher_options)
+        pending_landmarks = iter(landmarks)
+        completed: asyncio.Queue = asyncio.Queue(maxsize=max_concurrent)
         
-        async def search_with_semaphore(landmark: str) -> List[Dict]:
-            async with semaphore:
+        async def worker() -> None:
+            for landmark in pending_landmarks:
                 logger.info(f"Searching for images of: {landmark}")
-                return await searcher.search_quality_images(landmark)
+                try:
+                    result, complete = await searcher.search_landmark(landmark)
+                except TimeoutError:
+                    logger.warning(f"Search for {landmark} exceeded its {searcher.landmark_timeout}s budget")
+                    continue
+                except Exception as e:
+                    logger.error(f"Error searching for {landmark}: {str(e)}")
+                    continue
+                
+                if result:  # If images were found
+                    logger.info(f"Found {len(result)} image(s) for: {landmark}")
+                elif complete:
+                    logger.warning(f"No images with location data found for: {landmark}")
+                else:
+                    logger.warning(f"No images found for {landmark}, but some queries went unanswered")
+                await completed.put((landmark, result, complete))
         
-        # Create tasks for all landmarks
-        tasks = [search_with_semaphore(landmark) for landmark in landmarks]
+        async def run_workers() -> None:
+            await asyncio.gather(*(worker() for _ in range(max_concurrent)))
+            await completed.put(None)  # Signal that every landmark has been searched
         
-        # Execute all searches concurrently
-        landmark_results = await asyncio.gather(*tasks, return_exceptions=True)
+        runner = asyncio.create_task(run_workers())
+        try:
+            while (item := await completed.get()) is not None:
+                yield item
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
         
-        # Process results
-        for i, result in enumerate(landmark_results):
-            if isinstance(result, Exception):
-                logger.error(f"Error searching for {landmarks[i]}: {str(result)}")
+        if searcher.coalesced_requests or searcher.image_info_memo_hits:
+            logger.info(f"Saved {searcher.coalesced_requests + searcher.image_info_memo_hits} lookups: "
+                        f"{searcher.coalesced_requests} requests shared with identical in-flight requests, "
+                        f"{searcher.image_info_memo_hits} image infos served from memory")
+        if searcher.geo_index_lookups:
+            logger.info(f"Answered {searcher.geo_index_lookups} location lookups from the geotag index")
+        if searcher.rate_limiter.throttled:
+            logger.info(f"Commons API throttled {searcher.rate_limiter.throttled} requests "
+                        f"({searcher.retries} retries)")
+
+async def search_landmark_images(landmarks: List[str], max_concurrent: int = 5, **searcher_options) -> List[Dict]:
+    """Search for images of all landmarks concurrently."""
+    results = []
+    async for _, landmark_results, _ in iter_landmark_images(landmarks, max_concurrent, **searcher_options):
+        results.extend(landmark_results)
+    return results
+
+def parse_shard_spec(value: str) -> Tuple[int, int]:
+    """Parse a shard given as INDEX/COUNT (zero-based index)."""
+    match = re.fullmatch(r'(\d+)/(\d+)', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Shard must look like INDEX/COUNT, got: {value}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise argparse.ArgumentTypeError(f"Shard index must be between 0 and {count - 1}: {value}")
+    return index, count
+
+def shard_path(path: str, index: int, count: int) -> str:
+    """Per-shard variant of an output path (landmark_images.json -> landmark_images.shard-0-of-4.json)."""
+    file_path = Path(path)
+    return str(file_path.with_name(f"{file_path.stem}.shard-{index}-of-{count}{file_path.suffix}"))
+
+def shard_landmarks(landmarks: List[str], index: int, count: int) -> List[str]:
+    """Deterministically select the landmarks that belong to one shard.
+    
+    Landmarks are assigned by a hash of their name rather than their position, so a shard
+    keeps the same landmarks when the list is reordered or extended.
+    """
+    return [
+        landmark for landmark in landmarks
+        if int(hashlib.sha1(landmark.encode('utf-8')).hexdigest(), 16) % count == index
+    ]
+
+def merge_shard_outputs(output_file: str, shard_files: List[str], store_file: Optional[str] = None) -> Optional[int]:
+    """Merge shard results into the main results file, de-duplicating by landmark and file title.
+    
+    Results in the results store (when shards wrote to one) take precedence, then results
+    already in the main file, then shards in the order given. Merged shard files, their
+    journals and their negative-result records are removed afterwards.
+    
+    Returns:
+        The number of merged results, or None if a results file couldn't be read, in which
+        case nothing is written or removed
+    """
+    merged = {}
+    seen_titles = set()
+    duplicates = 0
+    
+    try:
+        sources = [load_existing_results(output_file, strict=True).values()]
+        sources += [load_existing_results(shard, journal_path_for(shard), strict=True).values()
+                    for shard in shard_files]
+    except Exception:
+        logger.error(f"Not merging into {output_file}: a results file couldn't be read; fix or move it and rerun")
+        return None
+    
+    store = LandmarkResultsStore(store_file) if store_file else None
+    if store is not None:
+        sources.insert(0, store.iter_results())
+    
+    for source in sources:
+        for result in source:
+            landmark = result.get('landmark', '')
+            title = result.get('title', '')
+            if landmark in merged or (title and title in seen_titles):
+                duplicates += 1
                 continue
-            
-            if result:  # If images were found
-                results.extend(result)
-                logger.info(f"Found {len(result)} image(s) for: {landmarks[i]}")
-            else:
-                logger.warning(f"No images with location data found for: {landmarks[i]}")
+            merged[landmark] = result
+            if title:
+                seen_titles.add(title)
     
-    return results
+    write_results_file(output_file, list(merged.values()))
+    if store is not None:
+        store.upsert_results(merged.values())
+        store.close()
+    
+    negative_cache = NegativeResultCache(DEFAULT_MISSES_FILE)
+    for shard_file in shard_files:
+        match = re.search(r'\.shard-(\d+)-of-(\d+)\.json$', shard_file)
+        if match:
+            misses_file = shard_path(DEFAULT_MISSES_FILE, int(match.group(1)), int(match.group(2)))
+            negative_cache.merge_from(misses_file)
+            Path(misses_file).unlink(missing_ok=True)
+        Path(shard_file).unlink(missing_ok=True)
+        Path(journal_path_for(shard_file)).unlink(missing_ok=True)
+    
+    for landmark in merged:
+        negative_cache.entries.pop(landmark, None)
+    negative_cache.compact()
+    
+    logger.info(f"Merged {len(shard_files)} shard(s) into {output_file}: {len(merged)} results, "
+                f"{duplicates} duplicates dropped")
+    return len(merged)
 
-async def main():
-    """Main function to run the landmark image search."""
+def run_shard_process(args: argparse.Namespace, index: int, count: int) -> None:
+    """Entry point of a worker process that searches one shard with its own event loop and session."""
+    shard_args = argparse.Namespace(**{
+        **vars(args),
+        'shard': (index, count),
+        'processes': None,
+        'rate': args.rate / count  # The API rate limit is shared by all shards
+    })
+    asyncio.run(run_search(shard_args))
+
+async def run_sharded(args: argparse.Namespace) -> None:
+    """Search all shards in parallel local processes, then merge their outputs."""
+    count = args.processes
+    logger.info(f"Searching in {count} shard processes")
+    
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=count, mp_context=multiprocessing.get_context('spawn')) as pool:
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(pool, run_shard_process, args, index, count) for index in range(count)),
+            return_exceptions=True
+        )
+    
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Shard {index}/{count} failed: {outcome!r}")
+    
+    # Shards that failed keep their journals, which the merge still picks up
+    shard_files = [shard_path(DEFAULT_OUTPUT_FILE, index, count) for index in range(count)]
+    merge_shard_outputs(DEFAULT_OUTPUT_FILE, shard_files, args.store)
+
+def open_results_store(store_file: str, output_file: str, journal: ResultJournal) -> LandmarkResultsStore:
+    """Open the results store, importing the JSON results into a new store and any journal into it.
+    
+    A new store is seeded from the main results file, plus output_file when it is a shard's.
+    """
+    store = LandmarkResultsStore(store_file)
+    if len(store) == 0:
+        for results_file in dict.fromkeys([DEFAULT_OUTPUT_FILE, output_file]):
+            # Raise on an unreadable results file rather than starting over and exporting over it
+            existing_results = load_existing_results(results_file, strict=True)
+            if existing_results:
+                store.upsert_results(existing_results.values())
+                logger.info(f"Imported {len(existing_results)} existing results from {results_file} into {store_file}")
+    if journal.path.exists():
+        # Results journaled by an interrupted JSON-file run go in whether or not the store is new
+        journaled = store.upsert_results(journal.read())
+        if journaled:
+            logger.info(f"Imported {journaled} journaled results from {journal.path} into {store_file}")
+        journal.clear()
+    return store
+
+async def run_search(args: argparse.Namespace) -> None:
+    """Run the landmark image search for the whole landmark list or for a single shard."""
     # Get landmarks file path from command line or use default
-    landmarks_file = sys.argv[1] if len(sys.argv) > 1 else "public_images/landmarks.txt"
+    landmarks_file = args.landmarks_file
     
     if not Path(landmarks_file).exists():
         logger.error(f"Landmarks file not found: {landmarks_file}")
@@ -540,11 +1580,13 @@ async def main():
     
     logger.info(f"Starting landmark image search from: {landmarks_file}")
     
-    # Define output file path
-    output_file = "public_images/landmark_images.json"
-    
-    # Load existing results if they exist
-    existing_results = load_existing_results(output_file)
+    # Define output file path; results are journaled there as they arrive and compacted at the end
+    output_file = DEFAULT_OUTPUT_FILE
+    misses_file = DEFAULT_MISSES_FILE
+    if args.shard:
+        output_file = shard_path(DEFAULT_OUTPUT_FILE, *args.shard)
+        misses_file = shard_path(DEFAULT_MISSES_FILE, *args.shard)
+    journal = ResultJournal(journal_path_for(output_file))
     
     # Parse landmarks from file
     landmarks = parse_landmarks_file(landmarks_file)
@@ -552,46 +1594,194 @@ async def main():
         logger.error("No landmarks found in file")
         sys.exit(1)
     
-    # Filter out landmarks that already have results
-    landmarks_to_search = filter_landmarks_to_search(landmarks, existing_results)
+    store = None
+    if args.store:
+        # Results are upserted into the store as they arrive, so no journal is needed
+        store = open_results_store(args.store, output_file, journal)
+        store.record_landmarks(landmarks)
+        existing_results = store
+    else:
+        # Load existing results if they exist, resuming from the journal of an interrupted run
+        existing_results = load_existing_results(output_file, str(journal.path))
+        if args.shard:
+            # Landmarks already in the main results file don't need searching either
+            existing_results = {**load_existing_results(DEFAULT_OUTPUT_FILE), **existing_results}
+    
+    if args.shard:
+        landmarks = shard_landmarks(landmarks, *args.shard)
+        logger.info(f"Shard {args.shard[0]}/{args.shard[1]}: {len(landmarks)} landmarks")
     
+    # Filter out landmarks that already have results or are backing off after a miss
+    negative_cache = NegativeResultCache(misses_file)
+    if args.shard:
+        negative_cache.merge_from(DEFAULT_MISSES_FILE)
+    landmarks_to_search = filter_landmarks_to_search(
+        landmarks, existing_results, None if args.retry_misses else negative_cache
+    )
+    found_before = sum(1 for landmark in landmarks if landmark in existing_results)
     if not landmarks_to_search:
-        logger.info("All landmarks already have results!")
+        if store is not None:
+            store.close()
+        elif journal.path.exists():
+            compact_results(output_file, journal)
+        negative_cache.compact()
+        logger.info("All landmarks already have results or were searched recently!")
         return
     
-    # Search for images of remaining landmarks
-    new_results = await search_landmark_images(landmarks_to_search)
+    # Open the response cache if requested
+    cache = None
+    if args.cache:
+        cache = CommonsResponseCache(args.cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+        logger.info(f"Using Commons API response cache: {args.cache}")
+    
+    geo_index = None
+    if args.geo_index:
+        geo_index = CommonsGeoIndex(args.geo_index)
+        logger.info(f"Using geotag index with {len(geo_index)} files: {args.geo_index}")
+    if args.offline:
+        logger.info("Offline: only cached API responses and the geotag index are used")
     
-    # Combine existing and new results
-    all_results = list(existing_results.values()) + new_results
+    # Search for images of remaining landmarks, journaling each result as it arrives
+    new_count = 0
+    new_preview = []
+    try:
+        async for landmark, landmark_results, complete in iter_landmark_images(
+            landmarks_to_search,
+            max_concurrent=args.concurrent_landmarks,
+            cache=cache,
+            rate_limiter=AdaptiveRateLimiter(rate=args.rate, burst=max(1, int(args.rate)),
+                                             max_concurrency=args.max_api_concurrency),
+            race_strategies=args.race,
+            landmark_timeout=args.landmark_timeout,
+            max_requests_per_landmark=args.max_requests_per_landmark,
+            geo_index=geo_index,
+            offline=args.offline
+        ):
+            if store is not None:
+                store.upsert_results(landmark_results)
+            for result in landmark_results:
+                if store is None:
+                    journal.append(result)
+                new_count += 1
+                if len(new_preview) < 5:
+                    new_preview.append(result)
+            
+            if landmark_results:
+                negative_cache.record_hit(landmark)
+            elif complete and not args.offline:
+                # An offline miss may only mean the responses weren't cached, so it doesn't count;
+                # neither does a search that lost queries to errors, throttling or its request budget
+                negative_cache.record_miss(landmark, WikiCommonsSearcher.query_plan_fingerprint(landmark))
+    finally:
+        journal.close()
+        negative_cache.compact()
+        if geo_index is not None:
+            geo_index.close()
+        if cache:
+            stats = cache.stats()
+            logger.info(f"Cache stats: {stats['hits']} hits, {stats['misses']} misses, "
+                        f"{stats['expired']} expired, {stats['evicted']} evicted")
+            cache.close()
     
-    # Save combined results to JSON file
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(all_results, f, indent=2, ensure_ascii=False)
+    if store is not None:
+        # Shards share the store; the JSON export is left to the merge step
+        missing_count = len(store.missing_landmarks())
+        if args.shard:
+            total_results = len(store)
+        else:
+            total_results = store.export_json(output_file)
+        store.close()
+        logger.info(f"Results stored in {args.store} ({missing_count} landmarks still without a result)")
+    else:
+        # Compact the journal into the combined JSON results file
+        total_results = compact_results(output_file, journal)
+        if total_results is None:
+            # The results are still safe in the journal; count what it holds
+            total_results = sum(1 for _ in journal.read())
     
-    logger.info(f"Search complete! Found {len(new_results)} new images with location data")
-    logger.info(f"Total results: {len(all_results)} images")
-    logger.info(f"Results saved to: {output_file}")
+    logger.info(f"Search complete! Found {new_count} new images with location data")
+    logger.info(f"Total results: {total_results} images")
+    if not (store is not None and args.shard):
+        logger.info(f"Results saved to: {output_file}")
     
     # Print summary
     print(f"\nSummary:")
     print(f"- Total landmarks: {len(landmarks)}")
-    print(f"- Previously found: {len(existing_results)}")
+    print(f"- Previously found: {found_before}")
     print(f"- Searched this run: {len(landmarks_to_search)}")
-    print(f"- New results found: {len(new_results)}")
-    print(f"- Total images with locations: {len(all_results)}")
-    print(f"- Overall success rate: {len(all_results)/len(landmarks)*100:.1f}%")
+    print(f"- Without a result (backing off): {len(negative_cache.entries)}")
+    print(f"- New results found: {new_count}")
+    print(f"- Total images with locations: {total_results}")
+    print(f"- Overall success rate: {(found_before + new_count)/len(landmarks)*100:.1f}%")
     
     # Show new results found this run
-    if new_results:
+    if new_preview:
         print(f"\nNew results found this run:")
-        for i, result in enumerate(new_results[:5]):
+        for i, result in enumerate(new_preview):
             print(f"{i+1}. {result['landmark']}")
             print(f"   URL: {result['commons_url']}")
             location = result['location']
             print(f"   Location: {location.get('lat', 'N/A')}, {location.get('lon', 'N/A')}")
             print()
 
+async def main():
+    """Main function to run the landmark image search."""
+    parser = argparse.ArgumentParser(description="Search Wikimedia Commons for geotagged landmark images.")
+    parser.add_argument('landmarks_file', nargs='?', default="public_images/landmarks.txt",
+                        help="Numbered list of landmarks (default: public_images/landmarks.txt)")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE_FILE, default=None, metavar='CACHE_FILE',
+                        help=f"Cache API responses on disk (default file: {DEFAULT_CACHE_FILE})")
+    parser.add_argument('--cache-max-mb', type=int, default=512,
+                        help="Maximum size of the response cache in MB (default: 512)")
+    parser.add_argument('--retry-misses', action='store_true',
+                        help="Search landmarks again even if a recent search found nothing")
+    parser.add_argument('--race', action='store_true',
+                        help="Run search strategies concurrently, keeping their order of preference")
+    parser.add_argument('--landmark-timeout', type=float, default=None, metavar='SECONDS',
+                        help="Give up on a landmark after this many seconds")
+    parser.add_argument('--max-requests-per-landmark', type=int, default=None, metavar='N',
+                        help="Cap on API requests made for a single landmark")
+    parser.add_argument('--concurrent-landmarks', type=int, default=5, metavar='N',
+                        help="Number of landmarks searched at the same time (default: 5)")
+    parser.add_argument('--rate', type=float, default=10.0, metavar='REQUESTS_PER_SECOND',
+                        help="Maximum Commons API request rate (default: 10)")
+    parser.add_argument('--max-api-concurrency', type=int, default=16, metavar='N',
+                        help="Upper bound for concurrent API requests (default: 16)")
+    parser.add_argument('--shard', type=parse_shard_spec, default=None, metavar='INDEX/COUNT',
+                        help="Only search one shard of the landmarks (e.g. 0/4) and write per-shard output")
+    parser.add_argument('--processes', type=int, default=None, metavar='N',
+                        help="Search N shards in parallel local processes and merge the results")
+    parser.add_argument('--merge', nargs='*', default=None, metavar='SHARD_FILE',
+                        help="Merge shard outputs (default: all in public_images/) into landmark_images.json")
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE_FILE, default=None, metavar='STORE_FILE',
+                        help=f"Keep results in an indexed SQLite store (default file: {DEFAULT_STORE_FILE}) "
+                             f"and export landmark_images.json from it")
+    parser.add_argument('--geo-index', nargs='?', const=DEFAULT_GEO_INDEX_FILE, default=None, metavar='INDEX_FILE',
+                        help=f"Answer geosearches and location checks from a local geotag index built by "
+                             f"commons_geo_index.py (default file: {DEFAULT_GEO_INDEX_FILE})")
+    parser.add_argument('--offline', action='store_true',
+                        help="Never call the Commons API; use only --cache responses and --geo-index")
+    args = parser.parse_args()
+    
+    if args.offline and not (args.cache or args.geo_index):
+        parser.error("--offline needs --cache and/or --geo-index to search anything")
+    
+    if args.merge is not None:
+        shard_files = args.merge or sorted(str(path) for path in Path(DEFAULT_OUTPUT_FILE).parent.glob(
+            f"{Path(DEFAULT_OUTPUT_FILE).stem}.shard-*-of-*.json"
+        ))
+        total_results = merge_shard_outputs(DEFAULT_OUTPUT_FILE, shard_files, args.store)
+        if total_results is None:
+            sys.exit(1)
+        print(f"Merged {len(shard_files)} shard file(s); {total_results} results in {DEFAULT_OUTPUT_FILE}")
+        return
+    
+    if args.processes and args.processes > 1:
+        await run_sharded(args)
+        return
+    
+    await run_search(args)
+
 if __name__ == "__main__":
     # Run the async main function
     asyncio.run(main())
\ No newline at end of file
@@ -142,6 +142,12 @@ export async function onRequestDelete(context: any): Promise<Response> {
 			const thumbnailKey = `thumbnails/${imageId}.${metadata.filename.split('.').pop()}`;
 			await env.IMAGES_BUCKET.delete(thumbnailKey);
 
+			// Delete pre-resized derivatives stored next to the original (see upload-simple)
+			const derivatives = await env.IMAGES_BUCKET.list({ prefix: `images/${imageId}/` });
+			await Promise.all(
+				derivatives.objects.map((object: { key: string }) => env.IMAGES_BUCKET.delete(object.key))
+			);
+
 			// Delete metadata from KV
 			await env.IMAGE_DATA.delete(`image:${imageId}`);
 
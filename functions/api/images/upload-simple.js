@@ -54,27 +54,42 @@ class ImageDB {
 	}
 
 	async createImage(image) {
+		const row = {
+			id: image.id,
+			filename: image.filename,
+			r2_key: image.r2Key,
+			location_lat: image.location.lat,
+			location_lng: image.location.lng,
+			uploaded_by: image.uploadedBy,
+			uploaded_by_username: image.uploadedByUsername,
+			file_size: image.fileSize,
+			mime_type: image.mimeType,
+			is_public: image.isPublic ? 1 : 0,
+			source_url: image.sourceUrl || null,
+			thumbnail_key: image.derivatives?.thumbnail || null,
+			medium_key: image.derivatives?.medium || null,
+			tags: JSON.stringify(image.tags || [])
+		};
+		try {
+			return await this.insertImageRow(row);
+		} catch (error) {
+			// Databases not yet migrated (migrations/0001_image_derivative_keys.sql) lack the
+			// derivative columns: keep the image, which then falls back to the original
+			if (!/no column named (thumbnail_key|medium_key)/.test(error?.message || String(error))) throw error;
+			const legacyRow = { ...row };
+			delete legacyRow.thumbnail_key;
+			delete legacyRow.medium_key;
+			return await this.insertImageRow(legacyRow);
+		}
+	}
+
+	async insertImageRow(row) {
+		const columns = Object.keys(row);
 		const result = await this.db.prepare(`
-			INSERT INTO images (
-				id, filename, r2_key, location_lat, location_lng, 
-				uploaded_by, uploaded_by_username, file_size, mime_type, 
-				is_public, source_url, tags, created_at
-			) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+			INSERT INTO images (${columns.join(', ')}, created_at)
+			VALUES (${columns.map(() => '?').join(', ')}, datetime('now'))
 			RETURNING *
-		`).bind(
-			image.id,
-			image.filename,
-			image.r2Key,
-			image.location.lat,
-			image.location.lng,
-			image.uploadedBy,
-			image.uploadedByUsername,
-			image.fileSize,
-			image.mimeType,
-			image.isPublic ? 1 : 0,
-			image.sourceUrl || null,
-			JSON.stringify(image.tags || [])
-		).first();
+		`).bind(...Object.values(row)).first();
 		return result;
 	}
 }
@@ -282,6 +297,32 @@ export async function onRequestPost(context) {
 		const r2Key = `images/${uniqueId}/${sanitizedName}`;
 
 		try {
+			// Store optional pre-resized versions (e.g. from upload_landmark_images.py) next to the original
+			const derivatives = {};
+			for (const variant of ['medium', 'thumbnail']) {
+				const derivativeFile = formData.get(variant);
+				if (
+					!derivativeFile ||
+					typeof derivativeFile === 'string' ||
+					!allowedTypes.includes(derivativeFile.type) ||
+					derivativeFile.size > maxSizeBytes
+				) {
+					continue;
+				}
+				const derivativeExtension = derivativeFile.name.split('.').pop() || 'jpg';
+				const derivativeKey = `images/${uniqueId}/${variant}.${derivativeExtension}`;
+				await env.IMAGES_BUCKET.put(derivativeKey, await derivativeFile.arrayBuffer(), {
+					httpMetadata: {
+						contentType: derivativeFile.type,
+						cacheControl: 'public, max-age=31536000' // 1 year cache
+					}
+				});
+				derivatives[variant] = derivativeKey;
+			}
+			const derivativeMetadata = Object.fromEntries(
+				Object.entries(derivatives).map(([variant, key]) => [`${variant}Key`, key])
+			);
+
 			// Upload to R2
 			await env.IMAGES_BUCKET.put(r2Key, await imageFile.arrayBuffer(), {
 				httpMetadata: {
@@ -293,13 +334,16 @@ export async function onRequestPost(context) {
 					uploadedAt: new Date().toISOString(),
 					locationLat: String(location.lat),
 					locationLng: String(location.lng || location.lon), // Support both lng and lon
-					uploadedBy: user.id // Track who uploaded this image
+					uploadedBy: user.id, // Track who uploaded this image
+					...derivativeMetadata
 				}
 			});
 
 			// Construct the image URL
 			const imageUrl = `/api/images/${uniqueId}/${sanitizedName}`;
-			const thumbnailUrl = `/api/images/${uniqueId}/${sanitizedName}?w=300&h=300&fit=cover&q=80`;
+			const thumbnailUrl = derivatives.thumbnail
+				? `/api/images/${derivatives.thumbnail.slice('images/'.length)}`
+				: `/api/images/${uniqueId}/${sanitizedName}?w=300&h=300&fit=cover&q=80`;
 
 			// Prepare metadata for response
 			const metadata = {
@@ -317,6 +361,7 @@ export async function onRequestPost(context) {
 				mimeType: imageFile.type,
 				url: imageUrl,
 				thumbnailUrl: thumbnailUrl,
+				derivatives: derivatives,
 				isPublic: isPublic,
 				...(sourceUrl && sourceUrl.trim() && { sourceUrl: sourceUrl.trim() })
 			};
@@ -336,6 +381,7 @@ export async function onRequestPost(context) {
 				mimeType: imageFile.type,
 				isPublic: isPublic,
 				sourceUrl: sourceUrl?.trim() || undefined,
+				derivatives: derivatives,
 				tags: []
 			});
 
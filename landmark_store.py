@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+landmark_store.py - Indexed SQLite store for landmark image search results and uploads.
+
+find_photo.py writes each result here with a transactional upsert as soon as a landmark
+completes, and upload_landmark_images.py reads pending results from it and records the
+server image ID of every successful upload. The store can be exported to (and imported
+from) the landmark_images.json format at any time.
+
+Usage:
+    python landmark_store.py [store_file] missing [landmarks_file]
+    python landmark_store.py [store_file] duplicates
+    python landmark_store.py [store_file] export [json_file]
+    python landmark_store.py [store_file] import [json_file]
+
+Example:
+    python landmark_store.py public_images/landmark_images.db missing public_images/landmarks.txt
+    python landmark_store.py public_images/landmark_images.db export public_images/landmark_images.json
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_FILE = "public_images/landmark_images.db"
+
+# Keys of a result that have their own columns; anything else is kept in the `extra` JSON column
+RESULT_COLUMNS = ('title', 'landmark', 'url', 'description', 'location', 'commons_url', 'search_strategy')
+
+class LandmarkResultsStore:
+    """SQLite store of one search result per landmark, plus the landmark list and upload records."""
+    
+    def __init__(self, db_path: str = DEFAULT_STORE_FILE):
+        self.db_path = db_path
+        # Several find_photo.py shard processes may write at the same time
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS results (
+                landmark TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                description TEXT NOT NULL DEFAULT '',
+                lat REAL,
+                lon REAL,
+                country TEXT,
+                region TEXT,
+                commons_url TEXT NOT NULL DEFAULT '',
+                search_strategy TEXT,
+                extra TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_title ON results (title);
+            CREATE INDEX IF NOT EXISTS idx_results_url ON results (url);
+            
+            CREATE TABLE IF NOT EXISTS landmarks (
+                name TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL
+            );
+            
+            CREATE TABLE IF NOT EXISTS uploads (
+                landmark TEXT PRIMARY KEY,
+                image_id TEXT,
+                image_url TEXT,
+                uploaded_at REAL NOT NULL
+            );
+        ''')
+        self.conn.commit()
+    
+    def __contains__(self, landmark: str) -> bool:
+        """Whether a landmark has a result (primary key lookup)."""
+        return self.conn.execute('SELECT 1 FROM results WHERE landmark = ?', (landmark,)).fetchone() is not None
+    
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+    
+    def _result_row(self, result: Dict, now: float) -> Tuple:
+        location = result.get('location') or {}
+        extra = {key: value for key, value in result.items() if key not in RESULT_COLUMNS}
+        return (
+            result['landmark'],
+            result.get('title', ''),
+            result.get('url', ''),
+            result.get('description', '') or '',
+            location.get('lat'),
+            location.get('lon'),
+            location.get('country'),
+            location.get('region'),
+            result.get('commons_url', ''),
+            result.get('search_strategy'),
+            json.dumps(extra, ensure_ascii=False),
+            now,
+            now
+        )
+    
+    def upsert_results(self, results: Iterable[Dict]) -> int:
+        """Insert or update results in a single transaction. Returns the number written."""
+        now = time.time()
+        rows = [self._result_row(result, now) for result in results if result.get('landmark')]
+        with self.conn:
+            self.conn.executemany('''
+                INSERT INTO results (landmark, title, url, description, lat, lon, country, region,
+                                     commons_url, search_strategy, extra, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (landmark) DO UPDATE SET
+                    title = excluded.title,
+                    url = excluded.url,
+                    description = excluded.description,
+                    lat = excluded.lat,
+                    lon = excluded.lon,
+                    country = excluded.country,
+                    region = excluded.region,
+                    commons_url = excluded.commons_url,
+                    search_strategy = excluded.search_strategy,
+                    extra = excluded.extra,
+                    updated_at = excluded.updated_at
+            ''', rows)
+        return len(rows)
+    
+    def upsert_result(self, result: Dict) -> None:
+        """Insert or update the result for one landmark."""
+        self.upsert_results([result])
+    
+    def _row_to_result(self, row: sqlite3.Row) -> Dict:
+        """Convert a row back to the landmark_images.json result shape."""
+        location = {'lat': row['lat'], 'lon': row['lon']}
+        if row['country'] is not None or row['region'] is not None:
+            location.update({'country': row['country'] or '', 'region': row['region'] or ''})
+        
+        result = {
+            'title': row['title'],
+            'landmark': row['landmark'],
+            'url': row['url'],
+            'description': row['description'],
+            'location': location,
+            'commons_url': row['commons_url']
+        }
+        if row['search_strategy']:
+            result['search_strategy'] = row['search_strategy']
+        result.update(json.loads(row['extra'] or '{}'))
+        return result
+    
+    def get_result(self, landmark: str) -> Optional[Dict]:
+        row = self.conn.execute('SELECT * FROM results WHERE landmark = ?', (landmark,)).fetchone()
+        return self._row_to_result(row) if row else None
+    
+    def iter_results(self) -> Iterator[Dict]:
+        """Yield every result in insertion order without loading them all at once."""
+        for row in self.conn.execute('SELECT * FROM results ORDER BY rowid'):
+            yield self._row_to_result(row)
+    
+    def record_landmarks(self, landmarks: Iterable[str]) -> None:
+        """Remember the landmark list so missing landmarks can be queried later."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO landmarks (name, first_seen) VALUES (?, ?)',
+                ((landmark, now) for landmark in landmarks)
+            )
+    
+    def missing_landmarks(self) -> List[str]:
+        """Recorded landmarks that don't have a result yet."""
+        rows = self.conn.execute('''
+            SELECT landmarks.name FROM landmarks
+            LEFT JOIN results ON results.landmark = landmarks.name
+            WHERE results.landmark IS NULL
+            ORDER BY landmarks.rowid
+        ''')
+        return [row['name'] for row in rows]
+    
+    def duplicate_titles(self) -> List[Tuple[str, List[str]]]:
+        """File titles used by more than one landmark, with the landmarks using them."""
+        rows = self.conn.execute('''
+            SELECT title, GROUP_CONCAT(landmark, char(31)) AS landmarks FROM results
+            GROUP BY title HAVING COUNT(*) > 1
+            ORDER BY title
+        ''')
+        return [(row['title'], row['landmarks'].split('\x1f')) for row in rows]
+    
+    def record_upload(self, landmark: str, image_id: Optional[str] = None, image_url: Optional[str] = None) -> None:
+        """Record that a landmark's image was uploaded to the gallery."""
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO uploads (landmark, image_id, image_url, uploaded_at) VALUES (?, ?, ?, ?)',
+                (landmark, image_id, image_url, time.time())
+            )
+    
+    def pending_uploads(self) -> Iterator[Dict]:
+        """Results whose image has not been uploaded yet, read from the database as they are consumed."""
+        rows = self.conn.execute('''
+            SELECT results.* FROM results
+            LEFT JOIN uploads ON uploads.landmark = results.landmark
+            WHERE uploads.landmark IS NULL
+            ORDER BY results.rowid
+        ''')
+        for row in rows:
+            yield self._row_to_result(row)
+    
+    def import_json(self, json_file: str) -> int:
+        """Import results from a landmark_images.json file. Returns the number imported."""
+        if not Path(json_file).exists():
+            return 0
+        with open(json_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        count = self.upsert_results(results)
+        logger.info(f"Imported {count} results from {json_file} into {self.db_path}")
+        return count
+    
+    def export_json(self, json_file: str) -> int:
+        """Atomically write all results in the landmark_images.json format. Returns the count."""
+        temp_file = f"{json_file}.tmp"
+        count = 0
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            # Stream the array so exporting doesn't need every result in memory
+            f.write('[')
+            for result in self.iter_results():
+                f.write(',\n' if count else '\n')
+                f.write('  ' + json.dumps(result, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+                count += 1
+            f.write('\n]' if count else ']')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, json_file)
+        return count
+    
+    def close(self) -> None:
+        self.conn.close()
+
+def main():
+    """Query or convert a results store from the command line."""
+    args = sys.argv[1:]
+    store_file = DEFAULT_STORE_FILE
+    if args and args[0] not in ('missing', 'duplicates', 'export', 'import'):
+        store_file = args.pop(0)
+    
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    
+    command = args[0]
+    store = LandmarkResultsStore(store_file)
+    try:
+        if command == 'missing':
+            if len(args) > 1:
+                # Imported lazily so querying the store doesn't require aiohttp
+                from find_photo import parse_landmarks_file
+                store.record_landmarks(parse_landmarks_file(args[1]))
+            missing = store.missing_landmarks()
+            for landmark in missing:
+                print(landmark)
+            logger.info(f"{len(missing)} landmarks without a result")
+        elif command == 'duplicates':
+            for title, landmarks in store.duplicate_titles():
+                print(f"{title}: {', '.join(landmarks)}")
+        elif command == 'export':
+            json_file = args[1] if len(args) > 1 else "public_images/landmark_images.json"
+            count = store.export_json(json_file)
+            logger.info(f"Exported {count} results to {json_file}")
+        elif command == 'import':
+            json_file = args[1] if len(args) > 1 else "public_images/landmark_images.json"
+            store.import_json(json_file)
+        else:
+            print(__doc__)
+            sys.exit(1)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
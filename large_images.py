@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+large_images.py - Bounded-memory decoding of huge PNG and TIFF rasters.
+
+Satellite products and scans on Commons can be hundreds of megapixels, far more than
+needed for a 2048px upload. Instead of decoding them whole, these helpers:
+
+- pick the smallest reduced-resolution page (overview) of a multi-page TIFF that still
+  covers the target size
+- decode striped TIFFs and non-interlaced 8-bit PNGs a band of rows at a time, box-reducing
+  each band into the output, so memory stays around one band plus the reduced image
+- stretch 16-bit and floating point rasters to 8 bits
+
+upload_landmark_images.process_image uses them for images over BANDED_DECODE_PIXELS.
+
+Usage:
+    python large_images.py [image_file] [output_file] [max_size]
+    python large_images.py --check [image_file] [max_size]
+
+--check decodes the image both in bands and whole, and fails if the reduced results differ.
+
+Example:
+    python large_images.py umbra_scene.tif umbra_scene.jpg 2048
+"""
+
+import io
+import itertools
+import logging
+import math
+import struct
+import sys
+import zlib
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageOps, TiffImagePlugin, TiffTags
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Images larger than this are decoded in bands where the format allows it
+BANDED_DECODE_PIXELS = 40_000_000
+
+# Pixels decoded per band
+BAND_PIXELS = 4_000_000
+
+# Largest images that are decoded at all: banded ones, and ones that must be decoded whole
+# (Pillow's own decompression bomb limit)
+MAX_BANDED_PIXELS = 2_000_000_000
+MAX_WHOLE_PIXELS = 2 * 89_478_485
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color types decodable in bands (at 8 bits per sample), with their bytes per pixel
+PNG_COLOR_TYPE_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# TIFF tags needed to decode a band of strips on its own
+TIFF_BAND_TAGS = (
+    256,  # ImageWidth
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    278,  # RowsPerStrip
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    532,  # ReferenceBlackWhite
+)
+STRIP_OFFSETS, STRIP_BYTE_COUNTS, IMAGE_LENGTH, ROWS_PER_STRIP = 273, 279, 257, 278
+BITS_PER_SAMPLE, COMPRESSION, SAMPLES_PER_PIXEL = 258, 259, 277
+
+HIGH_BIT_DEPTH_MODES = ('I', 'F', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+
+def to_8bit(img: Image.Image) -> Image.Image:
+    """Stretch a 16-bit or floating point image to 8-bit grayscale, clipping the extreme 0.5%."""
+    if img.mode not in HIGH_BIT_DEPTH_MODES:
+        return img
+    img = img.convert('F')
+    low, high = img.getextrema()
+    if not math.isfinite(low) or not math.isfinite(high):
+        low, high = 0.0, 1.0
+    scale = 255 / (high - low) if high > low else 0
+    img = img.point(lambda value: (value - low) * scale).convert('L')
+    # Satellite images often have a few very bright pixels; don't let them darken the rest
+    return ImageOps.autocontrast(img, cutoff=0.5)
+
+def select_page(img: Image.Image, target_size: Tuple[int, int]) -> Tuple[int, int]:
+    """Seek a multi-page TIFF to its smallest page covering target_size with the same aspect ratio.
+    
+    Returns:
+        The size of the page now selected
+    """
+    full_width, full_height = img.size
+    best_frame, best_size = img.tell(), img.size
+    for frame in range(1, getattr(img, 'n_frames', 1)):
+        img.seek(frame)
+        width, height = img.size
+        same_aspect = abs(width / full_width - height / full_height) <= 0.01 * max(width / full_width, 1e-9)
+        if (same_aspect and width >= target_size[0] and height >= target_size[1]
+                and width * height < best_size[0] * best_size[1]):
+            best_frame, best_size = frame, img.size
+    img.seek(best_frame)
+    if best_frame:
+        logger.info(f"Using {best_size[0]}x{best_size[1]} reduced-resolution page {best_frame} "
+                    f"of a {full_width}x{full_height} TIFF")
+    return best_size
+
+def _png_chunks(fp) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield (type, data) for each chunk of a PNG file, from its start."""
+    fp.seek(0)
+    if fp.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file")
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        data = fp.read(length)
+        fp.read(4)  # CRC; the image was already opened once, so don't check it again
+        yield chunk_type, data
+        if chunk_type == b'IEND':
+            return
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """A PNG chunk: length, type, data and CRC."""
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return b''.join((struct.pack('>I', len(data)), chunk_type, data, struct.pack('>I', crc)))
+
+def _png_info(img: Image.Image) -> Optional[Tuple[int, int, int, int, int]]:
+    """(width, height, bit depth, color type, interlace) from a PNG's IHDR."""
+    chunk_type, data = next(_png_chunks(img.fp))
+    if chunk_type != b'IHDR':
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', data)
+    return width, height, bit_depth, color_type, interlace
+
+def _iter_png_bands(img: Image.Image, rows_per_band: int) -> Iterator[Image.Image]:
+    """Decode a non-interlaced 8-bit PNG a band of rows at a time.
+    
+    The compressed stream is inflated incrementally, and each band's filtered rows are decoded
+    by Pillow as a small PNG of their own. Filters refer to the row above, so every band after
+    the first starts with the previous band's last row, stored unfiltered.
+    """
+    width, height, _, color_type, _ = _png_info(img)
+    stride = width * PNG_COLOR_TYPE_CHANNELS[color_type]
+    header_chunks = []
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    chunks = _png_chunks(img.fp)
+    previous_row = None
+    
+    y = 0
+    while y < height:
+        rows = min(rows_per_band, height - y)
+        needed = rows * (stride + 1)
+        while len(pending) < needed:
+            chunk_type, data = next(chunks)
+            if chunk_type == b'IDAT':
+                pending += inflater.decompress(data)
+            elif chunk_type in (b'PLTE', b'tRNS') and y == 0:
+                header_chunks.append(_png_chunk(chunk_type, data))
+            elif chunk_type == b'IEND':
+                raise ValueError("PNG image data ended early")
+        band_rows = rows
+        if previous_row is not None:
+            pending[0:0] = b'\x00' + previous_row
+            needed += stride + 1
+            band_rows += 1
+        image_data = zlib.compress(memoryview(pending)[:needed], 0)
+        del pending[:needed]
+        
+        ihdr = struct.pack('>IIBBBBB', width, band_rows, 8, color_type, 0, 0, 0)
+        band_png = b''.join((PNG_SIGNATURE, _png_chunk(b'IHDR', ihdr), *header_chunks,
+                             _png_chunk(b'IDAT', image_data), _png_chunk(b'IEND', b'')))
+        del image_data
+        
+        band = Image.open(io.BytesIO(band_png))
+        band.load()
+        del band_png
+        previous_row = band.crop((0, band_rows - 1, width, band_rows)).tobytes()
+        if band_rows > rows:
+            band = band.crop((0, 1, width, band_rows))
+        yield band
+        y += rows
+
+def _iter_tiff_bands(img: Image.Image, rows_per_band: int) -> Iterator[Image.Image]:
+    """Decode a striped TIFF page a band of strips at a time.
+    
+    Strips are compressed independently, so each band is decoded by Pillow (and libtiff) as a
+    small TIFF holding copies of just its strips.
+    """
+    tags = img.tag_v2
+    width, height = img.size
+    rows_per_strip = min(tags.get(ROWS_PER_STRIP, height), height)
+    offsets = tags[STRIP_OFFSETS]
+    byte_counts = tags[STRIP_BYTE_COUNTS]
+    if len(offsets) == 1 and tags.get(COMPRESSION, 1) == 1 and rows_per_band < rows_per_strip:
+        # Uncompressed images are often written as one strip; split it into virtual strips of rows
+        bits = tags.get(BITS_PER_SAMPLE, 1)
+        bits_per_pixel = sum(bits) if isinstance(bits, tuple) else bits * tags.get(SAMPLES_PER_PIXEL, 1)
+        row_bytes = math.ceil(width * bits_per_pixel / 8)
+        rows_per_strip = rows_per_band
+        offsets = [offsets[0] + y * row_bytes for y in range(0, height, rows_per_strip)]
+        byte_counts = [min(rows_per_strip, height - y) * row_bytes for y in range(0, height, rows_per_strip)]
+    strips_per_plane = math.ceil(height / rows_per_strip)
+    planes = len(offsets) // strips_per_plane  # SamplesPerPixel for planar images, otherwise 1
+    strips_per_band = max(1, rows_per_band // rows_per_strip)
+    byte_order = tags.prefix
+    
+    for first_strip in range(0, strips_per_plane, strips_per_band):
+        last_strip = min(first_strip + strips_per_band, strips_per_plane)
+        rows = min(last_strip * rows_per_strip, height) - first_strip * rows_per_strip
+        strips = [plane * strips_per_plane + strip for plane in range(planes)
+                  for strip in range(first_strip, last_strip)]
+        
+        strip_data = []
+        for strip in strips:
+            img.fp.seek(offsets[strip])
+            strip_data.append(img.fp.read(byte_counts[strip]))
+        
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=byte_order + (b'\x2a\x00' if byte_order == b'II' else b'\x00\x2a')
+                                                    + b'\x00' * 4)
+        for tag in TIFF_BAND_TAGS:
+            if tag in tags:
+                ifd[tag] = tags[tag]
+                ifd.tagtype[tag] = tags.tagtype[tag]
+        ifd[IMAGE_LENGTH] = rows
+        ifd[ROWS_PER_STRIP] = rows_per_strip
+        ifd[STRIP_BYTE_COUNTS] = tuple(len(data) for data in strip_data)
+        ifd.tagtype[STRIP_BYTE_COUNTS] = TiffTags.LONG
+        
+        # Relative to the end of the directory; Pillow adds its size when saving it
+        ifd[STRIP_OFFSETS] = tuple(itertools.accumulate((len(data) for data in strip_data[:-1]), initial=0))
+        ifd.tagtype[STRIP_OFFSETS] = TiffTags.LONG
+        band_tiff = io.BytesIO()
+        ifd.save(band_tiff)
+        band_tiff.write(b''.join(strip_data))
+        del strip_data
+        
+        band_tiff.seek(0)
+        band = Image.open(band_tiff)
+        band.load()
+        yield band
+
+def can_decode_in_bands(img: Image.Image) -> bool:
+    """Whether an opened (PNG or TIFF) image can be decoded a band of rows at a time."""
+    try:
+        if img.format == 'PNG':
+            info = _png_info(img)
+            return info is not None and info[2] == 8 and info[3] in PNG_COLOR_TYPE_CHANNELS and info[4] == 0
+        if img.format == 'TIFF':
+            tags = img.tag_v2
+            if STRIP_OFFSETS not in tags or STRIP_BYTE_COUNTS not in tags:
+                return False
+            # Only a single uncompressed strip can be split into bands; other strips are decoded whole
+            rows_per_strip = min(tags.get(ROWS_PER_STRIP, img.height), img.height)
+            splittable = len(tags[STRIP_OFFSETS]) == 1 and tags.get(COMPRESSION, 1) == 1
+            return splittable or rows_per_strip * img.width <= BAND_PIXELS
+    except Exception:
+        return False
+    return False
+
+def banded_decode_bytes(width: int, height: int, target_size: Tuple[int, int], bytes_per_pixel: int = 4) -> int:
+    """Rough peak memory of decode_reduced: a few copies of one band, plus the reduced image."""
+    factor = max(1, min(width // target_size[0], height // target_size[1]))
+    band_pixels = min(BAND_PIXELS, width * height)
+    return 4 * band_pixels * bytes_per_pixel + math.ceil(width / factor) * math.ceil(height / factor) * 4
+
+def _band_mode(band: Image.Image) -> Image.Image:
+    """Convert a decoded band to the mode it is reduced in."""
+    if band.mode == 'P' or band.mode == 'PA':
+        return band.convert('RGBA' if 'transparency' in band.info or band.mode == 'PA' else 'RGB')
+    if band.mode in HIGH_BIT_DEPTH_MODES:
+        return band.convert('F')  # Stretched to 8 bits once the whole image is known
+    if band.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        return band.convert('RGB')
+    return band
+
+def decode_reduced(img: Image.Image, target_size: Tuple[int, int]) -> Optional[Image.Image]:
+    """Decode an opened PNG or TIFF in bands, box-reducing it to no smaller than target_size.
+    
+    Returns:
+        The reduced image in an 8-bit mode (RGB, RGBA, L or LA), or None if the image's
+        layout can't be decoded in bands
+    """
+    if not can_decode_in_bands(img):
+        return None
+    
+    width, height = img.size
+    factor = max(1, min(width // target_size[0], height // target_size[1]))
+    rows_per_band = max(factor, BAND_PIXELS // width // factor * factor)
+    bands = _iter_png_bands(img, rows_per_band) if img.format == 'PNG' else _iter_tiff_bands(img, rows_per_band)
+    
+    reduced = None
+    y = 0  # Source rows reduced so far
+    leftover = None
+    for band in bands:
+        band = _band_mode(band)
+        if leftover is not None:
+            # TIFF strips needn't line up with blocks of factor rows; finish the block started last band
+            joined = Image.new(band.mode, (width, leftover.height + band.height))
+            joined.paste(leftover, (0, 0))
+            joined.paste(band, (0, leftover.height))
+            band = joined
+        
+        # Only whole blocks of factor rows are reduced, except at the bottom of the image
+        rows = band.height if y + band.height >= height else band.height // factor * factor
+        leftover = band.crop((0, rows, width, band.height)) if rows < band.height else None
+        if rows == 0:
+            continue
+        if rows < band.height:
+            band = band.crop((0, 0, width, rows))
+        
+        band = band.reduce(factor) if factor > 1 else band
+        if reduced is None:
+            reduced = Image.new(band.mode, (math.ceil(width / factor), math.ceil(height / factor)))
+        reduced.paste(band, (0, y // factor))
+        y += rows
+    
+    logger.info(f"Decoded {width}x{height} {img.format} in bands of {rows_per_band} rows, "
+                f"reduced to {reduced.width}x{reduced.height}")
+    return to_8bit(reduced)
+
+def check_banded_decode(image_file: str, max_size: int = 2048) -> bool:
+    """Compare the banded decode of an image with a whole decode reduced by the same factor."""
+    with Image.open(image_file) as img:
+        target = (max(1, img.width * max_size // max(img.size)), max(1, img.height * max_size // max(img.size)))
+        factor = max(1, min(img.width // target[0], img.height // target[1]))
+        banded = decode_reduced(img, target)
+        if banded is None:
+            logger.error(f"{image_file} can't be decoded in bands")
+            return False
+    with Image.open(image_file) as img:
+        # Loaded before the file closes: at factor 1 nothing below would decode it
+        img.load()
+        whole = _band_mode(img)
+        whole = to_8bit(whole.reduce(factor) if factor > 1 else whole)
+        
+        if banded.size != whole.size or banded.mode != whole.mode:
+            logger.error(f"Banded decode is {banded.mode} {banded.size}, whole decode is {whole.mode} {whole.size}")
+            return False
+        extrema = ImageChops.difference(banded, whole).getextrema()
+    max_difference = max(high for _, high in extrema) if banded.getbands()[1:] else extrema[1]
+    if max_difference:
+        logger.error(f"Banded decode differs from the whole decode by up to {max_difference}")
+        return False
+    logger.info(f"Banded decode of {image_file} matches the whole decode ({banded.width}x{banded.height})")
+    return True
+
+def main():
+    """Convert one large image to a JPEG no larger than max_size."""
+    if len(sys.argv) >= 3 and sys.argv[1] == '--check':
+        max_size = int(sys.argv[3]) if len(sys.argv) > 3 else 2048
+        sys.exit(0 if check_banded_decode(sys.argv[2], max_size) else 1)
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    
+    # Imported here so the helpers above don't depend on the uploader
+    from upload_landmark_images import process_image
+    
+    max_size = int(sys.argv[3]) if len(sys.argv) > 3 else 2048
+    result = process_image(sys.argv[1], max_size=max_size)
+    if not result['data']:
+        logger.error(f"Could not convert {sys.argv[1]}")
+        sys.exit(1)
+    with open(sys.argv[2], 'wb') as f:
+        f.write(result['data'])
+    logger.info(f"Wrote {result['width']}x{result['height']} {result['format']} to {sys.argv[2]}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+-- R2 keys of the pre-resized versions uploaded alongside an image, if any.
+-- Images without them keep using the original for thumbnails and previews.
+ALTER TABLE images ADD COLUMN thumbnail_key TEXT;
+ALTER TABLE images ADD COLUMN medium_key TEXT;
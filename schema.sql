@@ -127,6 +127,7 @@ CREATE INDEX IF NOT EXISTS idx_images_uploaded_by ON images(uploaded_by);
 CREATE INDEX IF NOT EXISTS idx_images_is_public ON images(is_public);
 CREATE INDEX IF NOT EXISTS idx_images_uploaded_at ON images(uploaded_at);
 CREATE INDEX IF NOT EXISTS idx_images_location ON images(location_lat, location_lng);
+CREATE INDEX IF NOT EXISTS idx_images_source_url ON images(source_url);
 
 CREATE INDEX IF NOT EXISTS idx_games_created_by ON games(created_by);
 CREATE INDEX IF NOT EXISTS idx_games_is_public ON games(is_public);
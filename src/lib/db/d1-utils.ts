@@ -11,6 +11,13 @@ import type {
 
 // Database utility functions for D1
 
+// Databases created before images stored their pre-resized versions lack these columns
+// until migrations/0001_image_derivative_keys.sql has been applied
+function isMissingDerivativeColumn(error: unknown): boolean {
+	const message = error instanceof Error ? error.message : String(error);
+	return /no column named (thumbnail_key|medium_key)/.test(message);
+}
+
 // User operations
 export class UserDB {
 	constructor(private db: D1Database) {}
@@ -222,7 +229,9 @@ export class ImageDB {
 			uploadedAt: result.uploaded_at as string,
 			isPublic: Boolean(result.is_public),
 			tags: result.tags ? JSON.parse(result.tags as string) : [],
-			sourceUrl: result.source_url as string
+			sourceUrl: result.source_url as string,
+			thumbnailKey: (result.thumbnail_key as string) || undefined,
+			mediumKey: (result.medium_key as string) || undefined
 		};
 	}
 
@@ -237,31 +246,41 @@ export class ImageDB {
 		mimeType?: string;
 		isPublic?: boolean;
 		sourceUrl?: string;
+		derivatives?: Record<string, string>; // R2 keys of pre-resized versions by variant
 		tags?: string[];
 	}): Promise<ImageMetadata> {
 		const now = new Date().toISOString();
 		
-		await this.db.prepare(`
-			INSERT INTO images (
-				id, filename, r2_key, location_lat, location_lng, 
-				uploaded_by, uploaded_by_username, uploaded_at, 
-				file_size, mime_type, is_public, source_url, tags
-			) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-		`).bind(
-			imageData.id,
-			imageData.filename,
-			imageData.r2Key,
-			imageData.location.lat,
-			imageData.location.lng,
-			imageData.uploadedBy,
-			imageData.uploadedByUsername || null,
-			now,
-			imageData.fileSize || null,
-			imageData.mimeType || null,
-			imageData.isPublic !== false,
-			imageData.sourceUrl || null,
-			imageData.tags ? JSON.stringify(imageData.tags) : null
-		).run();
+		const row: Record<string, unknown> = {
+			id: imageData.id,
+			filename: imageData.filename,
+			r2_key: imageData.r2Key,
+			location_lat: imageData.location.lat,
+			location_lng: imageData.location.lng,
+			uploaded_by: imageData.uploadedBy,
+			uploaded_by_username: imageData.uploadedByUsername || null,
+			uploaded_at: now,
+			file_size: imageData.fileSize || null,
+			mime_type: imageData.mimeType || null,
+			is_public: imageData.isPublic !== false,
+			source_url: imageData.sourceUrl || null,
+			thumbnail_key: imageData.derivatives?.thumbnail || null,
+			medium_key: imageData.derivatives?.medium || null,
+			tags: imageData.tags ? JSON.stringify(imageData.tags) : null
+		};
+
+		let derivatives = imageData.derivatives;
+		try {
+			await this.insertImageRow(row);
+		} catch (error) {
+			if (!isMissingDerivativeColumn(error)) throw error;
+			// Database not migrated yet: keep the image, which then falls back to the original
+			const legacyRow = { ...row };
+			delete legacyRow.thumbnail_key;
+			delete legacyRow.medium_key;
+			await this.insertImageRow(legacyRow);
+			derivatives = undefined;
+		}
 
 		return {
 			id: imageData.id,
@@ -273,10 +292,19 @@ export class ImageDB {
 			uploadedAt: now,
 			isPublic: imageData.isPublic !== false,
 			tags: imageData.tags || [],
-			sourceUrl: imageData.sourceUrl
+			sourceUrl: imageData.sourceUrl,
+			thumbnailKey: derivatives?.thumbnail,
+			mediumKey: derivatives?.medium
 		};
 	}
 
+	private async insertImageRow(row: Record<string, unknown>): Promise<void> {
+		const columns = Object.keys(row);
+		await this.db.prepare(
+			`INSERT INTO images (${columns.join(', ')}) VALUES (${columns.map(() => '?').join(', ')})`
+		).bind(...Object.values(row)).run();
+	}
+
 	async getUserImages(userId: string, limit = 50, offset = 0): Promise<ImageMetadata[]> {
 		const results = await this.db.prepare(`
 			SELECT * FROM images 
@@ -298,7 +326,9 @@ export class ImageDB {
 			uploadedAt: row.uploaded_at as string,
 			isPublic: Boolean(row.is_public),
 			tags: row.tags ? JSON.parse(row.tags as string) : [],
-			sourceUrl: row.source_url as string
+			sourceUrl: row.source_url as string,
+			thumbnailKey: (row.thumbnail_key as string) || undefined,
+			mediumKey: (row.medium_key as string) || undefined
 		}));
 	}
 
@@ -323,7 +353,36 @@ export class ImageDB {
 			uploadedAt: row.uploaded_at as string,
 			isPublic: Boolean(row.is_public),
 			tags: row.tags ? JSON.parse(row.tags as string) : [],
-			sourceUrl: row.source_url as string
+			sourceUrl: row.source_url as string,
+			thumbnailKey: (row.thumbnail_key as string) || undefined,
+			mediumKey: (row.medium_key as string) || undefined
+		}));
+	}
+
+	async getPublicImagesBySourceUrl(sourceUrl: string, limit = 50): Promise<ImageMetadata[]> {
+		const results = await this.db.prepare(`
+			SELECT * FROM images 
+			WHERE is_public = true AND source_url = ? 
+			ORDER BY uploaded_at DESC 
+			LIMIT ?
+		`).bind(sourceUrl, limit).all();
+
+		return results.results.map(row => ({
+			id: row.id as string,
+			filename: row.filename as string,
+			r2Key: row.r2_key as string,
+			location: { 
+				lat: row.location_lat as number, 
+				lng: row.location_lng as number 
+			},
+			uploadedBy: row.uploaded_by as string,
+			uploadedByUsername: row.uploaded_by_username as string,
+			uploadedAt: row.uploaded_at as string,
+			isPublic: Boolean(row.is_public),
+			tags: row.tags ? JSON.parse(row.tags as string) : [],
+			sourceUrl: row.source_url as string,
+			thumbnailKey: (row.thumbnail_key as string) || undefined,
+			mediumKey: (row.medium_key as string) || undefined
 		}));
 	}
 
@@ -349,7 +408,9 @@ export class ImageDB {
 			uploadedAt: row.uploaded_at as string,
 			isPublic: Boolean(row.is_public),
 			tags: row.tags ? JSON.parse(row.tags as string) : [],
-			sourceUrl: row.source_url as string
+			sourceUrl: row.source_url as string,
+			thumbnailKey: (row.thumbnail_key as string) || undefined,
+			mediumKey: (row.medium_key as string) || undefined
 		}));
 	}
 
@@ -38,6 +38,9 @@ export interface ImageMetadata {
 	isPublic: boolean;
 	tags?: string[];
 	thumbnailUrl?: string;
+	previewUrl?: string;
+	thumbnailKey?: string; // R2 keys of pre-resized versions stored next to the original
+	mediumKey?: string;
 	sourceUrl?: string; // Source URL for attribution (especially for curated public images)
 }
 
@@ -0,0 +1,20 @@
+import type { ImageMetadata } from '$lib/types';
+
+// URL of an object stored under images/ in R2 (served by /api/images/[...path])
+export function imageObjectUrl(r2Key: string): string {
+	return `/api/images/${r2Key.slice('images/'.length)}`;
+}
+
+// Thumbnail and preview URLs for image listings: the pre-resized versions stored with the image,
+// or the original for older images uploaded without them
+export function imageDisplayUrls(image: ImageMetadata): { thumbnailUrl: string; previewUrl: string } {
+	const originalUrl = `/api/images/${image.id}/${image.filename}`;
+	return {
+		thumbnailUrl: image.thumbnailKey
+			? imageObjectUrl(image.thumbnailKey)
+			: image.thumbnailUrl || `${originalUrl}?w=300&h=300&fit=cover&q=80`,
+		previewUrl: image.mediumKey
+			? imageObjectUrl(image.mediumKey)
+			: `${originalUrl}?w=800&h=600&fit=scale-down&q=85`
+	};
+}
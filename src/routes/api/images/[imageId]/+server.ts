@@ -151,6 +151,12 @@ export const DELETE = async ({ params, request, platform }: RequestEvent) => {
 			const thumbnailKey = `thumbnails/${imageId}.${metadata.filename.split('.').pop()}`;
 			await env.IMAGES_BUCKET.delete(thumbnailKey);
 
+			// Delete pre-resized derivatives stored next to the original (see upload-simple)
+			const derivatives = await env.IMAGES_BUCKET.list({ prefix: `images/${imageId}/` });
+			await Promise.all(
+				derivatives.objects.map((object: { key: string }) => env.IMAGES_BUCKET.delete(object.key))
+			);
+
 			// Delete image from D1 database
 			await db.images.deleteImage(imageId);
 
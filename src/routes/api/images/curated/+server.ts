@@ -2,6 +2,7 @@ import { json } from '@sveltejs/kit';
 import type { RequestEvent } from '@sveltejs/kit';
 import type { ImageMetadata } from '$lib/types';
 import { D1Utils } from '$lib/db/d1-utils';
+import { imageDisplayUrls } from '$lib/utils/imageUrls';
 
 // Get curated images specifically from the public@geo.cmxu.io account
 export const GET = async ({ url, platform }: RequestEvent) => {
@@ -38,10 +39,7 @@ export const GET = async ({ url, platform }: RequestEvent) => {
 		const enrichedImages = curatedImages.map((image: ImageMetadata) => ({
 			...image,
 			url: `/api/images/${image.id}/${image.filename}`,
-			thumbnailUrl:
-				image.thumbnailUrl ||
-				`/api/images/${image.id}/${image.filename}?w=300&h=300&fit=cover&q=80`,
-			previewUrl: `/api/images/${image.id}/${image.filename}?w=800&h=600&fit=scale-down&q=85`
+			...imageDisplayUrls(image)
 		}));
 
 		// Get total count efficiently
@@ -2,6 +2,7 @@ import { json } from '@sveltejs/kit';
 import type { RequestEvent } from '@sveltejs/kit';
 import type { ImageMetadata } from '$lib/types';
 import { D1Utils } from '$lib/db/d1-utils';
+import { imageDisplayUrls } from '$lib/utils/imageUrls';
 
 // Get image metadata from KV
 async function getImageMetadata(imageId: string, env: any): Promise<ImageMetadata | null> {
@@ -99,22 +100,23 @@ export const GET = async ({ url, platform }: RequestEvent) => {
 		const offsetParam = url.searchParams.get('offset') || '0';
 		const limit = Math.max(1, parseInt(limitParam)); // No maximum limit
 		const offset = Math.max(0, parseInt(offsetParam));
+		// Lets uploaders check whether an image from a given source is already in the gallery
+		const sourceUrl = url.searchParams.get('sourceUrl')?.trim();
 
 		// Get public images from D1
-		const publicImages = await db.images.getPublicImages(limit, offset);
+		const publicImages = sourceUrl
+			? await db.images.getPublicImagesBySourceUrl(sourceUrl, limit)
+			: await db.images.getPublicImages(limit, offset);
 
 		// Add URLs for the images
 		const enrichedImages = publicImages.map((image: ImageMetadata) => ({
 			...image,
 			url: `/api/images/${image.id}/${image.filename}`,
-			thumbnailUrl:
-				image.thumbnailUrl ||
-				`/api/images/${image.id}/${image.filename}?w=300&h=300&fit=cover&q=80`,
-			previewUrl: `/api/images/${image.id}/${image.filename}?w=800&h=600&fit=scale-down&q=85`
+			...imageDisplayUrls(image)
 		}));
 
 		// Get total count efficiently
-		const total = await db.images.getPublicImagesCount();
+		const total = sourceUrl ? publicImages.length : await db.images.getPublicImagesCount();
 
 		return json(
 			{
@@ -2,6 +2,7 @@ import { json, error } from '@sveltejs/kit';
 import type { RequestHandler } from './$types';
 import type { ImageMetadata } from '$lib/types';
 import { D1Utils } from '$lib/db/d1-utils';
+import { imageDisplayUrls } from '$lib/utils/imageUrls';
 
 // Get public images list from KV store
 async function getPublicImages(env: any): Promise<string[]> {
@@ -59,8 +60,7 @@ export const GET: RequestHandler = async ({ url, platform }) => {
 		const enrichedImages = selectedImages.map((image: ImageMetadata) => ({
 			...image,
 			src: `/api/images/${image.id}/${image.filename}`,
-			thumbnailUrl:
-				image.thumbnailUrl || `/api/images/${image.id}/${image.filename}?w=300&h=300&fit=cover&q=80`
+			...imageDisplayUrls(image)
 		}));
 
 		return json(enrichedImages, {
@@ -276,6 +276,32 @@ export const POST = async ({ request, platform }: RequestEvent) => {
 			// Convert file to ArrayBuffer
 			const arrayBuffer = await imageFile.arrayBuffer();
 
+			// Store optional pre-resized versions (e.g. from upload_landmark_images.py) next to the original
+			const derivatives: Record<string, string> = {};
+			for (const variant of ['medium', 'thumbnail']) {
+				const derivativeFile = formData.get(variant) as File | null;
+				if (
+					!derivativeFile ||
+					typeof derivativeFile === 'string' ||
+					!allowedTypes.includes(derivativeFile.type) ||
+					derivativeFile.size > maxSizeBytes
+				) {
+					continue;
+				}
+				const derivativeExtension = derivativeFile.name.split('.').pop() || 'jpg';
+				const derivativeKey = `images/${uniqueId}/${variant}.${derivativeExtension}`;
+				await env.IMAGES_BUCKET.put(derivativeKey, await derivativeFile.arrayBuffer(), {
+					httpMetadata: {
+						contentType: derivativeFile.type,
+						cacheControl: 'public, max-age=31536000' // 1 year cache
+					}
+				});
+				derivatives[variant] = derivativeKey;
+			}
+			const derivativeMetadata = Object.fromEntries(
+				Object.entries(derivatives).map(([variant, key]) => [`${variant}Key`, key])
+			);
+
 			// Upload original image to R2
 			const uploadResult = await env.IMAGES_BUCKET.put(r2Key, arrayBuffer, {
 				httpMetadata: {
@@ -287,13 +313,16 @@ export const POST = async ({ request, platform }: RequestEvent) => {
 					uploadedAt: new Date().toISOString(),
 					locationLat: String(location.lat),
 					locationLng: String(location.lng),
-					uploadedBy: user.id // Track who uploaded this image
+					uploadedBy: user.id, // Track who uploaded this image
+					...derivativeMetadata
 				}
 			});
 
 			// Construct the image URLs
 			const imageUrl = `/api/images/${uniqueId}/${sanitizedName}`;
-			const thumbnailUrl = `/api/images/${uniqueId}/${sanitizedName}?w=300&h=300&fit=cover&q=80`;
+			const thumbnailUrl = derivatives.thumbnail
+				? `/api/images/${derivatives.thumbnail.slice('images/'.length)}`
+				: `/api/images/${uniqueId}/${sanitizedName}?w=300&h=300&fit=cover&q=80`;
 
 			// Prepare metadata for response and KV storage
 			const metadata = {
@@ -308,6 +337,7 @@ export const POST = async ({ request, platform }: RequestEvent) => {
 				mimeType: imageFile.type,
 				url: imageUrl,
 				thumbnailUrl: thumbnailUrl,
+				derivatives: derivatives,
 				isPublic: isPublic,
 				...(sourceUrl && sourceUrl.trim() && { sourceUrl: sourceUrl.trim() }) // Add sourceUrl if provided
 			};
@@ -323,7 +353,8 @@ export const POST = async ({ request, platform }: RequestEvent) => {
 				fileSize: imageFile.size,
 				mimeType: imageFile.type,
 				isPublic: isPublic,
-				sourceUrl: sourceUrl?.trim() || undefined
+				sourceUrl: sourceUrl?.trim() || undefined,
+				derivatives: derivatives
 			});
 
 			// Update user image upload count
@@ -1,6 +1,7 @@
 import { json } from '@sveltejs/kit';
 import type { RequestEvent } from '@sveltejs/kit';
 import { D1Utils } from '$lib/db/d1-utils';
+import { imageDisplayUrls } from '$lib/utils/imageUrls';
 
 interface AuthenticatedUser {
 	id: string;
@@ -128,10 +129,7 @@ export const GET = async ({ request, platform }: RequestEvent) => {
 		const enrichedImages = userImages.map((image) => ({
 			...image,
 			url: `/api/images/${image.id}/${image.filename}`,
-			thumbnailUrl:
-				image.thumbnailUrl ||
-				`/api/images/${image.id}/${image.filename}?w=300&h=300&fit=cover&q=80`,
-			previewUrl: `/api/images/${image.id}/${image.filename}?w=800&h=600&fit=scale-down&q=85`
+			...imageDisplayUrls(image)
 		}));
 
 		// Get total count efficiently
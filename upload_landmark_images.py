@@ -3,21 +3,48 @@
 upload_landmark_images.py - Download and upload landmark images to the curated gallery.
 
 This script reads landmark_images.json, downloads each image from Wikimedia Commons,
-automatically resizes large images to appropriate dimensions (max 2048px, max 5MB),
+automatically resizes large images to appropriate dimensions (max 2048px, max 1MB),
 validates them, and uploads them to the application's curated images gallery with 
 location data and source URL.
 
 Features:
-- Automatic image resizing for large images
-- High-quality JPEG compression with 85% quality
+- Input streamed from JSON, JSON Lines (.jsonl) or a results store, so memory doesn't grow with
+  the number of landmarks and uploads start before the whole file has been read
+- Pipeline of fetch, transform and upload stages with their own workers (8 downloads, one
+  resize per core, 3 uploads) and bounded queues between them; per-stage stats are logged
+- Shortest-job-first scheduling by estimated decoded size, with at most 1GB of estimated
+  decoded images being processed at once, so huge scans can't exhaust memory
+- Automatic image resizing for large images, in a pool of worker processes (one per core)
+- Local content-addressed cache of downloads and processed images (public_images/image_cache),
+  so retrying failed uploads doesn't download or resize anything again
+- Streaming downloads with a per-file size cap (200MB) and a 512MB budget for all downloads
+  in flight; files over 8MB are spooled to a temporary file instead of memory
+- JPEG (or WebP with --webp) re-encoding at the highest quality (50-90) that fits the 1MB budget
+- Idempotent: landmarks whose source URL or image content is already in the gallery are
+  skipped before downloading (public_images/upload_manifest.sqlite, seeded from /api/images/public)
+- Gallery API requests retried with exponential backoff and jitter on 5xx, 429 and timeouts,
+  and an expired auth token refreshed from Supabase (and the request replayed) when configured
+- Resumable: each landmark's progress (downloaded, processed, uploaded with its server image ID,
+  or failed) is journaled as it happens (landmark_images.uploads.journal.jsonl next to the input),
+  and the next run skips uploaded landmarks and resumes the others from the image cache
+- Medium (1024px) and thumbnail (512px) versions made from the same decoded image and
+  uploaded with it, so gallery views don't have to load the full image
+- Huge PNG and TIFF rasters (up to 2 gigapixels) decoded in bands or from reduced-resolution
+  pages, and 16-bit or floating point images stretched to 8 bits (see large_images.py)
 - RGBA to RGB conversion for better compatibility
 - Maintains aspect ratio during resizing
 
 Usage:
-    python upload_landmark_images.py [json_file] [auth_token]
+    python upload_landmark_images.py [json_file] [auth_token] [--webp]
 
 Example:
     python upload_landmark_images.py public_images/landmark_images.json "your_supabase_jwt_token"
+    python upload_landmark_images.py public_images/landmark_images.db "your_supabase_jwt_token"
+    python upload_landmark_images.py public_images/landmark_images.jsonl "your_supabase_jwt_token"
+
+When given a results store (.db) written by find_photo.py --store, only landmarks that
+have not been uploaded yet are processed, and the server image ID of every successful
+upload is recorded in the store.
 
 Requirements:
     pip install Pillow aiohttp aiofiles
@@ -26,114 +53,1003 @@ Requirements:
 import asyncio
 import aiohttp
 import aiofiles
+import base64
+import functools
+import hashlib
+import heapq
+import itertools
 import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
 import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Optional, Tuple, Union
 import logging
 from urllib.parse import urlparse
 from PIL import Image
 import io
 
+from find_photo import ResultJournal
+from landmark_store import LandmarkResultsStore
+from large_images import (BANDED_DECODE_PIXELS, HIGH_BIT_DEPTH_MODES, MAX_BANDED_PIXELS, MAX_WHOLE_PIXELS,
+                          banded_decode_bytes, can_decode_in_bands, decode_reduced, select_page, to_8bit)
+
+# Input files with one of these suffixes are read as a landmark_store.py results store
+STORE_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Longest side of uploaded images; larger originals are downloaded as a thumbnail of this size
+# when find_photo.py recorded one, and resized otherwise
+MAX_IMAGE_SIZE = 2048
+
+# Byte budget per image: larger images are re-encoded at the highest quality that fits
+MAX_FILE_SIZE = 1024 * 1024
+
+# Quality range searched when encoding to the byte budget
+MIN_QUALITY = 50
+MAX_QUALITY = 90
+
+# Smaller versions uploaded alongside the full image, by longest side in pixels. The thumbnail
+# still covers the gallery's 300x300 crops for 3:2 photos.
+DERIVATIVE_SIZES = {'medium': 1024, 'thumbnail': 512}
+
+# Arguments for process_image; together with PROCESSING_VERSION they key cached processed images
+PROCESSING_PARAMS = {'max_size': MAX_IMAGE_SIZE, 'max_file_size': MAX_FILE_SIZE, 'fast_downscale': True,
+                     'output_format': 'JPEG', 'derivative_sizes': DERIVATIVE_SIZES}
+PROCESSING_VERSION = 4  # Bump when process_image changes its output for the same parameters
+
+DEFAULT_IMAGE_CACHE_DIR = "public_images/image_cache"
+IMAGE_CACHE_SCHEMA_VERSION = 2  # A cache index with another version is discarded
+
+DEFAULT_UPLOAD_MANIFEST_FILE = "public_images/upload_manifest.sqlite"
+MANIFEST_PAGE_SIZE = 500  # Images per /api/images/public request when seeding the manifest
+
+# Downloads are streamed in chunks of this size; up to SPOOL_THRESHOLD bytes stay in memory,
+# larger files are spooled to a temporary file that the image worker opens directly
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+SPOOL_THRESHOLD = 8 * 1024 * 1024
+MAX_DOWNLOAD_BYTES = 200 * 1024 * 1024  # Larger files are rejected (or aborted) without downloading them
+MAX_IN_FLIGHT_BYTES = 512 * 1024 * 1024  # Total size of the downloads being held at once
+
+# process_image enforces its own pixel limits, higher for images it can decode in bands
+Image.MAX_IMAGE_PIXELS = None
+
+# Estimated decoded memory of all images being processed at once (see estimate_decode_bytes)
+MAX_DECODE_BYTES = 1024 * 1024 * 1024
+
+# Typical ratio of decoded to compressed size, for images whose header can't be read
+DECODE_RATIO = 10
+
+# Default workers for the download and upload pipeline stages (resizing uses one per image worker process)
+FETCH_WORKERS = 8
+UPLOAD_WORKERS = 3
+
+# Input files are read in chunks of this many characters, and shortest-job-first scheduling
+# picks from this many landmarks at a time, so memory doesn't grow with the input
+INPUT_CHUNK_SIZE = 1024 * 1024
+SCHEDULE_WINDOW = 1000
+
+# Input files with one of these suffixes are read as JSON Lines (one landmark per line)
+JSON_LINES_SUFFIXES = ('.jsonl', '.ndjson')
+
+# Gallery API requests failing with these statuses (or no response) are retried with exponential
+# backoff and jitter, starting around RETRY_BASE_DELAY seconds and capped at MAX_RETRY_DELAY
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Gateway failures (like no response at all) leave open whether the server handled the request
+AMBIGUOUS_STATUSES = (0, 502, 504)
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+# Tokens expiring within this many seconds are refreshed before they are sent
+TOKEN_REFRESH_MARGIN = 60
+
+# Image formats the gallery accepts as they are, with their file extensions
+UPLOAD_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# Downscale first by an integer factor (box filter) as long as the image stays this many times
+# larger than the target; per Pillow's docs 3.0 is indistinguishable from plain LANCZOS
+REDUCING_GAP = 3.0
+
+def encode_to_budget(img: Image.Image, output_format: str = 'JPEG', max_bytes: int = MAX_FILE_SIZE,
+                     min_quality: int = MIN_QUALITY, max_quality: int = MAX_QUALITY) -> Tuple[bytes, int]:
+    """Encode an RGB or L image at the highest quality whose output fits in max_bytes.
+    
+    Binary-searches the quality setting, which takes about log2(max_quality - min_quality)
+    encodes at most; an image that fits at max_quality is encoded only once. If even
+    min_quality doesn't fit, the min_quality encoding is returned anyway.
+    
+    Returns:
+        The encoded bytes and the quality used
+    """
+    save_options = {'optimize': True} if output_format == 'JPEG' else {'method': 4}
+    
+    def encode(quality: int) -> bytes:
+        output_buffer = io.BytesIO()
+        img.save(output_buffer, format=output_format, quality=quality, **save_options)
+        return output_buffer.getvalue()
+    
+    best_quality = max_quality
+    best = encode(max_quality)
+    if len(best) <= max_bytes:
+        return best, best_quality
+    
+    # Invariant: max_quality doesn't fit; look for the highest quality below it that does
+    low, high = min_quality, max_quality - 1
+    best, best_quality = None, None
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode(quality)
+        if len(data) <= max_bytes:
+            best, best_quality = data, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    
+    if best is None:
+        logger.warning(f"Image doesn't fit in {max_bytes} bytes even at quality {min_quality}")
+        return encode(min_quality), min_quality
+    return best, best_quality
+
+def fit_size(size: Tuple[int, int], max_size: int) -> Optional[Tuple[int, int]]:
+    """Dimensions scaled down to fit in max_size x max_size with the same aspect ratio, or None if they fit."""
+    width, height = size
+    if width <= max_size and height <= max_size:
+        return None
+    ratio = min(max_size / width, max_size / height)
+    return (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+def estimate_decode_bytes(width: int, height: int, image_format: Optional[str] = None, mode: str = 'RGB',
+                          max_size: int = MAX_IMAGE_SIZE, fast_downscale: bool = True) -> int:
+    """Rough peak memory of process_image for an image, from its header.
+    
+    Counts the decoded image, an RGB copy for conversion and resizing, and the resized
+    image. JPEGs are decoded at the draft scale process_image will use.
+    """
+    target = fit_size((width, height), max_size) or (width, height)
+    scale = 1
+    if fast_downscale and image_format == 'JPEG':
+        while scale < 8 and width // (scale * 2) >= target[0] and height // (scale * 2) >= target[1]:
+            scale *= 2
+    decoded_pixels = (width // scale) * (height // scale)
+    bytes_per_pixel = Image.getmodebands(mode) * (2 if mode.startswith('I;16') else 4 if mode in ('I', 'F') else 1)
+    return decoded_pixels * (bytes_per_pixel + 3) + target[0] * target[1] * 3
+
+def process_image(image_source: Union[bytes, str], max_size: int = MAX_IMAGE_SIZE,
+                  max_file_size: int = MAX_FILE_SIZE, fast_downscale: bool = True,
+                  output_format: str = 'JPEG', derivative_sizes: Optional[Dict[str, int]] = None) -> Dict:
+    """Resize and re-encode an image only if it's too large or in an unsupported format.
+    
+    The image is opened once: format and dimensions come from its header, so images that
+    don't need resizing (and have no derivatives to make) are never decoded, and callers
+    don't have to parse the result again. Derivatives are resized from the same decoded
+    image, each from the next larger one. Huge PNGs and TIFFs are decoded in bands (or from a
+    reduced-resolution page) by large_images.py; images too large to decode fail gracefully.
+    
+    Args:
+        image_source: Raw image bytes, or the path of a file holding them
+        max_size: Maximum width/height in pixels (default 2048)
+        max_file_size: Byte budget (default 1MB); re-encoded images land just under it
+        fast_downscale: Let the JPEG decoder decode at 1/2, 1/4 or 1/8 scale (never below the
+            target size) and pre-reduce other images before the final LANCZOS resample
+        output_format: 'JPEG' or 'WEBP' for re-encoded images
+        derivative_sizes: Smaller versions to make, as {name: maximum width/height}; sizes
+            the full image already fits in are skipped
+    
+    Returns:
+        Dict with the image bytes ('data'), their PIL 'format' (None if unknown), 'width', 'height',
+        the encoding 'quality' (None if the original was kept) and 'derivatives' ({name: same shape})
+    """
+    if isinstance(image_source, str):
+        file_size = os.path.getsize(image_source)
+        image_file = image_source
+    else:
+        file_size = len(image_source)
+        image_file = io.BytesIO(image_source)
+    
+    result = None
+    try:
+        with Image.open(image_file) as img:
+            width, height = img.size
+            source_format = img.format
+            new_size = fit_size(img.size, max_size)
+            keep_original = (file_size <= max_file_size and new_size is None
+                             and source_format in UPLOAD_EXTENSIONS)
+            full_size = new_size or img.size
+            derivatives = {name: size for name, size in (derivative_sizes or {}).items()
+                           if fit_size(full_size, size) is not None}
+            
+            if keep_original:
+                # No resizing needed
+                if isinstance(image_source, str):
+                    image_source = Path(image_source).read_bytes()
+                result = {'data': image_source, 'format': source_format, 'width': width, 'height': height,
+                          'quality': None, 'derivatives': {}}
+                if not derivatives:
+                    return result
+            else:
+                logger.info(f"Original image size: {width}x{height} {source_format}, file size: {file_size} bytes")
+            
+            if fast_downscale and source_format == 'JPEG':
+                # Decode no larger than the largest image that will be encoded; must happen
+                # before anything loads the pixels
+                img.draft(None, full_size if result is None else fit_size(img.size, max(derivatives.values())))
+            elif source_format == 'TIFF':
+                # Multi-page TIFFs may carry reduced-resolution copies of the image
+                select_page(img, full_size)
+            
+            # Huge rasters are decoded in bands, straight to a reduced size, where the format allows it
+            decoded_pixels = img.width * img.height
+            if decoded_pixels > BANDED_DECODE_PIXELS and can_decode_in_bands(img):
+                if decoded_pixels > MAX_BANDED_PIXELS:
+                    raise ValueError(f"{img.width}x{img.height} is over the {MAX_BANDED_PIXELS} pixel limit")
+                img = decode_reduced(img, full_size)
+            elif decoded_pixels > MAX_WHOLE_PIXELS:
+                raise ValueError(f"{img.width}x{img.height} {source_format} is over the {MAX_WHOLE_PIXELS} pixel "
+                                 f"limit for images that can't be decoded in bands")
+            
+            # 16-bit and float images would be clipped by convert('RGB')
+            if img.mode in HIGH_BIT_DEPTH_MODES:
+                img = to_8bit(img)
+            
+            # Convert RGBA to RGB if needed (for JPEG compatibility)
+            if img.mode == 'RGBA':
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            
+            # Grayscale stays single-channel in JPEG; WebP only encodes color
+            if output_format == 'WEBP' and img.mode == 'L':
+                img = img.convert('RGB')
+            
+            reducing_gap = REDUCING_GAP if fast_downscale else None
+            if new_size and result is None:
+                # Resize using high-quality resampling
+                decoded_size = img.size
+                img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+                logger.info(f"Resized to: {new_size[0]}x{new_size[1]} (decoded at {decoded_size[0]}x{decoded_size[1]})")
+            
+            if result is None:
+                resized_data, quality = encode_to_budget(img, output_format, max_file_size)
+                logger.info(f"Compressed file size: {len(resized_data)} bytes as {output_format} quality {quality} "
+                            f"(saved {file_size - len(resized_data)} bytes)")
+                result = {'data': resized_data, 'format': output_format, 'width': img.width, 'height': img.height,
+                          'quality': quality, 'derivatives': {}}
+            
+            # Largest first, so each derivative is resized from the previous one
+            for name, size in sorted(derivatives.items(), key=lambda item: item[1], reverse=True):
+                derivative_size = fit_size(img.size, size)
+                if derivative_size:
+                    img = img.resize(derivative_size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+                derivative_data, quality = encode_to_budget(img, output_format, max_file_size)
+                result['derivatives'][name] = {'data': derivative_data, 'format': output_format,
+                                               'width': img.width, 'height': img.height, 'quality': quality}
+            
+            return result
+    
+    except Exception as e:
+        if result is not None:
+            # The full image is ready; upload it without the versions that failed
+            logger.warning(f"Failed to make smaller versions of image, uploading without them: {str(e)}")
+            result['derivatives'] = {}
+            return result
+        # The server would reject an image that needed resizing but couldn't be
+        logger.warning(f"Failed to process image: {str(e)}")
+        return {'data': b'', 'format': None, 'width': 0, 'height': 0, 'quality': None, 'derivatives': {}}
+
+class SpooledDownload:
+    """Download buffer that keeps small files in memory and spills large ones to a temporary file."""
+    
+    def __init__(self, spool_threshold: int = SPOOL_THRESHOLD):
+        self.spool_threshold = spool_threshold
+        self.size = 0
+        self.sha256 = hashlib.sha256()  # Content address for the image cache
+        self.path = None
+        self._buffer = io.BytesIO()
+        self._file = None
+    
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+        if self._file is None and self.size > self.spool_threshold:
+            fd, self.path = tempfile.mkstemp(prefix='landmark_image_')
+            self._file = os.fdopen(fd, 'wb')
+            self._file.write(self._buffer.getvalue())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+    
+    def source(self) -> Union[bytes, str]:
+        """The downloaded bytes, or the path of the temporary file holding them (see process_image)."""
+        if self._file is None:
+            return self._buffer.getvalue()
+        self._file.flush()
+        return self.path
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self.path)
+        self._buffer = None
+
+class ImageCache:
+    """Content-addressed disk cache of downloaded images and their processed versions.
+    
+    Files are stored under the SHA-256 of their content. Downloads are indexed by source URL
+    with their ETag/Last-Modified validators, processed images by the content they were made
+    from and the processing parameters. Least recently used files are evicted beyond max_bytes,
+    except files pinned because an image waiting to be processed still reads them.
+    """
+    
+    def __init__(self, cache_dir: str = DEFAULT_IMAGE_CACHE_DIR, max_bytes: int = 2 * 1024 * 1024 * 1024,
+                 max_age: float = 7 * 24 * 3600):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age  # Sources validated more recently than this are used without asking again
+        self.hits = 0
+        self.evicted = 0
+        self._pins: Dict[str, int] = {}  # Pin count by content hash
+        
+        self.conn = sqlite3.connect(self.cache_dir / 'index.sqlite', timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        (schema_version,) = self.conn.execute('PRAGMA user_version').fetchone()
+        if schema_version != IMAGE_CACHE_SCHEMA_VERSION:
+            # It's only a cache: start over rather than migrate (orphaned files age out of the index)
+            self.conn.executescript('''
+                DROP TABLE IF EXISTS sources;
+                DROP TABLE IF EXISTS processed;
+            ''')
+            self.conn.execute(f'PRAGMA user_version = {IMAGE_CACHE_SCHEMA_VERSION}')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sources (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                validated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS processed (
+                content_hash TEXT NOT NULL,
+                params TEXT NOT NULL,
+                variant TEXT NOT NULL,
+                output_hash TEXT NOT NULL,
+                format TEXT,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                quality INTEGER,
+                PRIMARY KEY (content_hash, params, variant)
+            );
+            CREATE INDEX IF NOT EXISTS idx_processed_output ON processed (output_hash);
+            CREATE TABLE IF NOT EXISTS objects (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_objects_last_used ON objects (last_used);
+        ''')
+        self.conn.commit()
+    
+    @staticmethod
+    def params_key(params: Dict) -> str:
+        return json.dumps({**params, 'version': PROCESSING_VERSION}, sort_keys=True)
+    
+    def object_path(self, content_hash: str) -> Path:
+        return self.objects_dir / content_hash[:2] / content_hash
+    
+    def has_object(self, content_hash: str) -> bool:
+        return self.object_path(content_hash).exists()
+    
+    def write_object(self, content_hash: str, source: Union[bytes, str]) -> int:
+        """Store content (bytes or a file to copy) under its hash. Does file I/O only, so it can run in a thread."""
+        path = self.object_path(content_hash)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            if isinstance(source, bytes):
+                temp_path.write_bytes(source)
+            else:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, path)
+        return path.stat().st_size
+    
+    def pin(self, content_hash: str) -> None:
+        """Keep a file from being evicted until it is unpinned as often as it was pinned."""
+        self._pins[content_hash] = self._pins.get(content_hash, 0) + 1
+    
+    def unpin(self, content_hash: str) -> None:
+        if self._pins.get(content_hash, 0) > 1:
+            self._pins[content_hash] -= 1
+        else:
+            self._pins.pop(content_hash, None)
+    
+    def _index_object(self, content_hash: str, size: int) -> None:
+        self.conn.execute(
+            'INSERT OR REPLACE INTO objects (hash, size, last_used) VALUES (?, ?, ?)',
+            (content_hash, size, time.time())
+        )
+    
+    def _touch_object(self, content_hash: str) -> None:
+        self.conn.execute('UPDATE objects SET last_used = ? WHERE hash = ?', (time.time(), content_hash))
+    
+    def get_source(self, url: str) -> Optional[Dict]:
+        """Cached download info for a URL, with 'fresh' set if it was validated within max_age."""
+        row = self.conn.execute(
+            'SELECT content_hash, etag, last_modified, validated_at FROM sources WHERE url = ?', (url,)
+        ).fetchone()
+        if not row:
+            return None
+        content_hash, etag, last_modified, validated_at = row
+        return {
+            'content_hash': content_hash,
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': time.time() - validated_at < self.max_age
+        }
+    
+    def put_source(self, url: str, content_hash: str, size: int, etag: Optional[str], last_modified: Optional[str]) -> None:
+        """Index a download whose content was stored with write_object."""
+        self._index_object(content_hash, size)
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sources (url, content_hash, etag, last_modified, validated_at) VALUES (?, ?, ?, ?, ?)',
+            (url, content_hash, etag, last_modified, time.time())
+        )
+        self.conn.commit()
+        self._evict_if_needed()
+    
+    def mark_validated(self, url: str) -> None:
+        """Record that the server confirmed (304) the cached download is current."""
+        self.conn.execute('UPDATE sources SET validated_at = ? WHERE url = ?', (time.time(), url))
+        self.conn.commit()
+    
+    def get_processed(self, content_hash: str, params: Dict) -> Optional[Dict]:
+        """The processed image and derivatives (see process_image) made from some content with these parameters."""
+        rows = self.conn.execute(
+            'SELECT variant, output_hash, format, width, height, quality FROM processed '
+            'WHERE content_hash = ? AND params = ?',
+            (content_hash, self.params_key(params))
+        ).fetchall()
+        if not rows or not all(self.has_object(row[1]) for row in rows):
+            return None
+        
+        image = {'derivatives': {}}
+        for variant, output_hash, image_format, width, height, quality in rows:
+            self._touch_object(output_hash)
+            output = {'data': self.object_path(output_hash).read_bytes(), 'format': image_format,
+                      'width': width, 'height': height, 'quality': quality}
+            if variant:
+                image['derivatives'][variant] = output
+            else:
+                image.update(output)
+        if 'data' not in image:
+            return None
+        
+        self._touch_object(content_hash)  # Keep the source alive while its output is being used
+        self.conn.commit()
+        self.hits += 1
+        return image
+    
+    def put_processed(self, content_hash: str, params: Dict, image: Dict) -> None:
+        """Store a processed image and its derivatives made from some content with these parameters."""
+        params_key = self.params_key(params)
+        rows = []
+        for variant, output in [('', image), *image['derivatives'].items()]:
+            output_hash = hashlib.sha256(output['data']).hexdigest()
+            self._index_object(output_hash, self.write_object(output_hash, output['data']))
+            rows.append((content_hash, params_key, variant, output_hash, output['format'],
+                         output['width'], output['height'], output['quality']))
+        self.conn.execute('DELETE FROM processed WHERE content_hash = ? AND params = ?', (content_hash, params_key))
+        self.conn.executemany(
+            'INSERT INTO processed (content_hash, params, variant, output_hash, format, width, height, quality) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            rows
+        )
+        self.conn.commit()
+        self._evict_if_needed()
+    
+    def _evict_if_needed(self) -> None:
+        """Delete least recently used files until the cache fits in max_bytes."""
+        (total_bytes,) = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()
+        if total_bytes <= self.max_bytes:
+            return
+        
+        hashes_to_delete = []
+        freed_bytes = 0
+        for content_hash, size in self.conn.execute('SELECT hash, size FROM objects ORDER BY last_used'):
+            if freed_bytes >= total_bytes - self.max_bytes:
+                break
+            if content_hash in self._pins:
+                continue  # Queued for or being processed
+            hashes_to_delete.append((content_hash,))
+            freed_bytes += size
+        
+        for (content_hash,) in hashes_to_delete:
+            self.object_path(content_hash).unlink(missing_ok=True)
+        self.conn.executemany('DELETE FROM objects WHERE hash = ?', hashes_to_delete)
+        # An image is only usable with all its derivatives
+        self.conn.executemany('''
+            DELETE FROM processed WHERE (content_hash, params) IN (
+                SELECT content_hash, params FROM processed WHERE output_hash = ?
+            )
+        ''', hashes_to_delete)
+        self.conn.commit()
+        self.evicted += len(hashes_to_delete)
+        logger.debug(f"Evicted {len(hashes_to_delete)} cached images ({freed_bytes} bytes)")
+    
+    def close(self) -> None:
+        self.conn.close()
+
+class UploadManifest:
+    """Record of images already in the gallery, by source URL and by downloaded content hash.
+    
+    Persisted in SQLite and mirrored in dicts, so checking whether a landmark was uploaded
+    before is a hash lookup. Seeded from the server's public images (see
+    LandmarkImageUploader.seed_upload_manifest) and updated after every upload.
+    """
+    
+    def __init__(self, db_path: str = DEFAULT_UPLOAD_MANIFEST_FILE):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS uploads (
+                source_url TEXT PRIMARY KEY,
+                content_hash TEXT,
+                image_id TEXT,
+                image_url TEXT,
+                landmark TEXT,
+                uploaded_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads (content_hash);
+        ''')
+        self.conn.commit()
+        
+        self.by_source_url: Dict[str, Optional[str]] = {}
+        self.by_content_hash: Dict[str, Optional[str]] = {}
+        for source_url, content_hash, image_id in self.conn.execute(
+                'SELECT source_url, content_hash, image_id FROM uploads'):
+            self.by_source_url[source_url] = image_id
+            if content_hash:
+                self.by_content_hash[content_hash] = image_id
+    
+    def __len__(self) -> int:
+        return len(self.by_source_url)
+    
+    def has_source(self, source_url: str) -> bool:
+        return source_url in self.by_source_url
+    
+    def has_content(self, content_hash: str) -> bool:
+        return content_hash in self.by_content_hash
+    
+    def record(self, source_url: str, image_id: Optional[str] = None, image_url: Optional[str] = None,
+               landmark: Optional[str] = None, content_hash: Optional[str] = None) -> None:
+        """Record an uploaded image. Known hashes and IDs aren't overwritten with unknown ones."""
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO uploads (source_url, content_hash, image_id, image_url, landmark, uploaded_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source_url) DO UPDATE SET
+                    content_hash = COALESCE(excluded.content_hash, content_hash),
+                    image_id = COALESCE(excluded.image_id, image_id),
+                    image_url = COALESCE(excluded.image_url, image_url),
+                    landmark = COALESCE(excluded.landmark, landmark)
+            ''', (source_url, content_hash, image_id, image_url, landmark, time.time()))
+        self.by_source_url[source_url] = image_id or self.by_source_url.get(source_url)
+        if content_hash:
+            self.by_content_hash[content_hash] = image_id
+    
+    def record_many(self, images: List[Dict]) -> int:
+        """Record server image entries ({'sourceUrl', 'id', 'url'}) in one transaction. Returns the count added."""
+        now = time.time()
+        rows = [(image['sourceUrl'], image.get('id'), image.get('url'), now)
+                for image in images if image.get('sourceUrl') and image['sourceUrl'] not in self.by_source_url]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO uploads (source_url, image_id, image_url, uploaded_at) VALUES (?, ?, ?, ?)',
+                rows
+            )
+        for source_url, image_id, _, _ in rows:
+            self.by_source_url[source_url] = image_id
+        return len(rows)
+    
+    def close(self) -> None:
+        self.conn.close()
+
+class UploadJournal:
+    """Per-landmark progress of upload runs, appended as each stage completes.
+    
+    Records ({'landmark', 'source_url', 'stage', ...}) are durably appended to a JSON Lines
+    file (see find_photo.ResultJournal) as a landmark's image is downloaded, processed,
+    uploaded (with the server image ID) or fails, so an interrupted run leaves a record of
+    everything that happened before it stopped. The next run over the same input replays it:
+    uploaded landmarks are skipped, and downloaded or processed ones resume from the image cache.
+    """
+    
+    def __init__(self, path: str):
+        self.journal = ResultJournal(path)
+        self.entries: Dict[str, Dict] = {}
+        
+        # The last record for a landmark wins; fields of earlier stages are kept
+        for record in self.journal.read():
+            landmark = record.get('landmark')
+            if landmark:
+                previous = self.entries.get(landmark, {})
+                if previous.get('source_url') != record.get('source_url'):
+                    previous = {}
+                previous.pop('error', None)
+                self.entries[landmark] = {**previous, **record}
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def get(self, landmark: str, source_url: str) -> Optional[Dict]:
+        """The latest record for a landmark, unless it was for a different source image."""
+        entry = self.entries.get(landmark)
+        if entry is None or entry.get('source_url') != source_url:
+            return None
+        return entry
+    
+    def record(self, landmark: str, source_url: str, stage: str, **fields: Any) -> None:
+        """Durably record that a landmark reached a stage ('downloaded', 'processed', 'uploaded' or 'failed')."""
+        record = {'landmark': landmark, 'source_url': source_url, 'stage': stage, 'at': time.time(), **fields}
+        previous = self.entries.get(landmark)
+        if previous is None or previous.get('source_url') != source_url:
+            previous = {}
+        previous.pop('error', None)  # A failure is superseded by any later record
+        self.entries[landmark] = {**previous, **record}
+        self.journal.append(record)
+    
+    def counts(self) -> Dict[str, int]:
+        """Number of landmarks whose latest record is at each stage."""
+        counts: Dict[str, int] = {}
+        for entry in self.entries.values():
+            counts[entry['stage']] = counts.get(entry['stage'], 0) + 1
+        return counts
+    
+    def compact(self) -> None:
+        """Rewrite the journal with one line (the merged record) per landmark."""
+        self.journal.close()
+        temp_file = f"{self.journal.path}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.journal.path)
+    
+    def close(self) -> None:
+        self.journal.close()
+
+def upload_journal_path_for(input_file: str) -> str:
+    """Journal file that accompanies an input file (landmark_images.json -> landmark_images.uploads.journal.jsonl)."""
+    return str(Path(input_file).with_suffix('.uploads.journal.jsonl'))
+
+def jwt_payload(token: str) -> Dict:
+    """The (unverified) claims of a JWT, or an empty dict if it can't be decoded."""
+    try:
+        payload = token.split('.')[1]
+        return json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return {}
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class TokenProvider:
+    """Bearer token for the gallery API. This one always returns the token it was given.
+    
+    LandmarkImageUploader asks for the token before every request, and asks for a refresh
+    when the server rejects it with a 401; subclasses that can get a new token override refresh.
+    """
+    
+    def __init__(self, token: str):
+        self.token = token
+        self.refreshes = 0
+    
+    async def get_token(self, session: aiohttp.ClientSession) -> str:
+        return self.token
+    
+    async def refresh(self, session: aiohttp.ClientSession, rejected_token: str) -> bool:
+        """Replace a rejected token. Returns whether there is a new token to retry with."""
+        return False
+
+class SupabaseTokenProvider(TokenProvider):
+    """Token provider that gets fresh Supabase access tokens from the auth API.
+    
+    A token is refreshed shortly before it expires, and when the server rejects it: with the
+    refresh token (which Supabase rotates on every use) or, failing that, by signing in with
+    email and password. Concurrent requests that see the same expired token share one refresh.
+    """
+    
+    def __init__(self, supabase_url: str, anon_key: str, access_token: str = '',
+                 refresh_token: Optional[str] = None, email: Optional[str] = None, password: Optional[str] = None):
+        super().__init__(access_token)
+        self.token_url = f"{supabase_url.rstrip('/')}/auth/v1/token"
+        self.anon_key = anon_key
+        self.refresh_token = refresh_token
+        self.email = email
+        self.password = password
+        self.lock = asyncio.Lock()
+    
+    async def get_token(self, session: aiohttp.ClientSession) -> str:
+        expires_at = jwt_payload(self.token).get('exp', 0) if self.token else 0
+        if expires_at - TOKEN_REFRESH_MARGIN < time.time():
+            await self.refresh(session, self.token)
+        return self.token
+    
+    async def refresh(self, session: aiohttp.ClientSession, rejected_token: str) -> bool:
+        async with self.lock:
+            if self.token != rejected_token:
+                return True  # Another request refreshed it while this one waited
+            
+            session_data = None
+            if self.refresh_token:
+                session_data = await self._grant(session, 'refresh_token', {'refresh_token': self.refresh_token})
+            if session_data is None and self.email and self.password:
+                session_data = await self._grant(session, 'password', {'email': self.email, 'password': self.password})
+            if session_data is None:
+                return False
+            
+            self.token = session_data['access_token']
+            self.refresh_token = session_data.get('refresh_token') or self.refresh_token
+            self.refreshes += 1
+            expires_at = jwt_payload(self.token).get('exp')
+            lifetime = f", valid for {(expires_at - time.time()) / 60:.0f} minutes" if expires_at else ""
+            logger.info(f"Refreshed auth token{lifetime}")
+            return True
+    
+    async def _grant(self, session: aiohttp.ClientSession, grant_type: str, body: Dict) -> Optional[Dict]:
+        """Request a new session from the Supabase auth API."""
+        try:
+            async with session.post(self.token_url, params={'grant_type': grant_type}, json=body,
+                                    headers={'apikey': self.anon_key}) as response:
+                if response.status != 200:
+                    logger.warning(f"Token refresh ({grant_type}) failed: HTTP {response.status}")
+                    return None
+                session_data = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+            logger.warning(f"Token refresh ({grant_type}) failed: {str(e)}")
+            return None
+        return session_data if session_data.get('access_token') else None
+
+class MemoryBudget:
+    """Caps the bytes held at once across all concurrent landmarks (downloads, or decoded images)."""
+    
+    def __init__(self, max_bytes: int = MAX_IN_FLIGHT_BYTES):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.peak = 0
+        self._condition = asyncio.Condition()
+    
+    async def acquire(self, size: int) -> int:
+        """Wait until size bytes fit in the budget and reserve them. Returns the amount reserved."""
+        size = min(size, self.max_bytes)  # A single item may always use the whole budget
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight + size <= self.max_bytes)
+            self.in_flight += size
+            self.peak = max(self.peak, self.in_flight)
+        return size
+    
+    async def release(self, size: int) -> None:
+        async with self._condition:
+            self.in_flight -= size
+            self._condition.notify_all()
+
+class FetchedImage:
+    """A downloaded (or cached) image waiting to be processed, holding its share of the download budget."""
+    
+    def __init__(self, source: Union[bytes, str], content_hash: str, download: Optional[SpooledDownload] = None,
+                 reserved: int = 0, budget: Optional[MemoryBudget] = None):
+        self.source = source  # Bytes, or the path of a spooled or cached file
+        self.content_hash = content_hash
+        self.download = download
+        self.reserved = reserved
+        self.budget = budget  # The budget reserved is released to
+        self.pinned = False  # Whether content_hash is pinned in the image cache until it's released
+        self.decode_bytes = 0  # Estimated memory to process it, set by LandmarkImageUploader.fetch_image
+
+async def iterate(items: Iterable) -> AsyncIterator:
+    """Async iterator over a plain iterable."""
+    for item in items:
+        yield item
+
+def is_outcome(value: Any) -> bool:
+    """Whether a pipeline stage returned a landmark's final (success, error_message)."""
+    return isinstance(value, tuple) and isinstance(value[0], bool)
+
+class StageStats:
+    """Items handled, handling time and queue depth of one pipeline stage."""
+    
+    def __init__(self, name: str, queue: asyncio.Queue):
+        self.name = name
+        self.queue = queue
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.max_depth = 0
+    
+    def observe_depth(self) -> None:
+        """Note the stage's queue depth after an item was added."""
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+    
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+    
+    def summary(self) -> str:
+        average = self.total_seconds / self.count if self.count else 0.0
+        return (f"{self.name} stage: {self.count} items, {average:.2f}s average, {self.max_seconds:.2f}s max, "
+                f"queue depth max {self.max_depth}/{self.queue.maxsize}")
+
 class LandmarkImageUploader:
     """Upload landmark images to the application's curated gallery."""
     
-    def __init__(self, auth_token: str, base_url: str = "https://geo.cmxu.io"):
-        self.auth_token = auth_token
+    def __init__(self, auth_token: str, base_url: str = "https://geo.cmxu.io",
+                 store: Optional[LandmarkResultsStore] = None, image_workers: Optional[int] = None,
+                 max_download_bytes: int = MAX_DOWNLOAD_BYTES, max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES,
+                 image_cache: Optional[ImageCache] = None, processing_params: Optional[Dict] = None,
+                 manifest: Optional[UploadManifest] = None, max_decode_bytes: int = MAX_DECODE_BYTES,
+                 journal: Optional[UploadJournal] = None, token_provider: Optional[TokenProvider] = None,
+                 max_retries: int = MAX_RETRIES):
+        # Sent with every gallery API request; refreshed through the provider when it expires
+        self.token_provider = token_provider or TokenProvider(auth_token)
+        self.max_retries = max_retries
+        self.retries = 0
         self.base_url = base_url.rstrip('/')
         self.upload_url = f"{self.base_url}/api/images/upload-simple"
         self.session = None
+        self.store = store  # Successful uploads are recorded here when given
+        # Decoding and resizing run in worker processes so the event loop only moves bytes
+        self.image_workers = image_workers or os.cpu_count() or 1
+        self.image_executor = None
+        self.max_download_bytes = max_download_bytes
+        # Bounds memory and temp disk used by downloads, whatever Commons serves
+        self.download_budget = MemoryBudget(max(max_in_flight_bytes, max_download_bytes))
+        # Fallback downloads made by transform workers; they can't wait on the download budget,
+        # which fetch workers blocked on the transform queue may be holding
+        self.fallback_budget = MemoryBudget(max_download_bytes)
+        # Images are processed smallest first, and only as many at once as fit in this estimate of decoded memory
+        self.decode_budget = MemoryBudget(max_decode_bytes)
+        # Downloads and processed images are reused across runs, e.g. when retrying failed uploads
+        self.image_cache = image_cache
+        # process_image arguments, e.g. {'output_format': 'WEBP'} or a different 'max_file_size' budget
+        self.processing_params = {**PROCESSING_PARAMS, **(processing_params or {})}
+        # Images already in the gallery are skipped
+        self.manifest = manifest
+        self.skipped = 0
+        # Each landmark's progress is recorded here, and an earlier run's is resumed from it
+        self.journal = journal
         
     async def __aenter__(self):
         """Async context manager entry."""
+        # The bearer token is added per request (see request_api), so downloads don't send it to Commons
         self.session = aiohttp.ClientSession(
             timeout=aiohttp.ClientTimeout(total=60),
             headers={
-                'Authorization': f'Bearer {self.auth_token}',
                 'User-Agent': 'Landmark Image Uploader/1.0'
             }
         )
+        self.image_executor = self._create_image_executor()
         return self
     
     async def __aexit__(self, *args):
         """Async context manager exit."""
         if self.session:
             await self.session.close()
+        if self.image_executor:
+            self.image_executor.shutdown(cancel_futures=True)
+    
+    def _create_image_executor(self) -> ProcessPoolExecutor:
+        # spawn: forking a process that runs an event loop (and aiohttp's resolver threads) isn't safe
+        return ProcessPoolExecutor(max_workers=self.image_workers, mp_context=multiprocessing.get_context('spawn'))
     
-    def resize_image_if_needed(self, image_data: bytes, max_size: int = 2048, max_file_size: int = 5 * 1024 * 1024) -> bytes:
-        """Resize image if it's too large or file size is too big.
+    async def run_image_work(self, function: Callable[..., Any], *args: Any) -> Any:
+        """Run CPU-bound image work in the process pool, replacing the pool if a worker died."""
+        executor = self.image_executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # A worker was killed (e.g. out of memory on a huge image); later images get a fresh pool
+            if self.image_executor is executor:
+                executor.shutdown(wait=False)
+                self.image_executor = self._create_image_executor()
+            raise
+    
+    async def process_content(self, source: Union[bytes, str], content_hash: Optional[str] = None) -> Dict:
+        """Process downloaded content (see process_image), reusing a cached result for the same content.
+        
+        The hash of the downloaded content is returned with the image as 'source_hash'.
+        """
+        image = None
+        if self.image_cache is not None and content_hash:
+            image = self.image_cache.get_processed(content_hash, self.processing_params)
+        
+        if image is None:
+            image = await self.run_image_work(functools.partial(process_image, **self.processing_params), source)
+            if self.image_cache is not None and content_hash and image['data']:
+                self.image_cache.put_processed(content_hash, self.processing_params, image)
+        image['source_hash'] = content_hash
+        return image
+    
+    async def download_image(self, url: str, landmark_name: str,
+                             budget: Optional[MemoryBudget] = None) -> Optional[Dict]:
+        """Download image from Wikimedia Commons and process it for upload (see process_image)."""
+        fetched = await self.fetch_image(url, landmark_name, budget)
+        if isinstance(fetched, FetchedImage):
+            return await self.transform_within_budget(fetched)
+        return fetched
+    
+    async def fetch_image(self, url: str, landmark_name: str,
+                          budget: Optional[MemoryBudget] = None) -> Union[Dict, FetchedImage, None]:
+        """Download an image, or find it in the image cache, without processing it.
+        
+        The body is streamed into a SpooledDownload, and its size counts against the shared
+        download budget until transform_image has processed it. With an image cache, recently
+        validated downloads are used without any request, and older ones are revalidated
+        with a conditional request.
         
         Args:
-            image_data: Raw image bytes
-            max_size: Maximum width/height in pixels (default 2048)
-            max_file_size: Maximum file size in bytes (default 5MB)
-            
+            budget: Budget the download counts against instead of the download budget
+        
         Returns:
-            Resized image bytes if resizing was needed, otherwise original bytes
+            The processed image if it was cached, a FetchedImage to pass to transform_image,
+            or None if the download failed
         """
-        try:
-            # Check if file size is within limits
-            if len(image_data) <= max_file_size:
-                # Still check if image dimensions need resizing
-                with Image.open(io.BytesIO(image_data)) as img:
-                    width, height = img.size
-                    if width <= max_size and height <= max_size:
-                        # No resizing needed
-                        return image_data
-            
-            # Load image and resize if needed
-            with Image.open(io.BytesIO(image_data)) as img:
-                # Convert RGBA to RGB if needed (for JPEG compatibility)
-                if img.mode == 'RGBA':
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1])
-                    img = background
-                elif img.mode not in ('RGB', 'L'):
-                    img = img.convert('RGB')
-                
-                width, height = img.size
-                logger.info(f"Original image size: {width}x{height}, file size: {len(image_data)} bytes")
-                
-                # Calculate new dimensions while maintaining aspect ratio
-                if width > max_size or height > max_size:
-                    ratio = min(max_size / width, max_size / height)
-                    new_width = int(width * ratio)
-                    new_height = int(height * ratio)
-                    
-                    # Resize using high-quality resampling
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    logger.info(f"Resized to: {new_width}x{new_height}")
-                
-                # Save with optimized quality
-                output_buffer = io.BytesIO()
-                
-                # Determine output format - prefer JPEG for better compression
-                if img.mode == 'L':
-                    # Grayscale - save as PNG to preserve quality
-                    img.save(output_buffer, format='PNG', optimize=True)
-                else:
-                    # Color image - save as JPEG with high quality
-                    img.save(output_buffer, format='JPEG', quality=85, optimize=True)
-                
-                resized_data = output_buffer.getvalue()
-                logger.info(f"Compressed file size: {len(resized_data)} bytes (reduction: {len(image_data) - len(resized_data)} bytes)")
-                
-                return resized_data
-                
-        except Exception as e:
-            logger.warning(f"Failed to resize image: {str(e)}, using original")
-            return image_data
-    
-    async def download_image(self, url: str, landmark_name: str) -> Optional[bytes]:
-        """Download image from Wikimedia Commons."""
+        budget = budget or self.download_budget
+        cached = self.image_cache.get_source(url) if self.image_cache is not None else None
+        if cached is not None:
+            content_hash = cached['content_hash']
+            if cached['fresh']:
+                fetched = self.fetch_cached(content_hash, landmark_name)
+                if fetched is not None:
+                    return fetched
+            if not self.image_cache.has_object(content_hash):
+                cached = None  # The download was evicted, so it can't be revalidated
+        
+        reserved = 0
+        download = None
         try:
             logger.info(f"Downloading image for {landmark_name}: {url}")
             
-            async with self.session.get(url) as response:
+            headers = {}
+            if cached is not None:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+            
+            async with self.session.get(url, headers=headers) as response:
+                if response.status == 304 and cached is not None:
+                    logger.info(f"Cached image for {landmark_name} is still current")
+                    self.image_cache.mark_validated(url)
+                    content_hash = cached['content_hash']
+                    return self.fetched_image(str(self.image_cache.object_path(content_hash)), content_hash)
+                
                 if response.status != 200:
                     logger.error(f"Failed to download {url}: HTTP {response.status}")
                     return None
@@ -144,41 +1060,128 @@ class LandmarkImageUploader:
                     logger.error(f"URL does not point to an image: {content_type}")
                     return None
                 
-                # Check file size (warn if very large, but still download and resize)
-                content_length = response.headers.get('content-length')
-                if content_length and int(content_length) > 50 * 1024 * 1024:
-                    logger.warning(f"Very large image download: {content_length} bytes - will resize after download")
-                
-                image_data = await response.read()
-                logger.info(f"Downloaded {len(image_data)} bytes for {landmark_name}")
-                
-                # Resize image if it's too large
-                resized_image_data = self.resize_image_if_needed(image_data)
+                # Check file size before downloading anything
+                content_length = int(response.headers.get('content-length') or 0)
+                if content_length > self.max_download_bytes:
+                    logger.error(f"Image for {landmark_name} is {content_length} bytes, "
+                                 f"over the {self.max_download_bytes} byte download limit")
+                    return None
                 
-                return resized_image_data
+                # Without a length, assume the worst case
+                reserved = await budget.acquire(content_length or self.max_download_bytes)
+                download = SpooledDownload()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    if download.size + len(chunk) > self.max_download_bytes:
+                        logger.error(f"Aborted download for {landmark_name} after "
+                                     f"{self.max_download_bytes} bytes (download limit)")
+                        return None
+                    download.write(chunk)
+                logger.info(f"Downloaded {download.size} bytes for {landmark_name}")
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+            
+            content_hash = download.sha256.hexdigest()
+            if self.image_cache is not None:
+                # Copying a large spooled file shouldn't block the event loop
+                size = await asyncio.to_thread(self.image_cache.write_object, content_hash, download.source())
+                self.image_cache.put_source(url, content_hash, size, etag, last_modified)
+            
+            # From here on transform_image (or release_fetched) owns the download and its budget
+            fetched = self.fetched_image(download.source(), content_hash, download, reserved, budget)
+            download, reserved = None, 0
+            return fetched
                 
         except Exception as e:
             logger.error(f"Error downloading image for {landmark_name}: {str(e)}")
             return None
+        finally:
+            if download is not None:
+                download.close()
+            if reserved:
+                await budget.release(reserved)
     
-    def get_file_extension(self, image_data: bytes, url: str = '', content_type: str = '') -> str:
-        """Get appropriate file extension for the image based on actual content."""
+    def fetch_cached(self, content_hash: str, landmark_name: str) -> Union[Dict, FetchedImage, None]:
+        """Downloaded content from the image cache: its processed image if cached, otherwise a FetchedImage."""
+        if self.image_cache is None:
+            return None
+        image = self.image_cache.get_processed(content_hash, self.processing_params)
+        if image is not None:
+            logger.info(f"Using cached image for {landmark_name}")
+            image['source_hash'] = content_hash
+            return image
+        if self.image_cache.has_object(content_hash):
+            logger.info(f"Using cached download for {landmark_name}")
+            return self.fetched_image(str(self.image_cache.object_path(content_hash)), content_hash)
+        return None
+    
+    def fetched_image(self, source: Union[bytes, str], content_hash: str, download: Optional[SpooledDownload] = None,
+                      reserved: int = 0, budget: Optional[MemoryBudget] = None) -> FetchedImage:
+        """A FetchedImage with the memory needed to process it estimated from the image header."""
+        fetched = FetchedImage(source, content_hash, download, reserved, budget)
+        if self.image_cache is not None:
+            # The source (or its cached copy) must stay on disk until release_fetched
+            self.image_cache.pin(content_hash)
+            fetched.pinned = True
         try:
-            # Try to detect format from image data
-            with Image.open(io.BytesIO(image_data)) as img:
-                if img.format:
-                    format_lower = img.format.lower()
-                    if format_lower in ['jpeg', 'jpg']:
-                        return 'jpg'
-                    elif format_lower == 'png':
-                        return 'png'
-                    elif format_lower == 'webp':
-                        return 'webp'
-                    elif format_lower == 'gif':
-                        return 'gif'
+            with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as img:
+                target = fit_size(img.size, self.processing_params['max_size']) or img.size
+                if img.width * img.height > BANDED_DECODE_PIXELS and can_decode_in_bands(img):
+                    fetched.decode_bytes = banded_decode_bytes(img.width, img.height, target)
+                    return fetched
+                fetched.decode_bytes = estimate_decode_bytes(img.width, img.height, img.format, img.mode,
+                                                             self.processing_params['max_size'],
+                                                             self.processing_params['fast_downscale'])
         except Exception:
-            # Fall back to URL/content-type detection
-            pass
+            # Let process_image report unreadable images; guess from the compressed size
+            size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+            fetched.decode_bytes = size * DECODE_RATIO
+        return fetched
+    
+    def estimate_landmark(self, landmark_data: Dict) -> int:
+        """Estimated memory to process a landmark's image before downloading it, from its metadata."""
+        width = landmark_data.get('original_width') or 0
+        height = landmark_data.get('original_height') or 0
+        if not width or not height:
+            width = height = MAX_IMAGE_SIZE  # Unknown: assume a full-size thumbnail
+        elif landmark_data.get('thumbnail_url'):
+            width, height = fit_size((width, height), MAX_IMAGE_SIZE) or (width, height)
+        return estimate_decode_bytes(width, height)
+    
+    async def transform_image(self, fetched: FetchedImage) -> Dict:
+        """Resize or re-encode a fetched image if needed, decoding it at most once, then release it."""
+        try:
+            return await self.process_content(fetched.source, fetched.content_hash)
+        except Exception as e:
+            logger.error(f"Error processing image: {str(e)}")
+            return {'data': b'', 'format': None, 'width': 0, 'height': 0, 'quality': None, 'derivatives': {}}
+        finally:
+            await self.release_fetched(fetched)
+    
+    async def transform_within_budget(self, fetched: FetchedImage) -> Dict:
+        """transform_image once enough estimated decode memory is free."""
+        # Large images wait until enough estimated memory is free
+        reserved = await self.decode_budget.acquire(fetched.decode_bytes)
+        try:
+            return await self.transform_image(fetched)
+        finally:
+            await self.decode_budget.release(reserved)
+    
+    async def release_fetched(self, fetched: FetchedImage) -> None:
+        """Delete a fetched image's spooled file, unpin it and return its share of the download budget."""
+        if fetched.pinned:
+            self.image_cache.unpin(fetched.content_hash)
+            fetched.pinned = False
+        if fetched.download is not None:
+            fetched.download.close()
+            fetched.download = None
+        if fetched.reserved:
+            await fetched.budget.release(fetched.reserved)
+            fetched.reserved = 0
+    
+    def get_file_extension(self, image_format: Optional[str], url: str = '', content_type: str = '') -> str:
+        """Get appropriate file extension for the image, preferring its actual (PIL) format."""
+        if image_format in UPLOAD_EXTENSIONS:
+            return UPLOAD_EXTENSIONS[image_format]
         
         # Try to get extension from URL
         if url:
@@ -208,8 +1211,74 @@ class LandmarkImageUploader:
         # Default to jpg (most common after processing)
         return 'jpg'
     
-    async def upload_image(self, image_data: bytes, landmark_data: Dict) -> bool:
-        """Upload image to the application's curated gallery."""
+    async def request_api(self, method: str, url: str, description: str,
+                          build_data: Optional[Callable[[], Any]] = None,
+                          recheck: Optional[Callable[[], Awaitable[Optional[Tuple[int, str]]]]] = None,
+                          **kwargs) -> Tuple[int, str]:
+        """Send an authenticated gallery API request, retrying transient failures.
+        
+        Responses with a RETRY_STATUSES status, timeouts and dropped connections are retried up
+        to max_retries times, after Retry-After (at most MAX_RETRY_DELAY) or an exponential
+        backoff with jitter. A 401 asks the token provider for a new token and replays the
+        request once. build_data makes the request body, as a fresh one is needed for every
+        attempt (aiohttp.FormData can only be sent once).
+        
+        A request other than GET that timed out, lost its connection or got a gateway error
+        (AMBIGUOUS_STATUSES) may still have taken effect, so it is only retried if recheck says
+        it didn't: recheck returns None when it is safe to retry, or the response to return
+        instead (the result the request had, or a failure if that can't be told). Without
+        recheck such requests aren't retried.
+        
+        Returns:
+            The last response's status (0 if there was none) and body text (or the error)
+        """
+        attempt = 0
+        refreshed = False
+        while True:
+            token = await self.token_provider.get_token(self.session)
+            retry_after = None
+            try:
+                async with self.session.request(method, url, data=build_data() if build_data else None,
+                                                headers={'Authorization': f'Bearer {token}'}, **kwargs) as response:
+                    status = response.status
+                    text = await response.text()
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, text = 0, str(e) or e.__class__.__name__
+            
+            if status == 401 and not refreshed:
+                refreshed = True
+                if await self.token_provider.refresh(self.session, token):
+                    logger.info(f"Retrying {description} with a refreshed auth token")
+                    continue
+            if (status and status not in RETRY_STATUSES) or attempt == self.max_retries:
+                return status, text
+            
+            maybe_applied = status in AMBIGUOUS_STATUSES and method != 'GET'
+            if maybe_applied and recheck is None:
+                return status, text
+            
+            delay = min(MAX_RETRY_DELAY, retry_after) if retry_after is not None else \
+                min(MAX_RETRY_DELAY, RETRY_BASE_DELAY * 2 ** attempt) * (0.5 + random.random())
+            attempt += 1
+            self.retries += 1
+            failure = f"HTTP {status}" if status else text
+            logger.warning(f"{description} failed ({failure}), retrying in {delay:.1f}s "
+                           f"(attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(delay)
+            
+            # Checked after the delay, so a request the server was still handling has finished
+            if maybe_applied:
+                applied = await recheck()
+                if applied is not None:
+                    return applied
+    
+    async def upload_image(self, image: Dict, landmark_data: Dict) -> Optional[Dict]:
+        """Upload a processed image (see process_image) to the application's curated gallery.
+        
+        Returns:
+            The server response on success (empty if it wasn't JSON), otherwise None
+        """
         try:
             landmark_name = landmark_data.get('landmark', 'Unknown')
             location = landmark_data.get('location', {})
@@ -221,11 +1290,11 @@ class LandmarkImageUploader:
             
             if lat is None or lon is None:
                 logger.error(f"Missing location data for {landmark_name}")
-                return False
+                return None
             
             # Create a temporary file for the image
             file_extension = self.get_file_extension(
-                image_data,
+                image['format'],
                 landmark_data.get('url', ''),
                 'image/jpeg'  # default
             )
@@ -235,111 +1304,514 @@ class LandmarkImageUploader:
             safe_name = safe_name.replace(' ', '_')
             filename = f"{safe_name}.{file_extension}"
             
-            # Prepare form data
-            form_data = aiohttp.FormData()
-            
-            # Add image file
-            form_data.add_field(
-                'image',
-                image_data,
-                filename=filename,
-                content_type=f'image/{file_extension}'
-            )
-            
-            # Add location data
-            location_json = json.dumps({
-                'lat': float(lat),
-                'lng': float(lon)  # Note: API expects 'lng' not 'lon'
-            })
-            form_data.add_field('location', location_json)
-            
-            # Add custom name (landmark name)
-            form_data.add_field('customName', landmark_name)
+            def build_form_data() -> aiohttp.FormData:
+                form_data = aiohttp.FormData()
+                
+                # Add image file
+                form_data.add_field(
+                    'image',
+                    image['data'],
+                    filename=filename,
+                    content_type=f'image/{file_extension}'
+                )
+                
+                # Add the smaller versions, which the server stores next to the image
+                for variant, derivative in image.get('derivatives', {}).items():
+                    derivative_extension = UPLOAD_EXTENSIONS[derivative['format']]
+                    form_data.add_field(
+                        variant,
+                        derivative['data'],
+                        filename=f"{safe_name}.{derivative_extension}",
+                        content_type=f'image/{derivative_extension}'
+                    )
+                
+                # Add location data
+                location_json = json.dumps({
+                    'lat': float(lat),
+                    'lng': float(lon)  # Note: API expects 'lng' not 'lon'
+                })
+                form_data.add_field('location', location_json)
+                
+                # Add custom name (landmark name)
+                form_data.add_field('customName', landmark_name)
+                
+                # Add source URL
+                if source_url:
+                    form_data.add_field('sourceUrl', source_url)
+                return form_data
             
-            # Add source URL
-            if source_url:
-                form_data.add_field('sourceUrl', source_url)
+            async def recheck_upload() -> Optional[Tuple[int, str]]:
+                # Without a source URL there's no telling whether a lost upload went through
+                if not source_url:
+                    return 0, "Upload may have gone through, not retrying it without a source URL to check"
+                uploaded = await self.find_uploaded(source_url)
+                if uploaded is None:
+                    return 0, "Upload may have gone through, and the gallery couldn't be checked"
+                if uploaded:
+                    logger.info(f"Upload of {landmark_name} went through despite the failed request")
+                    return 201, json.dumps({'success': True, 'imageUrl': uploaded.get('url'),
+                                            'thumbnailUrl': uploaded.get('thumbnailUrl'), 'metadata': uploaded})
+                return None
             
             logger.info(f"Uploading {landmark_name} to gallery...")
             
-            # Upload to the API
-            async with self.session.post(self.upload_url, data=form_data) as response:
-                response_text = await response.text()
-                
-                if response.status == 201:
-                    try:
-                        result = json.loads(response_text)
-                        logger.info(f"✅ Successfully uploaded {landmark_name}")
-                        logger.info(f"   Image URL: {result.get('imageUrl', 'N/A')}")
-                        return True
-                    except json.JSONDecodeError:
-                        logger.info(f"✅ Successfully uploaded {landmark_name} (non-JSON response)")
-                        return True
-                elif response.status == 401:
-                    logger.error(f"❌ Authentication failed for {landmark_name}: HTTP {response.status}")
-                    logger.error(f"   Your auth token may have expired. Get a fresh token and try again.")
-                    logger.error(f"   Run: node get-public-token.js")
-                    return False
-                else:
-                    logger.error(f"❌ Upload failed for {landmark_name}: HTTP {response.status}")
-                    logger.error(f"   Response: {response_text}")
-                    return False
-                    
+            # Upload to the API, retrying server errors and refreshing an expired token
+            status, response_text = await self.request_api('POST', self.upload_url, f"Upload of {landmark_name}",
+                                                            build_form_data, recheck_upload)
+            
+            if status == 201:
+                try:
+                    result = json.loads(response_text)
+                    logger.info(f"✅ Successfully uploaded {landmark_name}")
+                    logger.info(f"   Image URL: {result.get('imageUrl', 'N/A')}")
+                    derivative_keys = result.get('metadata', {}).get('derivatives', {})
+                    if derivative_keys:
+                        logger.info(f"   Derivatives: {', '.join(derivative_keys.values())}")
+                    return result
+                except json.JSONDecodeError:
+                    logger.info(f"✅ Successfully uploaded {landmark_name} (non-JSON response)")
+                    return {}
+            elif status == 401:
+                logger.error(f"❌ Authentication failed for {landmark_name}: HTTP {status}")
+                logger.error(f"   Your auth token may have expired and couldn't be refreshed. Get a fresh token")
+                logger.error(f"   (node get-public-token.js) or set SUPABASE_REFRESH_TOKEN, and try again.")
+                return None
+            else:
+                logger.error(f"❌ Upload failed for {landmark_name}: " + (f"HTTP {status}" if status else "no response"))
+                logger.error(f"   Response: {response_text}")
+                return None
+        
         except Exception as e:
             logger.error(f"❌ Error uploading {landmark_name}: {str(e)}")
-            return False
+            return None
+    
+    def get_download_urls(self, landmark_data: Dict) -> List[str]:
+        """URLs to try for a landmark's image: the thumbnail first if the original is larger than needed."""
+        image_url = landmark_data.get('url', '')
+        thumbnail_url = landmark_data.get('thumbnail_url', '')
+        original_size = max(landmark_data.get('original_width') or 0, landmark_data.get('original_height') or 0)
+        
+        # Results without dimensions still have a thumbnail no larger than MAX_IMAGE_SIZE
+        if thumbnail_url and thumbnail_url != image_url and (original_size == 0 or original_size > MAX_IMAGE_SIZE):
+            return [thumbnail_url, image_url] if image_url else [thumbnail_url]
+        return [image_url] if image_url else []
+    
+    def record_skipped(self, landmark_name: str, source_url: str, content_hash: Optional[str] = None) -> None:
+        """Count a landmark whose image is already in the gallery, and remember it as uploaded."""
+        self.skipped += 1
+        image_id = None
+        if content_hash:
+            image_id = self.manifest.by_content_hash.get(content_hash)
+            if source_url:
+                self.manifest.record(source_url, image_id, landmark=landmark_name, content_hash=content_hash)
+        else:
+            image_id = self.manifest.by_source_url.get(source_url)
+        if self.store is not None:
+            self.store.record_upload(landmark_name, image_id)
+        if self.journal is not None:
+            self.journal.record(landmark_name, source_url, 'uploaded', image_id=image_id, skipped=True)
+    
+    def record_outcome(self, landmark_data: Dict, outcome: Union[Tuple[bool, Optional[str]], Exception]) -> None:
+        """Journal a landmark that failed; successes are journaled by the stage that finished them."""
+        if self.journal is None or (not isinstance(outcome, Exception) and outcome[0]):
+            return
+        source_url = landmark_data.get('commons_url') or landmark_data.get('url', '')
+        error = str(outcome) if isinstance(outcome, Exception) else outcome[1]
+        self.journal.record(landmark_data.get('landmark', 'Unknown'), source_url, 'failed', error=error)
+    
+    async def find_uploaded(self, source_url: str) -> Optional[Dict]:
+        """The gallery's public image from a source URL: the image, {} if there is none, or None if the check failed."""
+        status, text = await self.request_api('GET', f"{self.base_url}/api/images/public",
+                                              f"Looking up {source_url}", params={'sourceUrl': source_url, 'limit': 1})
+        if status != 200:
+            return None
+        try:
+            images = json.loads(text).get('images', [])
+        except (json.JSONDecodeError, AttributeError):
+            return None
+        # Only an exact match counts, whatever the server's filtering
+        return next((image for image in images if image.get('sourceUrl') == source_url), {})
+    
+    async def seed_upload_manifest(self, page_size: int = MANIFEST_PAGE_SIZE) -> int:
+        """Add the gallery's public images to the upload manifest. Returns the number added."""
+        public_url = f"{self.base_url}/api/images/public"
+        added = 0
+        offset = 0
+        while True:
+            status, text = await self.request_api('GET', public_url, "Listing public images",
+                                                  params={'limit': page_size, 'offset': offset})
+            if status != 200:
+                logger.warning(f"Failed to list public images: " + (f"HTTP {status}" if status else text))
+                break
+            try:
+                page = json.loads(text)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Failed to list public images: {str(e)}")
+                break
+            
+            images = page.get('images', [])
+            added += self.manifest.record_many(images)
+            offset += len(images)
+            if not images or not page.get('hasMore'):
+                break
+        
+        logger.info(f"Upload manifest: {len(self.manifest)} known images ({added} new from {offset} public images)")
+        return added
     
     async def process_landmark(self, landmark_data: Dict) -> Tuple[bool, Optional[str]]:
         """Process a single landmark: download and upload.
         
+        run_pipeline runs the same steps for many landmarks with a separate number of
+        workers for each.
+        
         Returns:
             Tuple of (success: bool, error_message: Optional[str])
         """
+        outcome = await self.fetch_landmark(landmark_data)
+        if not is_outcome(outcome):
+            outcome = await self.transform_landmark(landmark_data, *outcome)
+        if not is_outcome(outcome):
+            outcome = await self.upload_landmark(landmark_data, outcome)
+        self.record_outcome(landmark_data, outcome)
+        return outcome
+    
+    async def fetch_landmark(self, landmark_data: Dict) -> Union[Tuple[bool, Optional[str]], Tuple[Union[Dict, FetchedImage], List[str]]]:
+        """Fetch stage: skip an already uploaded landmark or download its image.
+        
+        A landmark journaled by an earlier run is skipped if it was uploaded, and otherwise
+        resumes from its cached download or processed image.
+        
+        Returns:
+            The landmark's (success, error_message) if it's done, otherwise the fetched image
+            and the remaining download URLs to fall back on
+        """
         landmark_name = landmark_data.get('landmark', 'Unknown')
-        image_url = landmark_data.get('url', '')
+        source_url = landmark_data.get('commons_url') or landmark_data.get('url', '')
+        if self.manifest is not None and self.manifest.has_source(source_url):
+            logger.info(f"Skipping {landmark_name}: already uploaded")
+            self.record_skipped(landmark_name, source_url)
+            return True, None
+        
+        entry = self.journal.get(landmark_name, source_url) if self.journal is not None else None
+        if entry is not None and entry['stage'] == 'uploaded':
+            logger.info(f"Skipping {landmark_name}: uploaded by an earlier run")
+            self.skipped += 1
+            if self.store is not None:
+                self.store.record_upload(landmark_name, entry.get('image_id'), entry.get('image_url'))
+            return True, None
         
-        if not image_url:
+        download_urls = self.get_download_urls(landmark_data)
+        
+        if not download_urls:
             error_msg = f"No image URL for {landmark_name}"
             logger.error(error_msg)
             return False, error_msg
         
-        # Download the image
-        image_data = await self.download_image(image_url, landmark_name)
-        if not image_data:
-            error_msg = f"Failed to download image for {landmark_name}"
-            return False, error_msg
+        # Resume from the download (or processed image) of an earlier run, without revalidating it
+        if entry is not None and entry.get('content_hash'):
+            fetched = self.fetch_cached(entry['content_hash'], landmark_name)
+            if fetched is not None:
+                url = entry.get('url')
+                return fetched, download_urls[download_urls.index(url) + 1:] if url in download_urls else []
+        
+        # Download the image, falling back to the original if the thumbnail isn't available
+        for i, image_url in enumerate(download_urls):
+            fetched = await self.fetch_image(image_url, landmark_name)
+            if fetched is not None:
+                if self.journal is not None and isinstance(fetched, FetchedImage):
+                    self.journal.record(landmark_name, source_url, 'downloaded', url=image_url,
+                                        content_hash=fetched.content_hash)
+                return fetched, download_urls[i + 1:]
+        return False, f"Failed to download image for {landmark_name}"
+    
+    async def transform_landmark(self, landmark_data: Dict, fetched: Union[Dict, FetchedImage],
+                                 fallback_urls: List[str]) -> Union[Tuple[bool, Optional[str]], Dict]:
+        """Transform stage: process a fetched image for upload.
         
-        # Upload to gallery
-        success = await self.upload_image(image_data, landmark_data)
-        if success:
+        Returns:
+            The landmark's (success, error_message) if it's done, otherwise the processed image
+        """
+        landmark_name = landmark_data.get('landmark', 'Unknown')
+        image = fetched
+        if isinstance(fetched, FetchedImage):
+            image = await self.transform_within_budget(fetched)
+        
+        # An image that can't be processed is rare enough to fall back outside the pipeline,
+        # downloading against the fallback budget so this worker never waits on the fetch stage
+        for image_url in fallback_urls:
+            if image and image['data']:
+                break
+            image = await self.download_image(image_url, landmark_name, self.fallback_budget)
+        if not image or not image['data']:
+            return False, f"Failed to download or process image for {landmark_name}"
+        
+        # The same file may have been uploaded from another URL
+        content_hash = image.get('source_hash')
+        if self.manifest is not None and content_hash and self.manifest.has_content(content_hash):
+            logger.info(f"Skipping {landmark_name}: the same image was already uploaded")
+            source_url = landmark_data.get('commons_url') or landmark_data.get('url', '')
+            self.record_skipped(landmark_name, source_url, content_hash)
+            return True, None
+        
+        if self.journal is not None:
+            source_url = landmark_data.get('commons_url') or landmark_data.get('url', '')
+            self.journal.record(landmark_name, source_url, 'processed', content_hash=content_hash,
+                                format=image['format'], width=image['width'], height=image['height'],
+                                size=len(image['data']))
+        return image
+    
+    async def upload_landmark(self, landmark_data: Dict, image: Dict) -> Tuple[bool, Optional[str]]:
+        """Upload stage: upload a processed image and record it."""
+        landmark_name = landmark_data.get('landmark', 'Unknown')
+        source_url = landmark_data.get('commons_url') or landmark_data.get('url', '')
+        upload_result = await self.upload_image(image, landmark_data)
+        if upload_result is not None:
+            image_id = upload_result.get('metadata', {}).get('id')
+            image_url = upload_result.get('imageUrl')
+            if self.store is not None:
+                self.store.record_upload(landmark_name, image_id, image_url)
+            if self.manifest is not None and source_url:
+                self.manifest.record(source_url, image_id, image_url, landmark_name, image.get('source_hash'))
+            if self.journal is not None:
+                self.journal.record(landmark_name, source_url, 'uploaded', image_id=image_id, image_url=image_url)
             return True, None
         else:
             error_msg = f"Failed to upload {landmark_name} to gallery"
             return False, error_msg
+    
+    async def run_pipeline(self, landmarks: Union[Iterable[Dict], AsyncIterable[Dict]],
+                           fetch_workers: int = FETCH_WORKERS, transform_workers: Optional[int] = None,
+                           upload_workers: int = UPLOAD_WORKERS,
+                           on_result: Optional[Callable[[Dict, Any], None]] = None,
+                           schedule_window: int = SCHEDULE_WINDOW) -> int:
+        """Process landmarks in fetch, transform and upload stages connected by bounded queues.
+        
+        Each stage has its own workers, so downloads, resizing and uploads overlap, and a full
+        queue holds back the stage feeding it. Transform workers default to the number of
+        image worker processes.
+        
+        Landmarks may come from a list or be streamed (see iter_landmark_data); they are only
+        read as fast as the pipeline takes them, so memory is bounded by schedule_window and the
+        queues rather than the input size.
+        
+        Work is scheduled shortest job first. While the fetch queue is full, up to
+        schedule_window landmarks wait to enter it, smallest estimated processing memory
+        first, and each queue hands out its smallest item (by decode estimate or upload
+        size). Large images are also held back by the decode budget, so small ones keep
+        flowing past them.
+        
+        Args:
+            on_result: Called with each landmark and its (success, error_message), or the
+                exception it raised, as soon as it's done
+        
+        Returns:
+            The number of landmarks processed
+        """
+        transform_workers = transform_workers or self.image_workers
+        stages = [
+            ('fetch', fetch_workers, lambda item: self.fetch_landmark(item[0])),
+            ('transform', transform_workers, lambda item: self.transform_landmark(item[0], *item[1])),
+            ('upload', upload_workers, lambda item: self.upload_landmark(item[0], item[1]))
+        ]
+        # Room for each worker's next item, so workers rarely wait on the previous stage.
+        # Entries are (cost, sequence, entry); stop markers cost infinity so they come out last.
+        queues = [asyncio.PriorityQueue(maxsize=2 * workers) for _, workers, _ in stages]
+        stats = [StageStats(name, queue) for (name, _, _), queue in zip(stages, queues)]
+        fed = 0
+        finish_times = []  # Seconds from the start until each landmark was done
+        sequence = itertools.count()
+        pipeline_start = time.perf_counter()
+        
+        def cost(stage: int, output: Any) -> int:
+            if stage == 1:
+                fetched = output[0]
+                return fetched.decode_bytes if isinstance(fetched, FetchedImage) else 0
+            return len(output['data'])
+        
+        async def worker(stage: int) -> None:
+            _, _, handle = stages[stage]
+            while True:
+                _, _, item = await queues[stage].get()
+                if item is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    output = await handle(item)
+                except Exception as e:
+                    output = e
+                stats[stage].record(time.perf_counter() - start)
+                
+                # A landmark is done when a stage fails or returns its outcome
+                if isinstance(output, Exception) or is_outcome(output):
+                    self.record_outcome(item[0], output)
+                    if on_result is not None:
+                        on_result(item[0], output)
+                    finish_times.append(time.perf_counter() - pipeline_start)
+                else:
+                    await queues[stage + 1].put((cost(stage + 1, output), next(sequence), (item[0], output)))
+                    stats[stage + 1].observe_depth()
+        
+        async def run_stage(stage: int) -> None:
+            _, workers, _ = stages[stage]
+            await asyncio.gather(*(worker(stage) for _ in range(workers)))
+            if stage + 1 < len(stages):
+                # Stop the next stage's workers once everything before them is done
+                for _ in range(stages[stage + 1][1]):
+                    await queues[stage + 1].put((math.inf, next(sequence), None))
+        
+        async def put_fetch(entry: Tuple[int, int, Dict]) -> None:
+            estimate, _, landmark_data = entry
+            await queues[0].put((estimate, next(sequence), (landmark_data,)))
+            stats[0].observe_depth()
+        
+        async def feed() -> None:
+            nonlocal fed
+            window = []  # Heap of (estimate, input position, landmark)
+            stream = landmarks if isinstance(landmarks, AsyncIterable) else iterate(landmarks)
+            async for landmark_data in stream:
+                heapq.heappush(window, (self.estimate_landmark(landmark_data), fed, landmark_data))
+                fed += 1
+                # Landmarks only wait in the window while the fetch queue is full (or it's full itself)
+                while window and (not queues[0].full() or len(window) >= schedule_window):
+                    await put_fetch(heapq.heappop(window))
+            while window:
+                await put_fetch(heapq.heappop(window))
+            for _ in range(fetch_workers):
+                await queues[0].put((math.inf, next(sequence), None))
+        
+        try:
+            await asyncio.gather(feed(), *(run_stage(stage) for stage in range(len(stages))))
+        finally:
+            # Release downloads stranded in the transform queue if the pipeline was cancelled
+            while not queues[1].empty():
+                _, _, item = queues[1].get_nowait()
+                if item is not None and isinstance(item[1][0], FetchedImage):
+                    await self.release_fetched(item[1][0])
+        
+        for stage_stats in stats:
+            logger.info(stage_stats.summary())
+        if finish_times:
+            finish_times.sort()
+            logger.info(f"Landmarks done after {finish_times[len(finish_times) // 2]:.1f}s (median), "
+                        f"{finish_times[-1]:.1f}s (last); estimated decode memory peak "
+                        f"{self.decode_budget.peak / 2 ** 20:.0f}/{self.decode_budget.max_bytes / 2 ** 20:.0f} MB")
+        return fed
 
-async def load_landmark_data(json_file: str) -> List[Dict]:
-    """Load landmark data from JSON file."""
+async def iter_json_array(f, chunk_size: int = INPUT_CHUNK_SIZE) -> AsyncIterator[Any]:
+    """Parse the elements of a JSON array from an open (aiofiles) text file one at a time.
+    
+    The file is read in chunks and each element is decoded as soon as it's complete, so only
+    the current chunk and element are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    at_end = False
+    state = 'start'  # 'start': before '['; 'first': after '['; 'next': after an element; 'element': after ','
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError("JSON file should contain a list of landmarks")
+                position += 1
+                state = 'first'
+                continue
+            if char == ']' and state in ('first', 'next'):
+                return
+            if state == 'next':
+                if char != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                position += 1
+                state = 'element'
+                continue
+            
+            # An element is only complete once the delimiter after it has been read: a number
+            # cut off at the end of the buffer (1.5 of 1.5e3) would otherwise decode early
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if at_end:
+                    raise
+                end = None
+            if end is not None:
+                following = end
+                while following < len(buffer) and buffer[following].isspace():
+                    following += 1
+                if at_end or (following < len(buffer) and buffer[following] in ',]'):
+                    yield value
+                    position = end
+                    state = 'next'
+                    continue
+        elif at_end:
+            raise ValueError("JSON file ended before its list of landmarks")
+        
+        chunk = await f.read(chunk_size)
+        at_end = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+async def iter_json_lines(f, source: str, chunk_size: int = INPUT_CHUNK_SIZE) -> AsyncIterator[Any]:
+    """Parse a JSON Lines file from an open (aiofiles) text file, skipping (and logging) malformed lines.
+    
+    Read in chunks rather than by line, as every aiofiles read is a round trip to a thread.
+    """
+    line_number = 0
+    partial_line = ''
+    while True:
+        chunk = await f.read(chunk_size)
+        lines = (partial_line + chunk).split('\n')
+        partial_line = lines.pop() if chunk else ''
+        for line in lines:
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid JSON on line {line_number} of {source}: {str(e)}")
+        if not chunk:
+            return
+
+async def iter_landmark_data(json_file: str) -> AsyncIterator[Dict]:
+    """Stream landmark data from a JSON or JSON Lines file, or the not yet uploaded results of a results store.
+    
+    Landmarks are yielded as they are parsed, so uploads can start before the whole file has
+    been read and memory doesn't grow with its size. A malformed landmark in a JSON Lines file
+    is skipped; an error elsewhere ends the stream after the landmarks before it.
+    """
+    if json_file.endswith(STORE_SUFFIXES):
+        store = LandmarkResultsStore(json_file)
+        try:
+            count = 0
+            for landmark_data in store.pending_uploads():
+                count += 1
+                yield landmark_data
+        finally:
+            store.close()
+        logger.info(f"Read {count} landmarks not yet uploaded from {json_file}")
+        return
+    
+    count = 0
     try:
         async with aiofiles.open(json_file, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            data = json.loads(content)
-            
-        if not isinstance(data, list):
-            logger.error("JSON file should contain a list of landmarks")
-            return []
+            elements = iter_json_lines(f, json_file) if json_file.endswith(JSON_LINES_SUFFIXES) else iter_json_array(f)
+            async for landmark_data in elements:
+                if isinstance(landmark_data, dict):
+                    count += 1
+                    yield landmark_data
         
-        logger.info(f"Loaded {len(data)} landmarks from {json_file}")
-        return data
+        logger.info(f"Read {count} landmarks from {json_file}")
         
     except FileNotFoundError:
         logger.error(f"File not found: {json_file}")
-        return []
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in {json_file}: {str(e)}")
-        return []
+    except ValueError as e:
+        # json.JSONDecodeError included
+        logger.error(f"Invalid JSON in {json_file} after {count} landmarks: {str(e)}")
     except Exception as e:
         logger.error(f"Error loading {json_file}: {str(e)}")
-        return []
 
 async def save_failed_landmarks(failed_landmarks: List[Dict], output_file: str) -> None:
     """Save failed landmarks to a JSON file."""
@@ -350,36 +1822,31 @@ async def save_failed_landmarks(failed_landmarks: List[Dict], output_file: str)
     except Exception as e:
         logger.error(f"Failed to save failed landmarks: {str(e)}")
 
-async def upload_landmarks(landmarks: List[Dict], auth_token: str, max_concurrent: int = 3) -> None:
-    """Upload all landmarks with controlled concurrency."""
-    if not landmarks:
-        logger.error("No landmarks to upload")
-        return
-    
-    logger.info(f"Starting upload of {len(landmarks)} landmarks...")
-    
-    # Create semaphore to limit concurrent uploads
-    semaphore = asyncio.Semaphore(max_concurrent)
+async def upload_landmarks(landmarks: Union[Iterable[Dict], AsyncIterable[Dict]], auth_token: str,
+                           fetch_workers: int = FETCH_WORKERS,
+                           upload_workers: int = UPLOAD_WORKERS, store: Optional[LandmarkResultsStore] = None,
+                           image_workers: Optional[int] = None, **uploader_options) -> None:
+    """Upload all landmarks through the fetch, transform and upload pipeline (see run_pipeline).
     
-    async def upload_with_semaphore(uploader: LandmarkImageUploader, landmark_data: Dict) -> Tuple[bool, Optional[str]]:
-        async with semaphore:
-            return await uploader.process_landmark(landmark_data)
+    Images are resized by image_workers processes (default: one per core), each fed by one
+    transform worker; fetch_workers downloads and upload_workers uploads run at the same
+    time. Extra keyword arguments (max_download_bytes, ...) are passed to LandmarkImageUploader.
+    Landmarks may be a list or streamed from iter_landmark_data.
+    """
+    count = f"{len(landmarks)} " if isinstance(landmarks, list) else ""
+    logger.info(f"Starting upload of {count}landmarks...")
     
     # Track failed landmarks
     failed_landmarks = []
-    
-    # Upload all landmarks
-    async with LandmarkImageUploader(auth_token) as uploader:
-        tasks = [upload_with_semaphore(uploader, landmark) for landmark in landmarks]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Process results and collect failures
     successful = 0
-    for i, result in enumerate(results):
+    
+    def on_result(landmark_data: Dict, result: Any) -> None:
+        """Count a finished landmark and collect it if it failed."""
+        nonlocal successful
         if isinstance(result, Exception):
-            logger.error(f"Exception processing {landmarks[i].get('landmark', 'Unknown')}: {str(result)}")
+            logger.error(f"Exception processing {landmark_data.get('landmark', 'Unknown')}: {str(result)}")
             failed_landmarks.append({
-                **landmarks[i],
+                **landmark_data,
                 'error': str(result),
                 'error_type': 'exception'
             })
@@ -389,7 +1856,7 @@ async def upload_landmarks(landmarks: List[Dict], auth_token: str, max_concurren
                 successful += 1
             else:
                 failed_landmarks.append({
-                    **landmarks[i],
+                    **landmark_data,
                     'error': error_message or 'Unknown error',
                     'error_type': 'processing_failed'
                 })
@@ -399,12 +1866,27 @@ async def upload_landmarks(landmarks: List[Dict], auth_token: str, max_concurren
                 successful += 1
             else:
                 failed_landmarks.append({
-                    **landmarks[i],
+                    **landmark_data,
                     'error': 'Upload failed',
                     'error_type': 'upload_failed'
                 })
     
-    failed = len(results) - successful
+    # Upload all landmarks
+    async with LandmarkImageUploader(auth_token, store=store, image_workers=image_workers,
+                                     **uploader_options) as uploader:
+        if uploader.journal is not None and len(uploader.journal):
+            progress = ', '.join(f"{count} {stage}" for stage, count in sorted(uploader.journal.counts().items()))
+            logger.info(f"Resuming from upload journal {uploader.journal.journal.path}: {progress}")
+        if uploader.manifest is not None:
+            await uploader.seed_upload_manifest()
+        total = await uploader.run_pipeline(landmarks, fetch_workers, upload_workers=upload_workers,
+                                            on_result=on_result)
+    
+    if not total:
+        logger.error("No landmarks to upload")
+        return
+    
+    failed = total - successful
     
     # Save failed landmarks to JSON file if there are any
     if failed_landmarks:
@@ -412,10 +1894,13 @@ async def upload_landmarks(landmarks: List[Dict], auth_token: str, max_concurren
         await save_failed_landmarks(failed_landmarks, failed_file)
     
     logger.info(f"\n=== Upload Summary ===")
-    logger.info(f"Total landmarks: {len(landmarks)}")
-    logger.info(f"Successfully uploaded: {successful}")
+    logger.info(f"Total landmarks: {total}")
+    logger.info(f"Successfully uploaded: {successful - uploader.skipped}")
+    logger.info(f"Already uploaded (skipped): {uploader.skipped}")
     logger.info(f"Failed uploads: {failed}")
-    logger.info(f"Success rate: {successful/len(landmarks)*100:.1f}%")
+    if uploader.retries or uploader.token_provider.refreshes:
+        logger.info(f"Retried requests: {uploader.retries}, auth token refreshes: {uploader.token_provider.refreshes}")
+    logger.info(f"Success rate: {successful/total*100:.1f}%")
     
     if failed_landmarks:
         logger.info(f"Failed landmarks saved to: failed_landmark_uploads.json")
@@ -423,11 +1908,13 @@ async def upload_landmarks(landmarks: List[Dict], auth_token: str, max_concurren
 
 def print_usage():
     """Print usage instructions."""
-    print("Usage: python upload_landmark_images.py [json_file] [auth_token]")
+    print("Usage: python upload_landmark_images.py [json_file] [auth_token] [--webp]")
     print("")
     print("Arguments:")
-    print("  json_file   - Path to landmark_images.json file")
+    print("  json_file   - Path to landmark_images.json file, a JSON Lines (.jsonl) file with one landmark per")
+    print("                line, or a .db results store from find_photo.py --store")
     print("  auth_token  - Supabase JWT authentication token for the public user")
+    print("  --webp      - Re-encode resized images as WebP instead of JPEG")
     print("")
     print("Example:")
     print("  python upload_landmark_images.py public_images/landmark_images.json 'eyJ0eXAi...'")
@@ -445,7 +1932,11 @@ def print_usage():
     print("    4. Find 'sb-[project-id]-auth-token' item")
     print("    5. Copy the 'access_token' value from the JSON")
     print("")
-    print("Note: Tokens expire after ~1 hour, so get a fresh token if uploads fail with 401 errors")
+    print("Note: Tokens expire after ~1 hour. To have them refreshed during long runs, set")
+    print("      PUBLIC_SUPABASE_URL and PUBLIC_SUPABASE_ANON_KEY, plus SUPABASE_REFRESH_TOKEN (from the")
+    print("      same session as the token) or SUPABASE_EMAIL and SUPABASE_PASSWORD for the public user")
+    print("")
+    print("An interrupted or failed run resumes where it stopped when run again on the same file.")
 
 def validate_auth_token(token: str) -> bool:
     """Validate that the auth token looks like a JWT token."""
@@ -478,12 +1969,14 @@ def validate_auth_token(token: str) -> bool:
 
 async def main():
     """Main function."""
-    if len(sys.argv) < 3:
+    args = [arg for arg in sys.argv[1:] if arg != '--webp']
+    if len(args) < 2:
         print_usage()
         sys.exit(1)
     
-    json_file = sys.argv[1]
-    auth_token = sys.argv[2]
+    json_file = args[0]
+    auth_token = args[1]
+    processing_params = {'output_format': 'WEBP'} if '--webp' in sys.argv else None
     
     if not Path(json_file).exists():
         logger.error(f"File not found: {json_file}")
@@ -494,13 +1987,30 @@ async def main():
         print_usage()
         sys.exit(1)
     
-    # Load landmark data
-    landmarks = await load_landmark_data(json_file)
-    if not landmarks:
+    # Refresh expiring tokens when the Supabase project and a way to get a new token are configured
+    token_provider = None
+    supabase_url = os.environ.get('PUBLIC_SUPABASE_URL')
+    anon_key = os.environ.get('PUBLIC_SUPABASE_ANON_KEY')
+    refresh_token = os.environ.get('SUPABASE_REFRESH_TOKEN')
+    email, password = os.environ.get('SUPABASE_EMAIL'), os.environ.get('SUPABASE_PASSWORD')
+    if supabase_url and anon_key and (refresh_token or (email and password)):
+        token_provider = SupabaseTokenProvider(supabase_url, anon_key, auth_token, refresh_token, email, password)
+        logger.info("Auth token will be refreshed when it expires")
+    
+    # Landmarks are streamed from the file while uploading; read the first to check there are any
+    landmark_stream = iter_landmark_data(json_file)
+    first_landmark = await anext(landmark_stream, None)
+    if first_landmark is None:
+        logger.error("No landmarks to upload")
         sys.exit(1)
     
+    async def landmarks() -> AsyncIterator[Dict]:
+        yield first_landmark
+        async for landmark_data in landmark_stream:
+            yield landmark_data
+    
     # Ask for confirmation
-    print(f"\nAbout to upload {len(landmarks)} landmark images to the curated gallery.")
+    print(f"\nAbout to upload the landmark images in {json_file} to the curated gallery.")
     print("This will download images from Wikimedia Commons and upload them to your app.")
     print("")
     
@@ -513,8 +2023,23 @@ async def main():
         print("\nUpload cancelled.")
         sys.exit(0)
     
-    # Upload landmarks
-    await upload_landmarks(landmarks, auth_token)
+    # Upload landmarks, recording successes in the results store if one was given
+    store = LandmarkResultsStore(json_file) if json_file.endswith(STORE_SUFFIXES) else None
+    image_cache = ImageCache()
+    manifest = UploadManifest()
+    journal = UploadJournal(upload_journal_path_for(json_file))
+    try:
+        await upload_landmarks(landmarks(), auth_token, store=store, image_cache=image_cache,
+                               processing_params=processing_params, manifest=manifest, journal=journal,
+                               token_provider=token_provider)
+    finally:
+        journal.compact()
+        manifest.close()
+        if store is not None:
+            store.close()
+        if image_cache.hits:
+            logger.info(f"Reused {image_cache.hits} processed images from {image_cache.cache_dir}")
+        image_cache.close()
 
 if __name__ == "__main__":
     try: